@@ -6,7 +6,6 @@
 import neuraltda.topology2 as tp2
 from ephys import core, events
 import pandas as pd
-from joblib import Parallel, delayed
 
 
 # In[2]:
@@ -14,7 +13,7 @@ from joblib import Parallel, delayed
 winSizes = [2.0, 5.0, 10.0, 15.0, 25.0, 50.0, 100.0]
 
 povers = 0.5
-njobs = 10
+dtOverlaps = [winSize*povers for winSize in winSizes]
 
 
 # In[3]:
@@ -28,7 +27,7 @@ blockPath='./'
 
 print('Binning Entire Trials...')
 segmentInfo = [0, 0] 
-Parallel(n_jobs=njobs)(delayed(tp2.dag_bin)(blockPath, winSize, segmentInfo, dt_overlap=winSize*povers, cluster_group=['Good', 'MUA']) for winSize in winSizes)
+tp2.bin_data_multi(blockPath, winSizes, segmentInfo, dt_overlaps=dtOverlaps, cluster_group=['Good', 'MUA'])
 
 
 # # Correct / Incorrect Trials
@@ -45,8 +44,8 @@ clusters = core.load_clusters(blockPath)
 correctTrials = trials[trials['correct']==True]
 incorrectTrials = trials[trials['correct']==False]
 
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, correctTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='correct') for winSize in winSizes)
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, incorrectTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='incorrect') for winSize in winSizes)
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, correctTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='correct')
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, incorrectTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='incorrect')
 
 
 # # Active listening
@@ -62,7 +61,7 @@ clusters = core.load_clusters(blockPath)
 
 activeTrials = trials[pd.notnull(trials['response'])]
 
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, activeTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='ActiveListening') for winSize in winSizes)
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, activeTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='ActiveListening')
 
 
 # # Sample / Distractor
@@ -71,7 +70,7 @@ Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, activeTri
 
 print('Binning Sample/Distractor Period for all trials...')
 segmentInfo = [2500, 0] 
-Parallel(n_jobs=njobs)(delayed(tp2.dag_bin)(blockPath, winSize, segmentInfo, dt_overlap=winSize*povers, cluster_group=['Good', 'MUA'], comment='SampleDistractor') for winSize in winSizes)
+tp2.bin_data_multi(blockPath, winSizes, segmentInfo, dt_overlaps=dtOverlaps, cluster_group=['Good', 'MUA'], comment='SampleDistractor')
 
 
 # # Target
@@ -80,7 +79,7 @@ Parallel(n_jobs=njobs)(delayed(tp2.dag_bin)(blockPath, winSize, segmentInfo, dt_
 
 print('Binning Target Period for All Trials...')
 segmentInfo = [0, -2500.0] 
-Parallel(n_jobs=njobs)(delayed(tp2.dag_bin)(blockPath, winSize, segmentInfo, dt_overlap=winSize*povers, cluster_group=['Good', 'MUA'], comment='Target') for winSize in winSizes)
+tp2.bin_data_multi(blockPath, winSizes, segmentInfo, dt_overlaps=dtOverlaps, cluster_group=['Good', 'MUA'], comment='Target')
 
 
 # # Sample/Distractor Correct/Incorrect
@@ -97,8 +96,8 @@ clusters = core.load_clusters(blockPath)
 correctTrials = trials[trials['correct']==True]
 incorrectTrials = trials[trials['correct']==False]
 
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, correctTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='correct') for winSize in winSizes)
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, incorrectTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='incorrect') for winSize in winSizes)
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, correctTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='correct')
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, incorrectTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='incorrect')
 
 
 # # Target Correct/Incorrect
@@ -115,8 +114,8 @@ clusters = core.load_clusters(blockPath)
 correctTrials = trials[trials['correct']==True]
 incorrectTrials = trials[trials['correct']==False]
 
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, correctTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='correct') for winSize in winSizes)
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, incorrectTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='incorrect') for winSize in winSizes)
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, correctTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='correct')
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, incorrectTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='incorrect')
 
 print('Binning Active Listening Trials SD...')
 segmentInfo = [2500, 0] 
@@ -127,7 +126,7 @@ clusters = core.load_clusters(blockPath)
 
 activeTrials = trials[pd.notnull(trials['response'])]
 
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, activeTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='ActiveListening-SD') for winSize in winSizes)
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, activeTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='ActiveListening-SD')
 
 print('Binning Active Listening Trials SD...')
 segmentInfo = [0, -2500] 
@@ -138,7 +137,7 @@ clusters = core.load_clusters(blockPath)
 
 activeTrials = trials[pd.notnull(trials['response'])]
 
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, activeTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='ActiveListening-Targ') for winSize in winSizes)
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, activeTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='ActiveListening-Targ')
 
 print('Binning Passive Listening Trials SD...')
 segmentInfo = [2500, 0] 
@@ -149,7 +148,7 @@ clusters = core.load_clusters(blockPath)
 
 activeTrials = trials[pd.isnull(trials['response'])]
 
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, activeTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='PassiveListening-SD') for winSize in winSizes)
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, activeTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='PassiveListening-SD')
 
 print('Binning Passive Listening Trials Targ...')
 segmentInfo = [0, -2500] 
@@ -160,4 +159,4 @@ clusters = core.load_clusters(blockPath)
 
 activeTrials = trials[pd.isnull(trials['response'])]
 
-Parallel(n_jobs=njobs)(delayed(tp2.do_dag_bin_lazy)(blockPath, spikes, activeTrials, clusters, fs, winSize, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlap=povers*winSize, comment='PassiveListening-Targ') for winSize in winSizes)
+tp2.do_dag_bin_multi_lazy(blockPath, spikes, activeTrials, clusters, fs, winSizes, segmentInfo, cluster_group=['Good', 'MUA'], dt_overlaps=dtOverlaps, comment='PassiveListening-Targ')
@@ -0,0 +1,63 @@
+# Benchmark the vectorized population tensor binning against the
+# per-spike loop it replaced (loop_activity_tensor in tests/test_binning.py)
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import neuraltda.topology2 as tp2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'tests'))
+from test_binning import loop_activity_tensor
+
+# Synthetic recording parameters
+fs = 24000.0
+ncells = 200
+ntrials = 20
+trial_len = 6.0         # seconds
+gap = 2.0               # seconds of silence between trials
+rate = 10.0             # Hz per cell
+win_size = 10.0         # milliseconds
+dt_overlap = 5.0        # milliseconds
+segment_info = [0, 0]
+
+# Generate Poisson spikes over the whole recording
+trial_samps = int(trial_len*fs)
+gap_samps = int(gap*fs)
+trial_starts = (trial_samps + gap_samps)*np.arange(ntrials) + gap_samps
+total = int(trial_starts[-1] + trial_samps + gap_samps)
+nspikes = np.random.poisson(rate*ncells*total/fs)
+spikes = pd.DataFrame({'cluster': np.random.randint(0, ncells, nspikes),
+                       'time_samples': np.sort(np.random.randint(0, total,
+                                                                 nspikes)),
+                       'recording': np.zeros(nspikes, dtype=int)})
+trials = pd.DataFrame({'time_samples': trial_starts,
+                       'stimulus_end': trial_starts + trial_samps,
+                       'stimulus': ntrials*['benchmark_stimulus'],
+                       'recording': np.zeros(ntrials, dtype=int)})
+clusters_list = np.arange(ncells)
+print('{} spikes, {} cells, {} trials'.format(nspikes, ncells, ntrials))
+
+subwin_len = int(np.round(win_size/1000. * fs))
+noverlap = int(np.round(dt_overlap/1000. * fs))
+segment = tp2.get_segment([0, trial_samps], fs, segment_info)
+
+t0 = time.time()
+poptens_new = tp2.build_activity_tensor_quick(trials, spikes, clusters_list,
+                                              ncells, win_size, subwin_len,
+                                              noverlap, segment)
+t_new = time.time() - t0
+
+t0 = time.time()
+poptens_old = loop_activity_tensor(trials, spikes, clusters_list, ncells,
+                                   win_size, subwin_len, noverlap, segment)
+t_old = time.time() - t0
+
+assert np.array_equal(poptens_new, poptens_old)
+print('Per-spike loop: {:.3f} s'.format(t_old))
+print('Vectorized:     {:.3f} s'.format(t_new))
+print('Speedup:        {:.1f}x'.format(t_old / t_new))
@@ -0,0 +1,85 @@
+# Benchmark trial-parallel workers receiving a loaded population tensor
+# against workers receiving a memory-mapped tensor (open_population_memmap),
+# and against the same tensor mapped in the cell major order of the binned
+# files, where every trial touches every page.
+# Reports total time for a trivial per trial task and the largest RSS of
+# a worker while it holds its trial, above the RSS of an idle worker
+# (Linux: read from /proc/self/statm).
+
+import os
+import time
+import resource
+import tempfile
+
+import numpy as np
+import h5py
+from joblib import Parallel, delayed
+
+import neuraltda.topology2 as tp2
+
+ncells = 200
+nwins = 2000
+ntrials = 40
+njobs = 8
+stim = 'benchmark_stimulus'
+
+def worker_rss():
+    # Current resident set size in MB
+    with open('/proc/self/statm', 'r') as f:
+        return int(f.read().split()[1])*resource.getpagesize()/1e6
+
+def trial_task(poptens, trial, trial_major):
+    # Touch the trial slice only
+    if trial_major:
+        popmat = np.array(poptens[trial])
+    else:
+        popmat = np.array(poptens[:, :, trial])
+    return (popmat.sum(), worker_rss())
+
+def run(poptens, label, trial_major=True):
+    t0 = time.time()
+    res = Parallel(n_jobs=njobs, max_nbytes=None)(delayed(trial_task)
+                                                  (poptens, trial,
+                                                   trial_major)
+                                                  for trial in range(ntrials))
+    dt = time.time() - t0
+    peak = max(r[1] for r in res) - idle_rss
+    print('{:<10} {:.3f} s   worker RSS above idle {:.1f} MB'.format(label, dt,
+                                                                   peak))
+    return np.array([r[0] for r in res])
+
+# Start the workers and measure their RSS without data
+idle_rss = max(Parallel(n_jobs=njobs, max_nbytes=None)(
+    delayed(worker_rss)() for k in range(4*njobs)))
+
+tmp_dir = tempfile.mkdtemp()
+binned_f = os.path.join(tmp_dir, 'benchmark.binned')
+poptens = np.random.poisson(2.0, (ncells, nwins, ntrials)).astype(float)
+with h5py.File(binned_f, 'w') as bdf:
+    stimgrp = bdf.create_group(stim)
+    tp2.write_population_tensor(stimgrp, poptens, np.arange(ncells),
+                                24000.0, 10.0)
+print('Tensor: {} ({:.1f} MB)'.format(poptens.shape, poptens.nbytes/1e6))
+del poptens
+
+# Memory-mapped tensor: pickled by reference
+with tp2.open_population_memmap(binned_f, stim) as poptens:
+    sums_memmap = run(poptens, 'Memmap')
+
+# Cell major memory-mapped tensor
+cell_major_f = os.path.join(tmp_dir, 'cell_major.npy')
+np.save(cell_major_f, tp2.extract_population_tensor(binned_f, stim))
+sums_cell_major = run(np.load(cell_major_f, mmap_mode='r'), 'Cell major',
+                      trial_major=False)
+
+# Loaded tensor: pickled to every task
+loaded = np.ascontiguousarray(
+    np.transpose(tp2.extract_population_tensor(binned_f, stim), (2, 0, 1)))
+sums_loaded = run(loaded, 'Loaded')
+del loaded
+
+assert np.allclose(sums_loaded, sums_memmap)
+assert np.allclose(sums_cell_major, sums_memmap)
+os.remove(binned_f)
+os.remove(cell_major_f)
+os.rmdir(tmp_dir)
@@ -0,0 +1,61 @@
+# Benchmark pyslsa simplicial complex storage
+# Builds random complexes of increasing size and reports the build time,
+# the memory held by the complexes (growth of the process RSS) and the
+# time to compute the vertex Laplacians and their divergence.
+#
+# To compare two builds of pyslsa (e.g. the linked list storage of an
+# older revision against the flat chain group arrays) run the script
+# once per build:
+#     python benchmark_scg_storage.py /path/to/old/pyslsa.cpython-*.so
+#     python benchmark_scg_storage.py
+# Memory is only comparable between separate runs.
+
+import os
+import sys
+import time
+import importlib.util
+
+import numpy as np
+
+ncells = 60
+sizes = [(200, 5), (2000, 6), (5000, 7)]
+dim = 0
+beta = -1.0
+
+if len(sys.argv) > 1:
+    spec = importlib.util.spec_from_file_location('pyslsa', sys.argv[1])
+    pyslsa = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(pyslsa)
+else:
+    import pyslsa
+print('pyslsa: {}'.format(pyslsa.__file__))
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+def random_max_simplices(nsimps, maxverts):
+    return [tuple(sorted(np.random.choice(ncells, np.random.randint(2, maxverts+1),
+                                          replace=False).tolist()))
+            for _ in range(nsimps)]
+
+np.random.seed(0)
+held = []
+print('{:>8} {:>6} {:>10} {:>12} {:>12} {:>12}'.format('max simp', 'verts',
+                                                     'build (s)', 'memory (MB)',
+                                                     'KL (s)', 'KL'))
+for (nsimps, maxverts) in sizes:
+    maxsimps = [random_max_simplices(nsimps, maxverts) for k in range(2)]
+    rss0 = rss_mb()
+    t0 = time.time()
+    scgs = [pyslsa.build_SCG(m) for m in maxsimps]
+    t_build = time.time() - t0
+    mem = rss_mb() - rss0
+    t0 = time.time()
+    div = pyslsa.KL(scgs[0], scgs[1], dim, beta)
+    t_kl = time.time() - t0
+    print('{:>8} {:>6} {:>10.3f} {:>12.1f} {:>12.3f} {:>12.6f}'.format(
+        nsimps, maxverts, t_build, mem, t_kl, div))
+    # Keep the complexes so freed memory is not reused by the next size
+    held.append(scgs)
@@ -3,8 +3,6 @@ import numpy as np
 import glob
 import os
 import pickle
-import tqdm
-from itertools import product
 from joblib import Parallel, delayed
 import datetime
 
@@ -12,7 +10,6 @@ import datetime
 import neuraltda.simpComp as sc
 import neuraltda.spectralAnalysis as sa
 import neuraltda.topology2 as tp2
-import pyslsa
 
 
 # file save path
@@ -78,19 +75,17 @@ Ntrials = 15
 # Stimulus x Stimulus x TrialPairs x Dimension x Beta
 KL_divs = np.zeros((Nstim, Nstim, Ntrials*Ntrials, len(dims), len(betas)))
 
-for k, beta in enumerate(betas):
-    for l, dim in enumerate(dims):
-        # KL divergence is not symmetric, so we have to do i.e. I/L and L/I
-        for i, stim1 in enumerate(stims):
-            for j, stim2 in enumerate(stims):
-                print("Beginning Stimulus pair: ({}, {})".format(stim1, stim2))
-                # Extract scgs for each stimulis
-                scg1_dat = scg_data[stim1]
-                scg2_dat = scg_data[stim2]
-                for (trial1, trial2) in tqdm.tqdm(product(range(Ntrials), range(Ntrials))):
-                    scg1 = scg1_dat[trial1]
-                    scg2 = scg2_dat[trial2]
-                    KL = pyslsa.KL(scg1, scg2, dim, beta)
-                    KL_divs[i, j, trial1*Ntrials + trial2, l, k] = KL
+# Each Laplacian spectrum is computed once, all trial pairs, dimensions
+# and betas of a stimulus pair come from one threaded call
+njobs = 14
+# KL divergence is not symmetric, so we have to do i.e. I/L and L/I
+for i, stim1 in enumerate(stims):
+    for j, stim2 in enumerate(stims):
+        print("Beginning Stimulus pair: ({}, {})".format(stim1, stim2))
+        divs = sa.pairwise_divergence(scg_data[stim1][:Ntrials],
+                                      scg_data[stim2][:Ntrials],
+                                      dims, betas, metric='KL', njobs=njobs)
+        KL_divs[i, j] = np.reshape(divs, (Ntrials*Ntrials, len(dims),
+                                          len(betas)))
 with open(os.path.join(figsavepth, 'X103_KL_divs_{}_parameter_sweep.pkl'.format(bird)), 'wb') as f:
     pickle.dump([KL_divs, betas, dims, stims, Ntrials], f)
@@ -3,8 +3,6 @@ import numpy as np
 import glob
 import os
 import pickle
-import tqdm
-from itertools import product
 from joblib import Parallel, delayed
 import datetime
 
@@ -12,7 +10,6 @@ import datetime
 import neuraltda.simpComp as sc
 import neuraltda.spectralAnalysis as sa
 import neuraltda.topology2 as tp2
-import pyslsa
 
 
 # file save path
@@ -80,18 +77,19 @@ Ntrials = 15
 # Stimulus x Stimulus x TrialPairs x Dimension x Beta
 JS_divs = np.zeros((Nstim, Nstim, Ntrials*Ntrials, len(dims), len(betas)))
 
-for k, beta in enumerate(betas):
-    for l, dim in enumerate(dims):
-        for i, stim1 in enumerate(stims):
-            for j, stim2 in enumerate(stims):
-                print("Beginning Stimulus pair: ({}, {})".format(stim1, stim2))
-                # Extract scgs for each stimulis
-                scg1_dat = scg_data[stim1]
-                scg2_dat = scg_data[stim2]
-                for (trial1, trial2) in tqdm.tqdm(product(range(Ntrials), range(Ntrials))):
-                    scg1 = scg1_dat[trial1]
-                    scg2 = scg2_dat[trial2]
-                    JS = pyslsa.JS(scg1, scg2, dim, beta)
-                    JS_divs[i, j, trial1*Ntrials + trial2, l, k] = JS
+# Each Laplacian spectrum is computed once, all trial pairs, dimensions
+# and betas of a stimulus pair come from one threaded call
+njobs = 14
+# JS divergence is symmetric: (stim2, stim1) is the transpose of (stim1, stim2)
+for i, stim1 in enumerate(stims):
+    for j, stim2 in enumerate(stims[i:], start=i):
+        print("Beginning Stimulus pair: ({}, {})".format(stim1, stim2))
+        divs = sa.pairwise_divergence(scg_data[stim1][:Ntrials],
+                                      scg_data[stim2][:Ntrials],
+                                      dims, betas, metric='JS', njobs=njobs)
+        JS_divs[i, j] = np.reshape(divs, (Ntrials*Ntrials, len(dims),
+                                          len(betas)))
+        JS_divs[j, i] = np.reshape(np.transpose(divs, (1, 0, 2, 3)),
+                                   (Ntrials*Ntrials, len(dims), len(betas)))
 with open(os.path.join(figsavepth, 'X104_JS_divs_{}_parameter_sweep.pkl'.format(bird)), 'wb') as f:
     pickle.dump([JS_divs, betas, dims, stims, Ntrials], f)
@@ -2,6 +2,7 @@
 import neuraltda.simpComp as sc
 import neuraltda.topology2 as tp2
 import neuraltda.spectralAnalysis as sa
+import neuraltda.model_fitting as mf
 from ephys import rasters
 import pyslsa
 
@@ -50,7 +51,8 @@ def loss_C(a, beta, dim, ncells, nsamples2):
         maxsimps = sc.binarytomaxsimplex(binMatsamples[:, :, ind], rDup=True)
         # Compute SCG for test spike trains
         #Emodel = Emodels[ind]
-        Emodel = pyslsa.build_SCG(maxsimps)
+        # KL in dimension dim only needs simplices up to dimension dim+1
+        Emodel = pyslsa.build_SCG(maxsimps, dim+1)
 
         # Compute KL divergence for this test spike train and store it.
         #%time div = pyslsa.KL(Etarget, Emodel, dim, beta)
@@ -90,19 +92,15 @@ for I, ncell in enumerate(ncellss):
         SCGs.append(E)
     Etarget = SCGs[0]
 
-    ntrials = 1
     x_low = 10.0/(ncell*1000.)
     x_hi = 1600.0/(ncell*1000.)
     X = np.linspace(x_low, x_hi, 100)
-    for K, beta in enumerate(betas):
-        for L, dim in enumerate(dims):
-            print((I, K, L))
-            for t in range(ntrials):
-                for M, x in tqdm.tqdm(enumerate(X)):
-                    #print(x)
-                    (m, stderr) = loss_C(x, beta, dim, ncell, 10)
-                    KL[M, I, K, L] = m
-                    KLerr[M, I, K, L] = stderr
-                    Ptests[M, I, K, L] = x
+    # every rate, beta and dim in one parallel batch
+    print(I)
+    fitter = mf.PoissonModelFit(Etarget, ncell, nwin, 10, dims, betas)
+    (m, stderr) = fitter.sweep(X)
+    KL[:, I] = np.transpose(m, (0, 2, 1))
+    KLerr[:, I] = np.transpose(stderr, (0, 2, 1))
+    Ptests[:, I] = X[:, np.newaxis, np.newaxis]
 with open(os.path.join(figsavepth, 'pyslsa_modelfitting_paramsweep_out2.pkl'), 'wb') as f:
     pickle.dump([KL, KLerr, Ptests, ncellss, betas, dims], f)
@@ -0,0 +1,373 @@
+################################################################################
+## Persistent homology of cell group filtrations                              ##
+## Z/2 boundary matrix reduction with the clearing (twist) optimization       ##
+## of Chen and Kerber, "Persistent Homology Computation with a Twist" 2011.   ##
+## In-process replacement for running Perseus on cell group files.           ##
+################################################################################
+
+from itertools import combinations
+
+import numpy as np
+
+###############################
+###### Filtration Building ####
+###############################
+
+def cell_groups_to_filtration(cell_groups, max_dim=None):
+    '''
+    Builds the simplicial filtration generated by a time sequence of
+    cell groups.  The cell group of window ind is a simplex born at
+    filtration time ind+1, together with all its faces.  A face keeps the
+    earliest birth time of the simplices containing it.
+    This is the filtration build_perseus_persistent_input describes to Perseus.
+
+    Parameters
+    ----------
+    cell_groups : list
+        cell_group information returned by calc_cell_groups
+    max_dim : int
+        If not None, only simplices up to dimension max_dim+1 are built,
+        which is enough for Betti numbers up to dimension max_dim
+
+    Returns
+    -------
+    filtration : dict
+        Maps each simplex (sorted tuple of vertices) to its birth time
+    '''
+    filtration = {}
+    seen_groups = set()
+    for ind, win_grp in enumerate(cell_groups):
+        grp = tuple(sorted(win_grp[1]))
+        if len(grp) == 0 or grp in seen_groups:
+            continue
+        seen_groups.add(grp)
+        birth = ind + 1
+        if max_dim is not None and len(grp) > max_dim + 2:
+            tops = combinations(grp, max_dim + 2)
+        else:
+            tops = [grp]
+        # Descend from the top simplices.  Birth times are nondecreasing,
+        # so a simplex already present has all its faces present already.
+        stack = [s for s in tops if s not in filtration]
+        while stack:
+            simplex = stack.pop()
+            if simplex in filtration:
+                continue
+            filtration[simplex] = birth
+            if len(simplex) > 1:
+                for k in range(len(simplex)):
+                    face = simplex[:k] + simplex[k+1:]
+                    if face not in filtration:
+                        stack.append(face)
+    return filtration
+
+def order_filtration(filtration):
+    '''
+    Orders the simplices of a filtration by birth time, then dimension,
+    so that every face comes before its cofaces.
+
+    Returns
+    -------
+    simplices : list
+        simplices in filtration order
+    births : numpy array
+        birth time of each simplex
+    dims : numpy array
+        dimension of each simplex
+    '''
+    simplices = sorted(filtration.keys(),
+                       key=lambda s: (filtration[s], len(s), s))
+    births = np.array([filtration[s] for s in simplices], dtype=int)
+    dims = np.array([len(s) - 1 for s in simplices], dtype=int)
+    return (simplices, births, dims)
+
+#################################
+###### Boundary Reduction #######
+#################################
+
+def boundary_columns(simplices):
+    '''
+    Z/2 boundary matrix of an ordered list of simplices, as a list of
+    sets of row indices, one per column
+    '''
+    index = {s: i for i, s in enumerate(simplices)}
+    columns = []
+    for simplex in simplices:
+        if len(simplex) == 1:
+            columns.append(set())
+            continue
+        columns.append(set(index[simplex[:k] + simplex[k+1:]]
+                           for k in range(len(simplex))))
+    return columns
+
+def reduce_boundary(columns, dims):
+    '''
+    Reduces a Z/2 boundary matrix by column additions.
+    Columns are processed from the top dimension down; the pivot row of
+    every reduced column of dimension d is a positive simplex of
+    dimension d-1, whose column is cleared without being reduced.
+
+    Parameters
+    ----------
+    columns : list
+        sets of row indices (see boundary_columns).  Modified in place.
+    dims : numpy array
+        dimension of each column
+
+    Returns
+    -------
+    pairs : dict
+        Maps the index of each positive simplex that is killed
+        to the index of the simplex that kills it
+    '''
+    pairs = {}
+    cleared = np.zeros(len(columns), dtype=bool)
+    if len(columns) == 0:
+        return pairs
+    for dim in range(int(np.amax(dims)), 0, -1):
+        pivot_col = {}
+        for j in np.nonzero(dims == dim)[0]:
+            if cleared[j]:
+                continue
+            col = columns[j]
+            while col:
+                pivot = max(col)
+                other = pivot_col.get(pivot)
+                if other is None:
+                    break
+                col ^= columns[other]
+            if col:
+                pivot_col[pivot] = j
+                pairs[pivot] = j
+                cleared[pivot] = True
+                columns[pivot] = set()
+    return pairs
+
+##########################
+###### Betti Numbers #####
+##########################
+
+def filtration_bettis(filtration):
+    '''
+    Computes the Betti numbers of every stage of a filtration.
+
+    Parameters
+    ----------
+    filtration : dict
+        Maps simplices to birth times (see cell_groups_to_filtration)
+
+    Returns
+    -------
+    bettis : list
+        Each element is [<filtration_time>, <betti_vals_list>],
+        one per distinct birth time, with Betti numbers up to the top
+        dimension of the complex, as in the Perseus betti file.
+    '''
+    if len(filtration) == 0:
+        return []
+    (simplices, births, dims) = order_filtration(filtration)
+    columns = boundary_columns(simplices)
+    pairs = reduce_boundary(columns, dims)
+
+    negative = np.zeros(len(simplices), dtype=bool)
+    negative[list(pairs.values())] = True
+    times = np.unique(births)
+    ndims = int(np.amax(dims)) + 1
+
+    # Each positive simplex adds one to its dimension when born and
+    # is removed when the simplex pairing with it is born
+    changes = np.zeros((len(times), ndims), dtype=int)
+    positive = np.nonzero(~negative)[0]
+    np.add.at(changes, (np.searchsorted(times, births[positive]),
+                        dims[positive]), 1)
+    killed = np.array(list(pairs.keys()), dtype=int)
+    killers = np.array(list(pairs.values()), dtype=int)
+    np.add.at(changes, (np.searchsorted(times, births[killers]),
+                        dims[killed]), -1)
+    betti_vals = np.cumsum(changes, axis=0)
+    return [[int(t), [int(b) for b in betti_vals[k]]]
+            for k, t in enumerate(times)]
+
+def calc_bettis_from_cell_groups(cell_groups, max_dim=None):
+    '''
+    Computes the Betti numbers of the filtration generated by cell_groups.
+    In-process equivalent of build_perseus_persistent_input
+    followed by run_perseus.
+
+    Parameters
+    ----------
+    cell_groups : list
+        cell_group information returned by calc_cell_groups
+    max_dim : int
+        Highest Betti dimension to compute.  All dimensions if None
+
+    Returns
+    -------
+    bettis : list
+        list of betti numbers.
+        Each element is [<filtration_time>, <betti_vals_list>]
+    '''
+    filtration = cell_groups_to_filtration(cell_groups, max_dim)
+    bettis = filtration_bettis(filtration)
+    if max_dim is not None:
+        bettis = [[t, b[:max_dim+1]] for (t, b) in bettis]
+    return bettis
+
+###################################
+###### Incremental Filtration #####
+###################################
+
+class IncrementalBettis:
+    '''
+    Maintains the Betti numbers of a simplicial complex as cell groups
+    are added in filtration order.  Only the new simplices of each group
+    are processed: vertices and edges through union-find (H0), higher
+    simplices by reducing their boundary column against the pivots of
+    the columns already added (the standard reduction, one group at
+    a time).
+
+    Within a group, columns of dimension 2 and up are reduced from the
+    top dimension down and the pivots they hit are cleared, as in
+    reduce_boundary.  Rows of
+    negative simplices are dropped from the columns as they surface,
+    which does not change the pivots (compression, Bauer, Kerber and
+    Reininghaus 2014).
+
+    Parameters
+    ----------
+    max_dim : int
+        If not None, only simplices up to dimension max_dim+1 are added,
+        and only Betti numbers up to max_dim are correct.
+    '''
+
+    def __init__(self, max_dim=None):
+        self.max_dim = max_dim
+        self.index = {}
+        self.pivot_col = {}
+        self.negative = set()
+        self.parent = {}
+        self.bettis = []
+
+    def find(self, v):
+        root = v
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[v] != root:
+            (self.parent[v], v) = (root, self.parent[v])
+        return root
+
+    def new_faces(self, grp):
+        '''
+        Simplices of the closure of grp not yet in the complex,
+        in filtration order (by dimension)
+        '''
+        if self.max_dim is not None and len(grp) > self.max_dim + 2:
+            tops = combinations(grp, self.max_dim + 2)
+        else:
+            tops = [grp]
+        new = set()
+        stack = [s for s in tops if s not in self.index]
+        while stack:
+            simplex = stack.pop()
+            if simplex in new:
+                continue
+            new.add(simplex)
+            if len(simplex) > 1:
+                for k in range(len(simplex)):
+                    face = simplex[:k] + simplex[k+1:]
+                    if face not in self.index and face not in new:
+                        stack.append(face)
+        return sorted(new, key=lambda s: (len(s), s))
+
+    def reduce_column(self, simplex):
+        '''
+        Reduces the boundary column of simplex (dimension >= 2)
+        against the stored pivots.  Returns the pivot, None if the
+        column reduces to zero.
+        '''
+        col = set(self.index[simplex[:k] + simplex[k+1:]]
+                  for k in range(len(simplex)))
+        col -= self.negative
+        while col:
+            pivot = max(col)
+            if pivot in self.negative:
+                col.discard(pivot)
+                continue
+            other = self.pivot_col.get(pivot)
+            if other is None:
+                self.pivot_col[pivot] = col
+                return pivot
+            col ^= other
+        return None
+
+    def add_group(self, grp):
+        '''
+        Adds the simplex grp and all its faces to the complex
+
+        Returns
+        -------
+        bettis : list
+            Betti numbers of the complex after adding grp
+        '''
+        new = self.new_faces(tuple(sorted(grp)))
+        by_dim = {}
+        for simplex in new:
+            self.index[simplex] = len(self.index)
+            by_dim.setdefault(len(simplex) - 1, []).append(simplex)
+        while by_dim and len(self.bettis) <= max(by_dim):
+            self.bettis.append(0)
+
+        cleared = set()
+        # Vertices and edges first, so negative edges are known,
+        # then the higher dimensions from the top down
+        dims = [d for d in (0, 1) if d in by_dim] + \
+               sorted([d for d in by_dim if d > 1], reverse=True)
+        for dim in dims:
+            for simplex in by_dim[dim]:
+                ind = self.index[simplex]
+                if dim == 0:
+                    self.parent[simplex[0]] = simplex[0]
+                    self.bettis[0] += 1
+                elif dim == 1:
+                    (ru, rv) = (self.find(simplex[0]), self.find(simplex[1]))
+                    if ru != rv:
+                        self.parent[ru] = rv
+                        self.bettis[0] -= 1
+                        self.negative.add(ind)
+                    else:
+                        self.bettis[1] += 1
+                elif ind in cleared:
+                    self.bettis[dim] += 1
+                else:
+                    pivot = self.reduce_column(simplex)
+                    if pivot is None:
+                        self.bettis[dim] += 1
+                    else:
+                        self.bettis[dim-1] -= 1
+                        self.negative.add(ind)
+                        cleared.add(pivot)
+        return list(self.bettis)
+
+def calc_bettis_incremental(cell_groups, max_dim=None):
+    '''
+    Computes the Betti numbers of the filtration generated by cell_groups
+    window by window with IncrementalBettis.
+
+    Returns
+    -------
+    bettis : list
+        Each element is [<filtration_time>, <betti_vals_list>] with
+        filtration_time ind+1 for every window ind from the first
+        non empty cell group on, all padded to the same length
+    '''
+    inc = IncrementalBettis(max_dim)
+    bettis = []
+    for ind, win_grp in enumerate(cell_groups):
+        if len(win_grp[1]) > 0:
+            inc.add_group(win_grp[1])
+        if len(inc.bettis) > 0:
+            bettis.append([ind + 1, list(inc.bettis)])
+    ndims = len(inc.bettis)
+    if max_dim is not None:
+        ndims = min(ndims, max_dim + 1)
+    return [[t, (b + ndims*[0])[:ndims]] for (t, b) in bettis]
@@ -3,6 +3,7 @@ import neuraltda.simpComp as sc
 import neuraltda.topology2 as tp2
 import neuraltda.spectralAnalysis as sa
 from ephys import rasters
+import pyslsa
 
 # System Libs
 from importlib import reload
@@ -12,10 +13,12 @@ import os
 
 # Scientific Libs
 import numpy as np
-from scipy.optimize import brentq
+from scipy.optimize import brentq, minimize_scalar
+from joblib import Parallel, delayed
 import tqdm
 
-def poisson_model_loss_generic(a, beta, E_data, ncells, nwin, n_samples, metric_func):
+def poisson_model_loss_generic(a, beta, E_data, ncells, nwin, n_samples, metric_func,
+                               d=1):
     '''
     Produce the mean and stderr KL divergence for comparing Poisson models
     generated with parameter a compared to the SCG given  by E_data 
@@ -37,6 +40,8 @@ def poisson_model_loss_generic(a, beta, E_data, ncells, nwin, n_samples, metric_
     metric_func : function
         function taking (laplacian, laplacian, beta) 
         and producing the "distance"
+    d : int
+        Dimension of the Laplacians
 
     Returns 
     -------
@@ -60,6 +65,9 @@ def poisson_model_loss_generic(a, beta, E_data, ncells, nwin, n_samples, metric_
     probmat = np.tile(probs,  (1, nwin))[:, :, np.newaxis]
     probmat = np.tile(probmat, (1, 1, n_samples))
     binMatsamples = np.greater(probmat, samples).astype(int)
+
+    # The target Laplacian is the same for every sample
+    Ldata_orig = sc.compute_laplacian(E_data, d)
     
     # Compute simplicial complex 
     SCGs = []
@@ -68,11 +76,12 @@ def poisson_model_loss_generic(a, beta, E_data, ncells, nwin, n_samples, metric_
         # Compute SCG for test spike trains
         msimps = sc.binarytomaxsimplex(binMat=binMatsamples[:, :, ind],
                                        rDup=True)
-        E_model = sc.simplicialChainGroups(msimps)
+        # Laplacians in dimension d only need simplices up to dimension d+1
+        E_model = sc.simplicialChainGroups(msimps, max_dim=d+1)
 
         # Compute Laplacians for target and tests
         Lsamp = sc.compute_laplacian(E_model, d)
-        Ldata = sc.compute_laplacian(E_data, d)
+        Ldata = Ldata_orig
         
         # Reconcile Laplacian dimensions
         if (np.size(Lsamp) > np.size(Ldata)):
@@ -88,3 +97,218 @@ def poisson_model_loss_generic(a, beta, E_data, ncells, nwin, n_samples, metric_
     std = np.std(KLsave)
     stderr = std / np.sqrt(n_samples)
     return (m, stderr)
+
+########################################
+#### Batched Poisson Model Fitting #####
+########################################
+
+def _model_losses_python(binmat, ev_data, L_data, dims, betas, metric):
+    '''
+    Divergences of the complex of one model spike train from the target
+    for every dim and beta, with simpComp.  The model Laplacian in each
+    dimension is decomposed once for all betas.
+    '''
+    msimps = sc.binarytomaxsimplex(binMat=binmat.astype(int), rDup=True)
+    E_model = sc.simplicialChainGroups(msimps, max_dim=max(dims)+1)
+    losses = []
+    for dim in dims:
+        Lsamp = sc.compute_laplacian(E_model, dim, sparse=True)
+        ev = sc.laplacian_spectrum(Lsamp)
+        if metric == 'KL':
+            losses.append(sc.KL_spectra(ev_data[dim], ev, betas))
+        else:
+            (LA, LB) = sc.reconcile_laplacians(L_data[dim], Lsamp)
+            evM = sc.laplacian_spectrum((LA + LB) / 2.0)
+            losses.append(sc.JS_spectra(ev_data[dim], ev, evM, betas))
+    return np.array(losses)
+
+def _model_losses_pyslsa(binmat, E_data, dims, betas, metric):
+    '''
+    Divergences of the complex of one model spike train from the target
+    for every dim and beta, with PySLSA.  Spectra are cached on the SCGs.
+    '''
+    msimps = sc.binarytomaxsimplex(binmat.astype(int), True)
+    E_model = pyslsa.build_SCG(msimps, max(dims)+1)
+    div_func = {'KL': pyslsa.KL_betas, 'JS': pyslsa.JS_betas}[metric]
+    return np.array([div_func(E_data, E_model, dim, betas) for dim in dims])
+
+class PoissonModelFit:
+    '''
+    Fit the firing probability a of a population of independent
+    Bernoulli (Poisson) cells to a target simplicial complex, as
+    poisson_model_loss_generic does one rate at a time.
+
+    The target Laplacian spectra are computed once.  The model spike
+    trains of every rate are thresholded from one fixed array of
+    uniform samples (common random numbers), so the loss is a
+    deterministic function of a that root and minimum finders can work
+    on, and differences between rates are not swamped by sampling
+    noise.  The complexes of all the samples of a batch of rates are
+    built in parallel, and each gives its loss for every dim and beta
+    at once.  Losses are cached by rate.
+
+    Parameters
+    ----------
+    E_data : list or pyslsa.SCG
+        Target complex: chain groups from simpComp (built and compared
+        with simpComp in worker processes) or a PySLSA SCG (built and
+        compared with PySLSA in threads, which release the GIL)
+    ncells : int
+        Number of cells in the population
+    nwin : int
+        Number of time windows
+    n_samples : int
+        Model spike trains per rate
+    dims : list
+        Laplacian dimensions
+    betas : list
+        Inverse temperatures
+    metric : str
+        'KL' (divergence of the model from the target) or 'JS' (with
+        the mean Laplacian as the reference, as pyslsa.JS).  JS depends
+        on the order of the simplices, which differs between simpComp
+        and PySLSA
+    njobs : int
+        Number of joblib workers.  -1 uses all cores
+    seed : int
+        Seed of the uniform samples
+    '''
+
+    def __init__(self, E_data, ncells, nwin, n_samples, dims, betas,
+                 metric='KL', njobs=-1, seed=None):
+        assert metric in ['KL', 'JS'], 'Unknown metric {}'.format(metric)
+        self.E_data = E_data
+        self.dims = list(dims)
+        self.betas = [float(beta) for beta in betas]
+        self.metric = metric
+        self.njobs = njobs
+        self.python = isinstance(E_data, list)
+        self.uniforms = np.random.RandomState(seed).rand(n_samples, ncells,
+                                                         nwin)
+        self.losses = {}
+        if self.python:
+            self.L_data = {dim: sc.compute_laplacian(E_data, dim, sparse=True)
+                           for dim in self.dims}
+            self.ev_data = {dim: sc.laplacian_spectrum(L)
+                            for (dim, L) in self.L_data.items()}
+
+    def sample(self, rates):
+        '''
+        Model spike trains for each rate
+
+        Returns
+        -------
+        binmats : numpy array
+            Boolean (len(rates), n_samples, ncells, nwin) array
+        '''
+        rates = np.asarray(rates, dtype=float)
+        return self.uniforms[np.newaxis] < rates[:, np.newaxis, np.newaxis,
+                                                 np.newaxis]
+
+    def _compute(self, rates):
+        binmats = self.sample(rates)
+        if self.python:
+            L_data = self.L_data if self.metric == 'JS' else None
+            tasks = [delayed(_model_losses_python)(binmat, self.ev_data,
+                                                   L_data, self.dims,
+                                                   self.betas, self.metric)
+                     for binmat in binmats.reshape((-1,) + binmats.shape[2:])]
+            results = Parallel(n_jobs=self.njobs)(tasks)
+        else:
+            tasks = [delayed(_model_losses_pyslsa)(binmat, self.E_data,
+                                                   self.dims, self.betas,
+                                                   self.metric)
+                     for binmat in binmats.reshape((-1,) + binmats.shape[2:])]
+            results = Parallel(n_jobs=self.njobs, prefer='threads')(tasks)
+        n_samples = len(self.uniforms)
+        for (k, a) in enumerate(rates):
+            self.losses[a] = np.array(results[k*n_samples:(k+1)*n_samples])
+
+    def sweep(self, rates):
+        '''
+        Mean and stderr over samples of the loss for each rate, dim and
+        beta.  Rates not yet cached are computed in one parallel batch.
+
+        Returns
+        -------
+        (mean, stderr) : numpy arrays
+            (len(rates), len(dims), len(betas)) arrays
+        '''
+        rates = [float(a) for a in np.atleast_1d(rates)]
+        todo = sorted(set(a for a in rates if a not in self.losses))
+        if todo:
+            self._compute(todo)
+        losses = np.array([self.losses[a] for a in rates])
+        n_samples = losses.shape[1]
+        return (np.mean(losses, axis=1),
+                np.std(losses, axis=1) / np.sqrt(n_samples))
+
+    def loss(self, a, dim, beta):
+        '''
+        (mean, stderr) of the loss at rate a for one dim and beta
+        '''
+        (m, stderr) = self.sweep([a])
+        ind = (0, self.dims.index(dim), self.betas.index(float(beta)))
+        return (m[ind], stderr[ind])
+
+    def fit(self, dim, beta, bounds, ngrid=10, xatol=1e-4):
+        '''
+        Rate minimizing the mean loss for one dim and beta.
+        The minimum is bracketed on a grid of ngrid rates (one batch)
+        and refined by bounded Brent minimization.
+
+        Parameters
+        ----------
+        bounds : tuple
+            (lowest, highest) rate
+        ngrid : int
+            Number of rates in the bracketing grid
+        xatol : float
+            Tolerance on the rate
+
+        Returns
+        -------
+        (a, mean, stderr) : tuple
+            Fitted rate and the loss there
+        '''
+        grid = np.linspace(bounds[0], bounds[1], ngrid)
+        (m, stderr) = self.sweep(grid)
+        m = m[:, self.dims.index(dim), self.betas.index(float(beta))]
+        k = np.argmin(m)
+        res = minimize_scalar(lambda a: self.loss(a, dim, beta)[0],
+                              bounds=(grid[max(k-1, 0)], grid[min(k+1, ngrid-1)]),
+                              method='bounded', options={'xatol': xatol})
+        # the loss is piecewise constant in a, so the best grid rate
+        # can beat the refined one
+        a = res.x if res.fun <= m[k] else grid[k]
+        return (a,) + self.loss(a, dim, beta)
+
+    def rate_for_loss(self, level, dim, beta, bracket, xtol=1e-4):
+        '''
+        Rate in bracket at which the mean loss crosses level, by brentq.
+        The mean loss minus level must change sign over the bracket.
+        '''
+        return brentq(lambda a: self.loss(a, dim, beta)[0] - level,
+                      bracket[0], bracket[1], xtol=xtol)
+
+    def rate_interval(self, a_fit, dim, beta, bounds, nse=1.0, xtol=1e-4):
+        '''
+        Rates on either side of a fitted rate where the mean loss rises
+        nse standard errors above its value at a_fit.  A side where the
+        loss stays below that level returns its bound.
+
+        Returns
+        -------
+        (a_lo, a_hi) : tuple
+        '''
+        (m, stderr) = self.loss(a_fit, dim, beta)
+        level = m + nse*stderr
+        interval = []
+        for bound in bounds:
+            if self.loss(bound, dim, beta)[0] <= level:
+                interval.append(bound)
+            else:
+                interval.append(self.rate_for_loss(level, dim, beta,
+                                                   sorted([bound, a_fit]),
+                                                   xtol))
+        return tuple(interval)
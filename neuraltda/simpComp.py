@@ -10,8 +10,14 @@
 ####  Basically all of this deprecated by PySLSA, and the useful functions
 ####  Have been moved to stimulus_space.py
 
+import itertools
+import warnings
+
 import numpy as np
 import scipy.linalg as spla
+import scipy.sparse as sp
+import scipy.sparse.linalg as spsla
+from scipy.special import ive, logsumexp, xlogy
 import networkx as nx
 
 def maxEnt(scg, dim):
@@ -106,7 +112,160 @@ def get_faces(max_simp):
         out_faces[face[0]+1].append(tuple(sorted(np.array(max_simp)[face[1]])))
     return out_faces
 
-def simplicialChainGroups(maxsimps):
+def mask_bits(N):
+    '''
+    Returns the positions of the bits set in the integer N, in
+    increasing order.  N can have any number of bits.
+    '''
+    bits = []
+    while N:
+        low = N & -N
+        bits.append(low.bit_length() - 1)
+        N ^= low
+    return bits
+
+def maxsimps_to_masks(maxsimps, vertices):
+    '''
+    Encodes simplices as packed bitmasks.  Bit i is set if the simplex
+    contains vertices[i].  Masks span as many 64 bit words as needed,
+    so there is no limit on the number of cells.
+
+    Returns
+    -------
+    masks : numpy array
+        (nsimps, nwords) uint64 array, one row per distinct simplex
+    '''
+    nwords = max(1, (len(vertices) + 63) // 64)
+    position = {v: i for i, v in enumerate(vertices)}
+    masks = np.zeros((len(maxsimps), nwords), dtype=np.uint64)
+    for ind, simp in enumerate(maxsimps):
+        for v in simp:
+            (w, b) = divmod(position[v], 64)
+            masks[ind, w] |= np.uint64(1 << b)
+    return unique_masks(masks)
+
+def unique_masks(masks):
+    '''
+    Removes duplicate rows from an array of packed bitmasks
+    '''
+    if len(masks) == 0:
+        return masks
+    if masks.shape[1] == 1:
+        return np.unique(masks[:, 0])[:, np.newaxis]
+    masks = masks[np.lexsort(masks.T[::-1])]
+    keep = np.ones(len(masks), dtype=bool)
+    keep[1:] = (masks[1:] != masks[:-1]).any(axis=1)
+    return masks[keep]
+
+def mask_popcount(masks):
+    '''
+    Number of vertices in each packed bitmask
+    '''
+    bits = np.unpackbits(masks.astype('<u8').view(np.uint8), axis=1)
+    return bits.sum(axis=1)
+
+def mask_faces(masks):
+    '''
+    All the codimension one faces of an array of packed bitmasks,
+    with duplicates removed.  The faces of every simplex are generated
+    together, one bit at a time.
+    '''
+    faces = []
+    one = np.uint64(1)
+    for w in range(masks.shape[1]):
+        remaining = masks[:, w].copy()
+        while remaining.any():
+            low = remaining & (~remaining + one)
+            rows = low != 0
+            face = masks[rows]
+            face[:, w] ^= low[rows]
+            faces.append(face)
+            remaining ^= low
+    if not faces:
+        return np.zeros((0, masks.shape[1]), dtype=np.uint64)
+    return unique_masks(np.concatenate(faces))
+
+def mask_closure(masks, max_dim=None):
+    '''
+    Computes all the faces of a set of simplices given as packed bitmasks.
+    Faces are generated from the top dimension down, one codimension
+    at a time, so each face is expanded once however many simplices
+    contain it.  Simplices above max_dim are replaced by their
+    max_dim faces and never expanded.
+
+    Returns
+    -------
+    levels : list of arrays
+        levels[k] holds the masks of the simplices with k vertices
+    '''
+    nverts = mask_popcount(masks)
+    top = int(np.amax(nverts)) if len(nverts) else 0
+    if max_dim is not None and top > max_dim + 1:
+        top = max_dim + 1
+        big = [masks[nverts <= top]]
+        combos = {}
+        for N in masks[nverts > top]:
+            bits = np.array([64*w + b for w in range(len(N))
+                             for b in mask_bits(int(N[w]))])
+            if len(bits) not in combos:
+                combos[len(bits)] = np.array(list(
+                    itertools.combinations(range(len(bits)), top)))
+            face_bits = bits[combos[len(bits)]]
+            faces = np.zeros((len(face_bits), len(N)), dtype=np.uint64)
+            rows = np.arange(len(face_bits))
+            for j in range(top):
+                (w, b) = np.divmod(face_bits[:, j], 64)
+                faces[rows, w] |= np.left_shift(np.uint64(1),
+                                                b.astype(np.uint64))
+            big.append(faces)
+        masks = unique_masks(np.concatenate(big))
+        nverts = mask_popcount(masks)
+    levels = [masks[nverts == k] for k in range(top + 1)]
+    for k in range(top, 1, -1):
+        levels[k-1] = unique_masks(np.concatenate([levels[k-1],
+                                                   mask_faces(levels[k])]))
+    if top > 0:
+        levels[0] = np.zeros((1, masks.shape[1]), dtype=np.uint64)
+    return levels
+
+def masks_to_array(masks, nverts, vertices):
+    '''
+    Decodes packed bitmasks with nverts vertices each into a
+    lexicographically sorted (len(masks), nverts) array of vertex labels
+    '''
+    vertices = np.asarray(vertices)
+    bits = np.unpackbits(masks.astype('<u8').view(np.uint8), axis=1,
+                         bitorder='little')
+    pos = np.nonzero(bits)[1].reshape((len(masks), nverts))
+    if nverts > 0 and len(masks) > 0:
+        pos = pos[np.lexsort(pos.T[::-1])]
+    return vertices[pos]
+
+def chain_group_arrays(maxsimps, max_dim=None):
+    '''
+    Computes the generators of the chain groups of the simplicial complex
+    generated by maxsimps, using bitmask face closure.
+
+    Parameters
+    ----------
+    maxsimps : list of tuples
+        list of the maximal simplices in the complex
+    max_dim : int
+        Highest simplex dimension to generate.  All if None
+
+    Returns
+    -------
+    E : list of arrays
+        E[k] is the lexicographically sorted array of the
+        simplices with k vertices, of shape (n_k, k)
+    '''
+    vertices = sorted(set(v for simp in maxsimps for v in simp))
+    masks = maxsimps_to_masks(maxsimps, vertices)
+    levels = mask_closure(masks, max_dim)
+    return [masks_to_array(level, k, vertices)
+            for k, level in enumerate(levels)]
+
+def simplicialChainGroups(maxsimps, max_dim=None):
     '''
     Take a list of maximal simplices and
     successively add faces until all generators
@@ -116,24 +275,20 @@ def simplicialChainGroups(maxsimps):
     ----------
     maxsimps : list of tuples
         list of the maximal simplices in the complex
+    max_dim : int
+        Highest simplex dimension to generate.  All if None
 
     Returns
     -------
     E : list of lists
-        simplicial complex generators in each dimension
+        simplicial complex generators in each dimension.
+        E[k] is the sorted list of simplices (tuples) with k vertices
 
     '''
-    maxdim = max([len(s) for s in maxsimps])
-    Elen = maxdim+1
-    E = [[] for ind in range(Elen)]
-    K = list(maxsimps)
-    for maxsimp in K:
-        faces = get_faces(maxsimp)
-        for j in range(len(faces)):
-            E[j] = union(E[j], faces[j])
-    for k in range(Elen):
-        E[k] = sorted(E[k])
-    return E
+    E = chain_group_arrays(maxsimps, max_dim)
+    if len(E) == 1:
+        return [[()]]
+    return [[tuple(simp) for simp in Ek.tolist()] for Ek in E]
 
 ###############################################################
 #### KMM Computation of Simplicial Complexes (Much slower) ####
@@ -250,6 +405,58 @@ def canonicalCoordinates(c, K):
             v[ind] = c[K[ind]]
     return v
 
+def simplex_index(K):
+    '''
+    Dictionary mapping each simplex of the basis K to its index
+    '''
+    return {tuple(simplex): ind for ind, simplex in enumerate(K)}
+
+def sparse_boundary_operator(E, dim, index=None):
+    '''
+    Return the boundary operator in dimension dim for simplicial
+    complex E as a sparse (CSC) matrix from E[dim+1] to E[dim].
+    Each column has at most dim+1 nonzeros, looked up with a
+    simplex to index dictionary instead of scanning the basis.
+
+    Parameters
+    ----------
+    E : list
+        Chain group generators, as returned by simplicialChainGroups
+        or chain_group_arrays
+    dim : int
+        E[dim+1] is the domain, E[dim] the codomain
+    index : dict
+        simplex_index(E[dim]), if already computed
+
+    Returns
+    -------
+    mat : scipy.sparse.csc_matrix
+        (len(E[dim]), len(E[dim+1])) matrix.
+        Chain groups beyond the top of E are empty.
+    '''
+    m = len(E[dim]) if dim < len(E) else 0
+    n = len(E[dim+1]) if dim+1 < len(E) else 0
+    if dim == 0 or m == 0 or n == 0:
+        # The boundary of a vertex is zero
+        return sp.csc_matrix((m, n))
+    if index is None:
+        index = simplex_index(E[dim])
+    rows = []
+    cols = []
+    vals = []
+    for j, simplex in enumerate(E[dim+1]):
+        simplex = tuple(simplex)
+        sgn = 1
+        for k in range(len(simplex)):
+            row = index.get(simplex[:k] + simplex[k+1:])
+            if row is not None:
+                rows.append(row)
+                cols.append(j)
+                vals.append(sgn)
+            sgn = -1*sgn
+    return sp.csc_matrix((np.array(vals, dtype=float), (rows, cols)),
+                         shape=(m, n))
+
 def boundaryOperatorMatrices(E):
     '''
     Given a list of simplicial complex generators,
@@ -260,28 +467,19 @@ def boundaryOperatorMatrices(E):
     nmat = len(E)-1
     D = [[] for i in range(nmat)]
     for k in range(1, nmat):
-        m = len(E[k-1])
-        n = len(E[k])
-        mat = np.zeros((m, n))
-        for j in range(n):
-            c = boundaryOperator(E[k][j])
-            mat[:, j] = canonicalCoordinates(c, E[k-1])
-        D[k-1] = mat
+        D[k-1] = boundaryOperatorMatrix(E, k-1)
     return D
 
 def boundaryOperatorMatrix(E, dim):
     '''
     Return the matrix of the boundary operator
     in dimension dim for simplicial complex E
+    as a dense array (see sparse_boundary_operator)
 
     '''
-    m = len(E[dim])
-    n = len(E[dim+1])
-    mat = np.zeros((m, n))
-    for j in range(n):
-        c = boundaryOperator(E[dim+1][j])
-        mat[:, j] = canonicalCoordinates(c, E[dim])
-    return mat
+    if dim+1 >= len(E):
+        raise IndexError('No chain group {} in E'.format(dim+1))
+    return sparse_boundary_operator(E, dim).toarray()
 
 def maskedBoundaryOperatorMatrix(E, Emask):
     ''' Emask is the simplicial Chain groups you want to mask in
@@ -330,42 +528,56 @@ def laplacian(D, dim):
         L1 = np.array([0], ndmin=2)
     return L1 + L2
 
-def compute_laplacian(scg, dim):
+def sparse_laplacian(scg, dim):
     '''
-    Compute the Laplacian matrix in dimension dim 
-    for the simplicial complex scg 
+    Compute the Laplacian D^T D + D' D'^T in dimension dim for the
+    simplicial complex scg as a sparse (CSR) matrix, where
+    D = sparse_boundary_operator(scg, dim) and
+    D' = sparse_boundary_operator(scg, dim+1).
+    As compute_laplacian, an empty chain group gives a 1x1 zero matrix.
 
     '''
-    try:
-        Di = np.array(boundaryOperatorMatrix(scg, dim))
-    except:
-        print('error1')
-        Di = []
-    try:
-        Di1 = np.array(boundaryOperatorMatrix(scg, dim+1))
-    except:
-        print('error2')
-        Di1 = []
+    n = len(scg[dim+1]) if dim+1 < len(scg) else 0
+    if n == 0:
+        return sp.csr_matrix((1, 1))
+    Di = sparse_boundary_operator(scg, dim)
+    Di1 = sparse_boundary_operator(scg, dim+1)
+    L = (Di.T @ Di) + (Di1 @ Di1.T)
+    return sp.csr_matrix(L)
+
+def compute_laplacian(scg, dim, sparse=False):
+    '''
+    Compute the Laplacian matrix in dimension dim 
+    for the simplicial complex scg 
 
-    if len(Di1) >0:
-        L2 = np.dot(Di1, Di1.T)
-    else:
-        L2 = np.array([0], ndmin=2)
+    Parameters
+    ----------
+    scg : list
+        Chain group generators
+    dim : int
+        Dimension of the Laplacian
+    sparse : bool
+        Return a scipy.sparse CSR matrix instead of a dense array
 
-    if len(Di) > 0:
-        L1 = np.dot(Di.T, Di)
-    else:
-        L1 = np.array([0], ndmin=2)
-    return L1 + L2
+    '''
+    L = sparse_laplacian(scg, dim)
+    if sparse:
+        return L
+    return L.toarray()
 
 def reconcile_laplacians(L1, L2):
     ''' 
     Expand the bases so that Laplacian matrices 
-    L1 and L2 have the same shape 
+    L1 and L2 have the same shape.
+    Sparse matrices stay sparse.
     '''
-    laps = sorted([L1, L2], key=np.size)
+    laps = sorted([L1, L2], key=lambda L: np.shape(L)[0])
     L1 = laps[0]
     L2 = laps[1]
+    if sp.issparse(L1) or sp.issparse(L2):
+        L1 = sp.coo_matrix(L1)
+        L_new = sp.csr_matrix((L1.data, (L1.row, L1.col)), shape=L2.shape)
+        return (L_new, L2)
     L_new = np.zeros(L2.shape)
     try:
         (a,b) = L1.shape
@@ -374,11 +586,23 @@ def reconcile_laplacians(L1, L2):
         print('Reconcile Laplacians: L1 Size Value Error')
     return (L_new, L2)
 
+def dense_laplacian(L):
+    '''
+    Dense array of a Laplacian that may be a sparse matrix
+    '''
+    if sp.issparse(L):
+        return L.toarray()
+    return L
+
 #######################################################
 #### Density Matrix and KL/JS Divergence Functions ####
 #######################################################
 
+# Density matrix eigenvalues below this are left out of the KL sums
+EIG_THRESHOLD = 1e-14
+
 def densityMatrix(L, beta):
+    L = dense_laplacian(L)
     try:
         M = spla.expm(beta*L)
         M = M /np.trace(M)
@@ -388,18 +612,24 @@ def densityMatrix(L, beta):
         M = 0
     return M
 
-def Entropy(rho):
+def entropy_eigvals(p):
+    '''
+    Von Neumann entropy (bits) from the eigenvalues of a density matrix.
+    Eigenvalues rounded below zero count as zero.
+    '''
+    p = np.maximum(p, 0.0)
+    return -np.sum(xlogy(p, p))/np.log(2.0)
 
-    r, w = np.linalg.eig(rho)
-    np.real(r)
-    ent = -np.real(np.sum(np.multiply(r, np.log(r)/np.log(2.0))))
-    return ent
+def Entropy(rho):
+    '''
+    Von Neumann entropy (bits) of a density matrix, from its
+    eigenvalues.
+    '''
+    return entropy_eigvals(laplacian_spectrum(rho))
 
 def KLdivergence_lap(LA, LB, beta):
-    r, w = np.linalg.eig(LA)
-    s, w = np.linalg.eig(LB)
-    r = (np.real(sorted(r)))
-    s = (np.real(sorted(s)))
+    r = laplacian_spectrum(LA)
+    s = laplacian_spectrum(LB)
 
     r = np.exp(beta*r)
     s = np.exp(beta*s)
@@ -409,23 +639,29 @@ def KLdivergence_lap(LA, LB, beta):
     div = np.sum(np.multiply(r, (np.log(r) - np.log(s))/np.log(2.0)))
     return div
 
+def kl_terms(r, s):
+    '''
+    Terms r*log2(r/s) of the KL divergence between two density matrices
+    with paired eigenvalues r and s.  Pairs with an eigenvalue below
+    EIG_THRESHOLD contribute 0.
+    '''
+    r = np.asarray(r, dtype=float)
+    s = np.asarray(s, dtype=float)
+    keep = (r >= EIG_THRESHOLD) & (s >= EIG_THRESHOLD)
+    out = np.zeros(len(r))
+    out[keep] = r[keep]*(np.log(r[keep]) - np.log(s[keep]))/np.log(2.0)
+    return out
+
+def KLdivergence_eigvals(r, s):
+    '''
+    KL divergence (bits) between two density matrices from their
+    sorted eigenvalues r and s.
+    '''
+    return np.sum(kl_terms(r, s))
+
 def KLdivergence(rho, sigma):
-    r= np.linalg.eigvalsh(rho)
-    s= np.linalg.eigvalsh(sigma)
-    # r = spla.eigh(rho, eigvals_only=True)
-    # s = spla.eigh(sigma, eigvals_only=True)
-    r = np.real(sorted(r))
-    s = np.real(sorted(s))
-    # r = np.real(r)
-    # s = np.real(s)
-    div = 0.
-    for rval, sval in zip(r,s):
-        if rval < 1e-14 or sval < 1e-14:
-            div += 0
-        else:
-            div += rval*(np.log(rval) - np.log(sval))/np.log(2.0)
-    #div = np.sum(np.multiply(r, (np.log(r) - np.log(s))/np.log(2.0)))
-    return div
+    return KLdivergence_eigvals(laplacian_spectrum(rho),
+                                laplacian_spectrum(sigma))
 
 def Likelihood(rho, sigma):
 
@@ -442,8 +678,11 @@ def JSdivergence_matrixlog_old(rho, sigma):
             KLdivergence_matrixlog(sigma, M))/2.0
 
 def JSdivergence(rho, sigma):
-    M = (rho+sigma)/2.0
-    return (KLdivergence(rho, M) + KLdivergence(sigma, M))/2.0
+    # each spectrum once: M enters both KL terms
+    r = laplacian_spectrum(rho)
+    s = laplacian_spectrum(sigma)
+    m = laplacian_spectrum((rho+sigma)/2.0)
+    return (KLdivergence_eigvals(r, m) + KLdivergence_eigvals(s, m))/2.0
 
 def JSdivergence_BDD(rho, sigma):
     M = (rho+sigma)/2.0
@@ -458,15 +697,584 @@ def JSdivergences(rho, sigma):
     return div
 
 def spectralEntropies(rhos):
-
+    '''
+    Von Neumann entropies (nats) of a list of density matrices
+    '''
     ents = []
     for ind in range(len(rhos)):
-        v, w = np.linalg.eig(rhos[ind])
-        ve = np.log(v)
-        ent = -np.dot(v.T, ve)
-        ents.append(ent)
+        ents.append(entropy_eigvals(laplacian_spectrum(rhos[ind]))*np.log(2.0))
     return ents
 
+##############################################
+#### Laplacian Spectra and Spectrum Cache ####
+##############################################
+
+def laplacian_spectrum(L, eigenvectors=False):
+    '''
+    Sorted eigenvalues of a (dense or sparse) Laplacian matrix, or of
+    any real symmetric matrix such as a density matrix.
+    KL and JS divergences depend on the Laplacians only through these.
+    From the LAPACK divide and conquer solver (dsyevd), which returns
+    them in ascending order.  With eigenvectors=True, returns
+    (eigenvalues, eigenvectors as columns).
+    '''
+    A = dense_laplacian(L)
+    return spla.eigh(A, eigvals_only=not eigenvectors, driver='evd',
+                     overwrite_a=(A is not L), check_finite=False)
+
+def pad_spectrum(ev, n):
+    '''
+    Spectrum of a Laplacian whose basis is expanded to size n with zeros,
+    as reconcile_laplacians does
+    '''
+    return np.sort(np.concatenate([ev, np.zeros(n - len(ev))]))
+
+def log_density_spectra(ev, betas):
+    '''
+    Log eigenvalues of the density matrices exp(beta*L)/tr for each beta
+
+    Returns
+    -------
+    logp : numpy array
+        (len(betas), len(ev)) array
+    '''
+    x = np.outer(betas, ev)
+    return x - logsumexp(x, axis=1, keepdims=True)
+
+def KL_spectra(evA, evB, betas):
+    '''
+    KL divergence (bits) between the density matrices of two Laplacians
+    given their sorted spectra, for every beta at once.
+    Same value as KLdivergence_lap on the reconciled Laplacians.
+
+    Parameters
+    ----------
+    evA, evB : numpy array
+        Sorted Laplacian spectra (see laplacian_spectrum)
+    betas : list
+        Inverse temperatures
+
+    Returns
+    -------
+    divs : numpy array
+        One divergence per beta
+    '''
+    n = max(len(evA), len(evB))
+    betas = np.atleast_1d(np.asarray(betas, dtype=float))
+    lr = log_density_spectra(pad_spectrum(evA, n), betas)
+    ls = log_density_spectra(pad_spectrum(evB, n), betas)
+    return np.sum(np.exp(lr)*(lr - ls), axis=1) / np.log(2.0)
+
+def JS_spectra(evA, evB, evM, betas):
+    '''
+    JS divergence for every beta from the spectra of two Laplacians
+    and of their mean (LA + LB)/2, as pyslsa.JS computes it
+    '''
+    return 0.5*KL_spectra(evA, evM, betas) + 0.5*KL_spectra(evB, evM, betas)
+
+class SpectrumCache:
+    '''
+    Sorted Laplacian spectra keyed by (SCG identity, dim), so that each
+    Laplacian is decomposed once however many betas and pairs it enters.
+    The cache keeps a reference to each SCG so identities are not reused.
+    SCGs must not be modified while cached.
+    '''
+
+    def __init__(self):
+        self.spectra = {}
+
+    def spectrum(self, scg, dim):
+        '''
+        Sorted eigenvalues of the Laplacian of scg in dimension dim
+        '''
+        key = (id(scg), dim)
+        if key not in self.spectra:
+            L = compute_laplacian(scg, dim, sparse=True)
+            self.spectra[key] = (scg, laplacian_spectrum(L))
+        return self.spectra[key][1]
+
+    def mean_spectrum(self, scgA, scgB, dim):
+        '''
+        Sorted eigenvalues of the mean of the reconciled Laplacians of
+        scgA and scgB.  Depends on the pair, so it is not cached.
+        '''
+        LA = compute_laplacian(scgA, dim, sparse=True)
+        LB = compute_laplacian(scgB, dim, sparse=True)
+        (LA, LB) = reconcile_laplacians(LA, LB)
+        return laplacian_spectrum((LA + LB) / 2.0)
+
+    def KL(self, scgA, scgB, dim, betas):
+        return KL_spectra(self.spectrum(scgA, dim),
+                          self.spectrum(scgB, dim), betas)
+
+    def JS(self, scgA, scgB, dim, betas):
+        return JS_spectra(self.spectrum(scgA, dim), self.spectrum(scgB, dim),
+                          self.mean_spectrum(scgA, scgB, dim), betas)
+
+def KL_betas(scgA, scgB, dim, betas, cache=None):
+    '''
+    KL divergence between simplicial complexes scgA and scgB in
+    dimension dim for each beta in betas.  Python counterpart of
+    pyslsa.KL_betas.  Pass a SpectrumCache to reuse spectra across calls.
+    '''
+    if cache is None:
+        cache = SpectrumCache()
+    return cache.KL(scgA, scgB, dim, betas)
+
+def JS_betas(scgA, scgB, dim, betas, cache=None):
+    '''
+    JS divergence between simplicial complexes scgA and scgB in
+    dimension dim for each beta in betas.  Python counterpart of
+    pyslsa.JS_betas.
+    '''
+    if cache is None:
+        cache = SpectrumCache()
+    return cache.JS(scgA, scgB, dim, betas)
+
+###################################################
+#### Stochastic Lanczos Quadrature Divergences ####
+###################################################
+
+# Approximate mode for complexes too large for a dense eigendecomposition.
+# Each random probe vector v gives a Gauss quadrature rule (nodes and
+# weights) for the spectral measure of a symmetric operator from nsteps
+# Lanczos iterations, so tr f(L) ~ n * mean over probes of
+# sum(weights * f(nodes)).  Pooling the rules of all probes gives an
+# approximate spectrum ("atoms": values with eigenvalue counts summing
+# to n) from which the divergences below are computed.  Only sparse
+# matrix-vector products are needed.  The reported error combines the
+# jackknife standard error over probes with the bias of a finite number
+# of Lanczos steps, estimated as the change of the value when the rules
+# of the same probes are cut to nsteps/2.  That bias does not shrink with
+# more probes: the sorted eigenvalue pairing of KL and JS needs nsteps
+# of about 40 where the entropy is converged at 10.
+
+def lanczos_tridiagonal(matvec, v, nsteps):
+    '''
+    Lanczos iterations with full reorthogonalization from the unit
+    vector v, stopping early at an invariant subspace
+
+    Parameters
+    ----------
+    matvec : function
+        Product of the operator with a vector
+    v : numpy array
+        Unit starting vector
+    nsteps : int
+        Number of Lanczos iterations
+
+    Returns
+    -------
+    alpha, beta : numpy array
+        Diagonal and off-diagonal of the tridiagonal matrix
+    '''
+    n = len(v)
+    nsteps = min(nsteps, n)
+    Q = np.zeros((nsteps, n))
+    alpha = np.zeros(nsteps)
+    beta = np.zeros(nsteps)
+    q = v
+    k = 0
+    for k in range(nsteps):
+        Q[k] = q
+        w = matvec(q)
+        alpha[k] = np.dot(q, w)
+        w = w - Q[:k+1].T @ (Q[:k+1] @ w)
+        w = w - Q[:k+1].T @ (Q[:k+1] @ w)
+        beta[k] = np.linalg.norm(w)
+        if beta[k] < 1e-10*max(1.0, abs(alpha[k])) or k == nsteps - 1:
+            # invariant subspace found: the rule is exact
+            break
+        q = w / beta[k]
+    return (alpha[:k+1], beta[:k])
+
+def gauss_rule(alpha, beta, nsteps=None):
+    '''
+    Gauss quadrature rule of the tridiagonal matrix of lanczos_tridiagonal,
+    optionally from its first nsteps iterations only
+
+    Returns
+    -------
+    nodes, weights : numpy array
+        Quadrature nodes (Ritz values) and weights (summing to 1)
+    '''
+    if nsteps is not None:
+        (alpha, beta) = (alpha[:nsteps], beta[:nsteps-1])
+    nodes, vecs = spla.eigh_tridiagonal(alpha, beta)
+    return (nodes, vecs[0]**2)
+
+def lanczos_quadrature(matvec, v, nsteps):
+    '''
+    Gauss quadrature rule for the spectral measure of a symmetric
+    operator with respect to the unit vector v, from nsteps Lanczos
+    iterations (see lanczos_tridiagonal)
+
+    Returns
+    -------
+    nodes, weights : numpy array
+        Quadrature nodes (Ritz values) and weights (summing to 1)
+    '''
+    return gauss_rule(*lanczos_tridiagonal(matvec, v, nsteps))
+
+class SLQSpectrum:
+    '''
+    Approximate spectrum of a symmetric n x n operator from stochastic
+    Lanczos quadrature with Rademacher probe vectors.
+    The ndeflate eigenvalues at the end of the spectrum selected by
+    which ('SA' smallest, 'LA' largest) are computed exactly with eigsh
+    and projected out of the probes: they dominate the density matrices
+    and are the ones a quadrature rule resolves worst.
+    Operators with n <= nsteps + ndeflate are decomposed exactly.
+
+    Parameters
+    ----------
+    A : sparse matrix or LinearOperator
+        The operator
+    nsteps : int
+        Lanczos iterations per probe
+    seed : int
+        Seed of the probe vectors
+    ndeflate : int
+        Number of exact eigenvalues
+    which : str
+        End of the spectrum of the exact eigenvalues, 'SA' or 'LA'
+    sigma : float
+        Shift below the spectrum: the exact eigenvalues are found by
+        shift-invert (A must be a sparse matrix), which converges much
+        faster than which='SA' for the clustered small eigenvalues of
+        Laplacians
+    '''
+
+    def __init__(self, A, nsteps=40, seed=None, ndeflate=0, which='LA',
+                 sigma=None):
+        n = A.shape[0]
+        self.matvec = lambda x: A @ x
+        self.n = n
+        self.nsteps = nsteps
+        self.rng = np.random.RandomState(seed)
+        self.rules = []
+        self.tridiagonals = []
+        self.norms = []
+        self.exact = np.zeros(0)
+        self.V = np.zeros((n, 0))
+        self.complete = (n <= nsteps + ndeflate)
+        if self.complete:
+            dense = A @ np.eye(n)
+            self.exact = spla.eigh((dense + dense.T) / 2.0, eigvals_only=True)
+        elif ndeflate > 0:
+            try:
+                (self.exact, self.V) = spsla.eigsh(
+                    A, ndeflate, sigma=sigma,
+                    which=which if sigma is None else 'LM')
+            except spsla.ArpackNoConvergence as err:
+                # keep the eigenpairs that did converge
+                (self.exact, self.V) = (err.eigenvalues, err.eigenvectors)
+
+    @property
+    def nprobes(self):
+        return len(self.rules)
+
+    def _project(self, x):
+        return x - self.V @ (self.V.T @ x)
+
+    def add_probes(self, nprobes):
+        if self.complete:
+            return
+        for k in range(nprobes):
+            y = self._project(self.rng.choice([-1.0, 1.0], size=self.n))
+            norm2 = np.dot(y, y)
+            tridiagonal = lanczos_tridiagonal(
+                lambda x: self._project(self.matvec(x)),
+                y / np.sqrt(norm2), self.nsteps)
+            (nodes, weights) = gauss_rule(*tridiagonal)
+            self.tridiagonals.append(tridiagonal)
+            self.norms.append(norm2)
+            self.rules.append((nodes, weights*norm2))
+
+    def atoms(self, leave_out=None, nsteps=None):
+        '''
+        Exact eigenvalues and pooled quadrature rules of the probes,
+        optionally leaving one probe out (for the jackknife), or with
+        the rules of the first nsteps Lanczos iterations of each probe
+        (for the truncation bias)
+
+        Returns
+        -------
+        values, counts : numpy array
+            Eigenvalue estimates and the number of eigenvalues each
+            stands for.  The counts sum to n
+        '''
+        exact = self.exact
+        rules = self.rules
+        if nsteps is not None and nsteps < self.nsteps:
+            rules = []
+            for ((alpha, beta), norm2) in zip(self.tridiagonals, self.norms):
+                (nodes, weights) = gauss_rule(alpha, beta, nsteps)
+                rules.append((nodes, weights*norm2))
+        rules = [rule for (k, rule) in enumerate(rules) if k != leave_out]
+        if self.complete or not rules:
+            return (exact, np.ones(len(exact)))
+        values = np.concatenate([nodes for (nodes, weights) in rules])
+        counts = np.concatenate([weights for (nodes, weights) in rules])
+        counts = counts * (self.n - len(exact)) / np.sum(counts)
+        return (np.concatenate([exact, values]),
+                np.concatenate([np.ones(len(exact)), counts]))
+
+def slq_laplacian_spectrum(L, beta, nsteps=40, seed=None, ndeflate=20):
+    '''
+    SLQSpectrum of a (sparse or dense) Laplacian matrix, with the
+    eigenvalues that dominate exp(beta*L) computed exactly
+    '''
+    L = sp.csc_matrix(L, dtype=float)
+    if beta < 0:
+        # smallest eigenvalues, by shift-invert below zero (L is PSD)
+        return SLQSpectrum(L, nsteps, seed, ndeflate, 'SA', sigma=-1e-3)
+    return SLQSpectrum(L, nsteps, seed, ndeflate, 'LA')
+
+def density_atoms(atoms, beta):
+    '''
+    Eigenvalues of the density matrix exp(beta*L)/tr from the atoms
+    of the spectrum of L
+    '''
+    (values, counts) = atoms
+    x = beta*values
+    return (np.exp(x - logsumexp(x, b=counts)), counts)
+
+def sorted_pair_sum(atomsA, atomsB, f):
+    '''
+    Sum of f(a_i, b_i) over the sorted eigenvalues a_i, b_i of two
+    spectra given as atoms, as in KLdivergence.  The counts of atomsB
+    are rescaled to the total of atomsA.
+    '''
+    (va, ca) = atomsA
+    (vb, cb) = atomsB
+    ia = np.argsort(va)
+    ib = np.argsort(vb)
+    (va, ca) = (va[ia], np.cumsum(ca[ia]))
+    (vb, cb) = (vb[ib], np.cumsum(cb[ib]))
+    cb = cb * ca[-1] / cb[-1]
+    breaks = np.union1d(ca, cb)
+    lengths = np.diff(np.concatenate([[0.0], breaks]))
+    mids = breaks - lengths/2.0
+    ja = np.minimum(np.searchsorted(ca, mids), len(va) - 1)
+    jb = np.minimum(np.searchsorted(cb, mids), len(vb) - 1)
+    return np.sum(lengths * f(va[ja], vb[jb]))
+
+def slq_estimate(spectra, func, tol=1e-3, min_probes=10, max_probes=200,
+                 block=10):
+    '''
+    Evaluate func on the atoms of SLQ spectra, adding probes to every
+    spectrum until the error is at most tol
+
+    Parameters
+    ----------
+    spectra : list
+        SLQSpectrum objects
+    func : function
+        Takes one atoms tuple per spectrum and returns a number
+    tol : float
+        Target error
+    min_probes, max_probes : int
+        Bounds on the number of probes per spectrum
+    block : int
+        Probes added between error checks
+
+    Returns
+    -------
+    value : float
+        Estimate from all probes
+    error : float
+        Jackknife standard error and Lanczos truncation bias, added in
+        quadrature (0 if every spectrum is exact)
+    '''
+    def evaluate(leave_out=None, halve_steps=False):
+        return func(*[S.atoms(leave_out,
+                              S.nsteps // 2 if halve_steps else None)
+                      for S in spectra])
+
+    for S in spectra:
+        S.add_probes(min_probes - S.nprobes)
+    while True:
+        value = evaluate()
+        nprobes = max(S.nprobes for S in spectra)
+        if nprobes < 2:
+            return (value, 0.0)
+        loo = np.array([evaluate(k) for k in range(nprobes)])
+        jackknife = np.sqrt((nprobes - 1) * np.mean((loo - np.mean(loo))**2))
+        bias = abs(value - evaluate(halve_steps=True))
+        error = np.hypot(jackknife, bias)
+        if error <= tol:
+            return (value, error)
+        if bias > tol:
+            # more probes do not reduce the truncation bias
+            warnings.warn('SLQ: error {:.3g} above tolerance {:.3g}: Lanczos truncation bias {:.3g}, raise nsteps'.format(
+                error, tol, bias))
+            return (value, error)
+        if nprobes >= max_probes:
+            warnings.warn('SLQ: error {:.3g} above tolerance {:.3g} after {} probes'.format(
+                error, tol, nprobes))
+            return (value, error)
+        for S in spectra:
+            S.add_probes(min(block, max_probes - nprobes))
+
+def expm_chebyshev(L, beta, shift=0.0, tol=1e-15):
+    '''
+    Function applying exp(beta*L - shift) to vectors, for a sparse
+    positive semidefinite L, from the Chebyshev expansion of exp on
+    [0, lmax] with lmax just above the largest eigenvalue of L.
+    The expansion is computed once and takes a fixed number of sparse
+    products per vector, where expm_multiply estimates norms on every
+    call.
+
+    Parameters
+    ----------
+    L : sparse matrix
+        Laplacian
+    beta : float
+        Inverse temperature
+    shift : float
+        Subtracted in the exponent, e.g. the log trace of exp(beta*L)
+    tol : float
+        Coefficients below tol times the first are dropped
+    '''
+    L = sp.csr_matrix(L, dtype=float)
+    # the error is relative to exp(beta*lmax): the bound must be tight
+    lmax = abs(L).sum(axis=1).max()
+    if L.shape[0] > 2:
+        lmax = min(lmax, 1.01*spsla.eigsh(L, 1, which='LA',
+                                          return_eigenvectors=False)[0])
+    lmax = max(lmax, 1e-12)
+    # with t = 2x/lmax - 1, exp(beta*x) = exp(c)*exp(c*t) and
+    # exp(c*t) = I_0(c) + 2*sum_k I_k(c)*T_k(t); ive(k, c) = I_k(c)*exp(-|c|)
+    c = beta*lmax/2.0
+    coefs = ive(np.arange(int(2*abs(c)) + 40), c)
+    coefs = coefs[:np.max(np.nonzero(np.abs(coefs) >= tol*coefs[0])) + 1]
+    coefs[1:] *= 2.0
+    coefs *= np.exp(c + abs(c) - shift)
+
+    def apply(v):
+        # three term recurrence T_(k+1)(t) = 2t T_k(t) - T_(k-1)(t)
+        t_prev = v
+        t_cur = (2.0/lmax)*(L @ v) - v
+        out = coefs[0]*t_prev + coefs[1]*t_cur if len(coefs) > 1 else coefs[0]*v
+        for a in coefs[2:]:
+            (t_prev, t_cur) = (t_cur, 2.0*((2.0/lmax)*(L @ t_cur) - t_cur) - t_prev)
+            out += a*t_cur
+        return out
+    return apply
+
+def _slq_seed(seed, k):
+    return None if seed is None else seed + k
+
+def entropy_slq(L, beta, tol=1e-3, nsteps=40, ndeflate=20, seed=None,
+                **kwargs):
+    '''
+    Approximate von Neumann entropy (bits) of the density matrix
+    exp(beta*L)/tr, as Entropy(densityMatrix(L, beta)).
+    See slq_estimate for tol and the other keyword arguments.
+
+    Returns
+    -------
+    (entropy, error) : tuple
+    '''
+    S = slq_laplacian_spectrum(L, beta, nsteps, seed, ndeflate)
+
+    def entropy(atoms):
+        (r, counts) = density_atoms(atoms, beta)
+        return -np.sum(counts * xlogy(r, r)) / np.log(2.0)
+    return slq_estimate([S], entropy, tol, **kwargs)
+
+def KLdivergence_slq(LA, LB, beta, tol=1e-3, nsteps=40, ndeflate=20,
+                     seed=None, **kwargs):
+    '''
+    Approximate KL divergence (bits) between the density matrices of two
+    Laplacians of the same shape, as
+    KLdivergence(densityMatrix(LA, beta), densityMatrix(LB, beta))
+
+    Returns
+    -------
+    (div, error) : tuple
+    '''
+    SA = slq_laplacian_spectrum(LA, beta, nsteps, seed, ndeflate)
+    SB = slq_laplacian_spectrum(LB, beta, nsteps, _slq_seed(seed, 1),
+                                ndeflate)
+
+    def kl(atomsA, atomsB):
+        return sorted_pair_sum(density_atoms(atomsA, beta),
+                               density_atoms(atomsB, beta), kl_terms)
+    return slq_estimate([SA, SB], kl, tol, **kwargs)
+
+def _js_atoms(atomsA, atomsB, rM, beta):
+    return 0.5*(sorted_pair_sum(density_atoms(atomsA, beta), rM, kl_terms) +
+                sorted_pair_sum(density_atoms(atomsB, beta), rM, kl_terms))
+
+def JS_lap_slq(LA, LB, beta, tol=1e-3, nsteps=40, ndeflate=20, seed=None,
+               **kwargs):
+    '''
+    Approximate JS divergence (bits) with the mean Laplacian (LA + LB)/2
+    as the reference, as JS_spectra and pyslsa.JS
+
+    Returns
+    -------
+    (div, error) : tuple
+    '''
+    LM = (sp.csr_matrix(LA) + sp.csr_matrix(LB)) / 2.0
+    spectra = [slq_laplacian_spectrum(L, beta, nsteps, _slq_seed(seed, k),
+                                      ndeflate)
+               for (k, L) in enumerate([LA, LB, LM])]
+
+    def js(atomsA, atomsB, atomsM):
+        return _js_atoms(atomsA, atomsB, density_atoms(atomsM, beta), beta)
+    return slq_estimate(spectra, js, tol, **kwargs)
+
+def JSdivergence_slq(LA, LB, beta, tol=1e-3, nsteps=40, ndeflate=20,
+                     seed=None, **kwargs):
+    '''
+    Approximate JS divergence (bits) between the density matrices
+    rho = exp(beta*LA)/tr and sigma = exp(beta*LB)/tr of two Laplacians
+    of the same shape, as JSdivergence(rho, sigma).
+    The mixture M = (rho + sigma)/2 is applied to vectors with
+    expm_chebyshev, using the traces estimated from the spectra of LA
+    and LB, and is never formed.
+
+    Returns
+    -------
+    (div, error) : tuple
+    '''
+    LA = sp.csc_matrix(LA)
+    LB = sp.csc_matrix(LB)
+    SA = slq_laplacian_spectrum(LA, beta, nsteps, seed, ndeflate)
+    SB = slq_laplacian_spectrum(LB, beta, nsteps, _slq_seed(seed, 1),
+                                ndeflate)
+
+    # log traces of exp(beta*L), to the requested tolerance
+    def logtr(atoms):
+        (values, counts) = atoms
+        return logsumexp(beta*values, b=counts)
+    (logZA, errA) = slq_estimate([SA], logtr, tol, **kwargs)
+    (logZB, errB) = slq_estimate([SB], logtr, tol, **kwargs)
+
+    expA = expm_chebyshev(LA, beta, logZA)
+    expB = expm_chebyshev(LB, beta, logZB)
+
+    def mixture(v):
+        return 0.5*(expA(v) + expB(v))
+    n = LA.shape[0]
+    SM = SLQSpectrum(spsla.LinearOperator((n, n), matvec=mixture,
+                                          dtype=float),
+                     nsteps, _slq_seed(seed, 2), ndeflate, 'LA')
+
+    def js(atomsA, atomsB, atomsM):
+        (m, counts) = atomsM
+        # M has unit trace: rescale the quadrature part of the spectrum,
+        # whose trace is an estimate, and keep the exact eigenvalues
+        m = np.maximum(m, 0.0)
+        k = len(SM.exact)
+        if k < len(m):
+            m[k:] *= (1.0 - np.sum(m[:k])) / np.sum(counts[k:]*m[k:])
+        return _js_atoms(atomsA, atomsB, (m, counts), beta)
+    return slq_estimate([SA, SB, SM], js, tol, **kwargs)
+
 ###############################################
 #### Graph and Population Tensor Functions ####
 ###############################################
@@ -9,82 +9,213 @@
 #### Deprecated
 
 import neuraltda.stimulus_space as ss 
+import neuraltda.simpComp as sc
+import neuraltda.spectral_divergence as sd
 import neuraltda.topology2 as tp2
 import h5py
 import os
+import json
+import hashlib
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import scipy.sparse as sp
 from joblib import Parallel, delayed
 import pycuslsa as pyslsa
 
-def pyslsa_compute_chain_group(poptens, thresh, trial):
+def pyslsa_compute_chain_group(poptens, thresh, trial, max_dim=None):
     '''
     Computes the chain complex using PySLSA
 
+    Parameters
+    ----------
+    max_dim : int
+        If not None, only simplices up to dimension max_dim are built.
+        Laplacians in dimension d need max_dim = d+1.
     '''
     popmat = poptens[:, :, trial]
     popmat_binary = ss.binnedtobinary(popmat, thresh)
     maxsimps = ss.binarytomaxsimplex(popmat_binary, rDup=True)
     maxsimps = sorted(maxsimps, key=len)
-    scgGens = pyslsa.build_SCG(maxsimps)
+    if max_dim is None:
+        scgGens = pyslsa.build_SCG(maxsimps)
+    else:
+        scgGens = pyslsa.build_SCG(maxsimps, max_dim)
     return scgGens
 
-def computeChainGroup(poptens, thresh, trial):
+def computeChainGroup(poptens, thresh, trial, max_dim=None):
     '''
-    Computes the Chain complex for the population data in poptens
+    Computes the Chain complex for the population data in poptens,
+    a trial major Ntrial x Ncell x Nwin tensor (see
+    topology2.open_population_memmap)
+    Only simplices up to dimension max_dim are built if max_dim is not None
     '''
 
     #print(trial)
-    popmat = poptens[:, :, trial]
+    popmat = poptens[trial]
     popmatbinary = ss.binnedtobinary(popmat, thresh)
     maxsimps = ss.binarytomaxsimplex(popmatbinary, rDup=True)
     # filter max simplices
     maxsimps = sorted(maxsimps, key=len)
     newms = maxsimps
     r = 1
-    scgGens = ss.simplicialChainGroups(newms)
+    scgGens = ss.simplicialChainGroups(newms, max_dim)
     return scgGens
 
 def parallel_compute_chain_group(bdf, stim, thresh):
-    poptens = np.array(bdf[stim]['pop_tens'])
     try:
-        (ncell, nwin, ntrial) = np.shape(poptens)
+        (ncell, nwin, ntrial) = tp2.population_tensor_shape(bdf[stim])
     except ValueError:
         print('Empty Poptens')
         return
     if  nwin == 0:
         return
     scgGenSave = dict()
-    scgGenSave = Parallel(n_jobs=14)(delayed(computeChainGroup)
-                                     (poptens, thresh, trial)
-                                     for trial in range(ntrial))
+    with tp2.open_population_memmap(bdf.filename, stim) as poptens:
+        scgGenSave = Parallel(n_jobs=14)(delayed(computeChainGroup)
+                                         (poptens, thresh, trial)
+                                         for trial in range(ntrial))
+
+###############################
+#### Chain Group Store ########
+###############################
+
+def scg_store_path(blockPath, binned_datafile, thresh, comment='',
+                   clusters=None, max_dim=None):
+    ''' Path of the chain group store of a binned file, threshold
+        and chain group parameters:
+        blockPath/scg/<binFileName>-<thresh>[-<comment>]-<hash>.scg
+        where hash is a short hash of clusters and max_dim, so stores
+        built with different parameters do not overwrite each other.
+    '''
+    (binFold, binFile) = os.path.split(binned_datafile)
+    (binFileName, binExt) = os.path.splitext(binFile)
+    scg_prefix = '-{}'.format(thresh)
+    if not (comment == ''):
+        scg_prefix = scg_prefix + '-{}'.format(comment)
+    if clusters is not None:
+        clusters = [int(c) for c in clusters]
+    params = json.dumps({'clusters': clusters, 'max_dim': max_dim},
+                        sort_keys=True)
+    scg_prefix = scg_prefix + '-{}'.format(
+        hashlib.sha1(params.encode()).hexdigest()[:8])
+    return os.path.join(blockPath, 'scg', binFileName + scg_prefix + '.scg')
+
+def scg_store_params(binned_datafile, thresh, clusters=None, max_dim=None):
+    ''' Parameters identifying the chain groups of a store.
+        The binned file is identified by name, size and modification time
+        so a rebinned file invalidates the store.
+    '''
+    st = os.stat(binned_datafile)
+    if clusters is not None:
+        clusters = [int(c) for c in clusters]
+    return {'binned_file': os.path.basename(binned_datafile),
+            'binned_size': st.st_size,
+            'binned_mtime': st.st_mtime,
+            'thresh': float(thresh),
+            'clusters': clusters,
+            'max_dim': max_dim}
+
+def save_scgs(scgf, stimGenSave, params=None):
+    ''' Saves a dict of per stim lists of SCGs to an HDF5 store.
+        Each trial is a uint8 dataset holding SCG.to_bytes().
+        The store is written to a temporary file and moved into place.
+
+    Parameters
+    ----------
+    scgf : str
+        Path of the store
+    stimGenSave : dict
+        stim -> list of SCGs, one per trial
+    params : dict
+        Parameters the SCGs were computed with (see scg_store_params)
+    '''
+    scgFold = os.path.dirname(scgf)
+    if scgFold and not os.path.exists(scgFold):
+        os.makedirs(scgFold)
+    tmpf = scgf + '.tmp'
+    with h5py.File(tmpf, 'w') as f:
+        f.attrs['params'] = json.dumps(params)
+        for stim, scgs in stimGenSave.items():
+            stimgrp = f.create_group(stim)
+            stimgrp.attrs['ntrials'] = len(scgs)
+            for trial, scg in enumerate(scgs):
+                stimgrp.create_dataset(str(trial),
+                                       data=np.frombuffer(scg.to_bytes(),
+                                                          dtype=np.uint8))
+    os.replace(tmpf, scgf)
+    return scgf
+
+def scg_store_valid(scgf, params=None):
+    ''' True if the store exists and was saved with params
+    '''
+    if not os.path.exists(scgf):
+        return False
+    try:
+        with h5py.File(scgf, 'r') as f:
+            saved = json.loads(f.attrs['params'])
+    except (OSError, KeyError, ValueError):
+        return False
+    # Round trip params through json so tuples and lists compare equal
+    return saved == json.loads(json.dumps(params))
+
+def load_scgs(scgf, stims=None):
+    ''' Loads the SCGs saved by save_scgs
+
+    Returns
+    -------
+    stimGenSave : dict
+        stim -> list of SCGs, one per trial
+    '''
+    stimGenSave = dict()
+    with h5py.File(scgf, 'r') as f:
+        if stims is None:
+            stims = list(f.keys())
+        for stim in stims:
+            stimgrp = f[stim]
+            stimGenSave[stim] = [
+                pyslsa.SCG.from_bytes(stimgrp[str(trial)][()].tobytes())
+                for trial in range(int(stimgrp.attrs['ntrials']))]
+    return stimGenSave
 
 def pyslsa_compute_chain_groups_binned(blockPath, binned_datafile,
                        thresh, comment='',
                        shuffle=False, clusters=None,
-                       nperms=None, ncellsperm=30):
+                       nperms=None, ncellsperm=30, max_dim=None):
     ''' Takes a binned data file and computes the chain group 
         generators and saves them
         Output file has 3 params in name:  Winsize-dtOverlap-Thresh.scg
+        Only simplices up to dimension max_dim are built if max_dim is not None
+        Unshuffled, unpermuted chain groups are saved to the chain group
+        store (see save_scgs) and loaded from it when it matches
+        the binned file and parameters.
     '''
+    store = not (shuffle or nperms)
+    if store:
+        scgf = scg_store_path(blockPath, binned_datafile, thresh, comment,
+                              clusters, max_dim)
+        params = scg_store_params(binned_datafile, thresh, clusters, max_dim)
+        if scg_store_valid(scgf, params):
+            print('Loading Chain Groups: {}'.format(scgf))
+            return load_scgs(scgf)
     print('Computing Chain Groups...')
     with h5py.File(binned_datafile, 'r') as bdf:
         stims = bdf.keys()
         print(stims)
         stimGenSave = dict()
         for ind, stim in enumerate(stims):
-            binned_clusters = np.array(bdf[stim]['clusters'])
-            poptens = np.array(bdf[stim]['pop_tens'])
             print('Stim: {}, Clusters:{}'.format(stim, str(clusters)))
             try:
-                if clusters is not None:
-                    poptens = poptens[np.in1d(binned_clusters, clusters), :, :]
-                    print("Selecting Clusters: poptens:" 
-                            + str(np.shape(poptens)))
-                (ncell, nwin, ntrial) = np.shape(poptens)
+                (ncell, nwin, ntrial) = tp2.population_tensor_shape(bdf[stim],
+                                                                   clusters)
             except (ValueError, IndexError):
                 print('Poptens Error')
                 continue
+            if  nwin == 0:
+                continue
+            if shuffle or nperms:
+                poptens = tp2.read_population_tensor(bdf[stim],
+                                                     clusters=clusters)
             if shuffle:
                 poptens = tp2.build_shuffled_data_tensor(poptens, 1)
                 poptens = poptens[:, :, :, 0]
@@ -96,41 +227,34 @@ def pyslsa_compute_chain_groups_binned(blockPath, binned_datafile,
                 poptens = np.reshape(poptens,
                         (ncellsperm, nwin, ntrial*nperms))
                 ntrial = ntrial*nperms
-            if  nwin == 0:
-                continue
             print('Calling PySLSA...')
             scgGenSave = []
             for trial in range(ntrial):
-                 scgGenSave.append(pyslsa_compute_chain_group(poptens, thresh, trial))
+                if not (shuffle or nperms):
+                    # Only read this trial from the binned file
+                    poptens = tp2.read_population_tensor(bdf[stim], [trial],
+                                                         clusters)
+                    scgGenSave.append(pyslsa_compute_chain_group(poptens,
+                                                                 thresh, 0,
+                                                                 max_dim))
+                else:
+                    scgGenSave.append(pyslsa_compute_chain_group(poptens,
+                                                                 thresh,
+                                                                 trial,
+                                                                 max_dim))
             stimGenSave[stim] = scgGenSave
+    if store:
+        save_scgs(scgf, stimGenSave, params)
     return stimGenSave
-    # Create output filename
-    #(binFold, binFile) = os.path.split(binned_datafile)
-    #(binFileName, binExt) = os.path.splitext(binFile)
-    #scg_prefix = '-{}'.format(thresh)
-    #if not (comment == ''):
-    #    scg_prefix = scg_prefix + '-{}'.format(comment)
-    #scgGenFile = binFileName + scg_prefix + '.scg'
-
-    # Create scg Folder
-    #scgFold = os.path.join(blockPath, 'scg/')
-    #if not os.path.exists(scgFold):
-    #    os.makedirs(scgFold)
-
-    # Create output file
-    #scgGenFile = os.path.join(scgFold, scgGenFile)
-    #with open(scgGenFile, 'wb') as scggf:
-    #    #print(stimGenSave)
-    #    pickle.dump(stimGenSave, scggf)
-    #return scgGenFile
 
 def computeChainGroups(blockPath, binned_datafile,
                        thresh, comment='',
                        shuffle=False, clusters=None,
-                       nperms=None, ncellsperm=30):
+                       nperms=None, ncellsperm=30, max_dim=None):
     ''' Takes a binned data file and computes the chain group 
         generators and saves them
         Output file has 3 params in name:  Winsize-dtOverlap-Thresh.scg
+        Only simplices up to dimension max_dim are built if max_dim is not None
     '''
     print('Computing Chain Groups...')
     with h5py.File(binned_datafile, 'r') as bdf:
@@ -138,18 +262,27 @@ def computeChainGroups(blockPath, binned_datafile,
         print(stims)
         stimGenSave = dict()
         for ind, stim in enumerate(stims):
-            binned_clusters = np.array(bdf[stim]['clusters'])
-            poptens = np.array(bdf[stim]['pop_tens'])
             print('Stim: {}, Clusters:{}'.format(stim, str(clusters)))
             try:
-                if clusters is not None:
-                    poptens = poptens[np.in1d(binned_clusters, clusters), :, :]
-                    print("Selecting Clusters: poptens:" 
-                            + str(np.shape(poptens)))
-                (ncell, nwin, ntrial) = np.shape(poptens)
+                (ncell, nwin, ntrial) = tp2.population_tensor_shape(bdf[stim],
+                                                                   clusters)
             except (ValueError, IndexError):
                 print('Poptens Error')
                 continue
+            if  nwin == 0:
+                continue
+            if not (shuffle or nperms):
+                # Workers get a memory-mapped tensor and read their trial
+                print('Starting jobs...')
+                with tp2.open_population_memmap(binned_datafile, stim,
+                                                clusters) as poptens:
+                    scgGenSave = Parallel(n_jobs=14)(
+                        delayed(computeChainGroup)(poptens, thresh, trial,
+                                                   max_dim)
+                        for trial in range(ntrial))
+                stimGenSave[stim] = scgGenSave
+                continue
+            poptens = tp2.read_population_tensor(bdf[stim], clusters=clusters)
             if shuffle:
                 poptens = tp2.build_shuffled_data_tensor(poptens, 1)
                 poptens = poptens[:, :, :, 0]
@@ -161,11 +294,12 @@ def computeChainGroups(blockPath, binned_datafile,
                 poptens = np.reshape(poptens,
                         (ncellsperm, nwin, ntrial*nperms))
                 ntrial = ntrial*nperms
-            if  nwin == 0:
-                continue
+            # trial major, as open_population_memmap
+            poptens = np.ascontiguousarray(np.transpose(poptens, (2, 0, 1)))
             print('Starting jobs...')
             scgGenSave = Parallel(n_jobs=14)(delayed(computeChainGroup)
-                    (poptens, thresh, trial) for trial in range(ntrial))
+                    (poptens, thresh, trial, max_dim)
+                    for trial in range(ntrial))
             stimGenSave[stim] = scgGenSave
 
     # Create output filename
@@ -218,12 +352,20 @@ def computeSimplicialLaplacians(scgf):
     with open(LapFile, 'w') as lpf:
         pickle.dump(LapDict, lpf)
 
-def compute_JS_expanded(scgA, scgB, d, beta):
+def compute_JS_expanded(scgA, scgB, d, beta, approx=False, tol=1e-3,
+                        return_error=False, **slq_args):
     '''
     Computes the Jensen-Shannon Divergence between
     simplicial complexes A and B in dimension d
     using parameter beta.
     The bases are expanded according to reconcile_laplacians
+
+    With approx=True the divergence is estimated by stochastic Lanczos
+    quadrature on the sparse Laplacians (see simpComp.JSdivergence_slq)
+    to an error of about tol, instead of forming the density
+    matrices.  slq_args (nsteps, ndeflate, seed, max_probes, ...) are
+    passed on.  With return_error=True, returns (div, error); the error
+    of the exact computation is 0.
     '''
     # print('Computing Boundary Operators')
     # DA = ss.boundaryOperatorMatrix(scgA)
@@ -231,18 +373,20 @@ def compute_JS_expanded(scgA, scgB, d, beta):
     #print('Computing Laplacians')
 
     # Compute Laplacian Matrices in dimension d
-    LA = ss.compute_laplacian(scgA, d)
-    LB = ss.compute_laplacian(scgB, d)
+    LA = sc.compute_laplacian(scgA, d, sparse=True)
+    LB = sc.compute_laplacian(scgB, d, sparse=True)
 
     # Reconcile Laplacians
     (LA, LB) = sc.reconcile_laplacians(LA, LB)
 
-    # Computing Density Matrices
-    rho1 = sc.densityMatrix(LA, beta)
-    rho2 = sc.densityMatrix(LB, beta)
-
-    # Computing JS divergence
-    div = sc.JSdivergence(rho1, rho2)
+    if approx:
+        (div, error) = sc.JSdivergence_slq(LA, LB, beta, tol, **slq_args)
+    else:
+        # JS divergence from the eigendecompositions of the Laplacians
+        div = sd.JS_laplacians(LA, LB, beta)
+        error = 0.0
+    if return_error:
+        return (div, error)
     return div
 
 def compute_JS_expanded_SSG(scgA, scgB, beta):
@@ -261,12 +405,8 @@ def compute_JS_expanded_SSG(scgA, scgB, beta):
     #print('Reconciling Laplacians')
     (LA, LB) = sc.reconcile_laplacians(LA, LB)
 
-    #print('Computing Density Matrices')
-    rho1 = sc.densityMatrix(LA, beta)
-    rho2 = sc.densityMatrix(LB, beta)
-
     #print('Computing JS divergence')
-    div = sc.JSdivergence(rho1, rho2)
+    div = sd.JS_laplacians(LA, LB, beta)
     return div
 
 
@@ -277,15 +417,131 @@ def compute_JS_expanded_negativeL(scgA, scgB, d, beta):
     LA = sc.laplacian(DA, d)
     LB = sc.laplacian(DB, d)
     (LA, LB) = sc.reconcile_laplacians(LA, LB)
-    rho1 = sc.densityMatrix(-1.0*LA, beta)
-    rho2 = sc.densityMatrix(-1.0*LB, beta)
-    div = sc.JSdivergence(rho1, rho2)
+    div = sd.JS_laplacians(-1.0*LA, -1.0*LB, beta)
     return div
 
-def compute_entropy(scgA, d, beta):
-
-    DA = sc.boundaryOperatorMatrix(scgA)
-    LA = sc.laplacian(DA, d)
-    rho1 = sc.densityMatrix(LA, beta)
-    div = sc.Entropy(rho1)
-    return div
+def compute_entropy(scgA, d, beta, approx=False, tol=1e-3,
+                    return_error=False, **slq_args):
+    '''
+    Von Neumann entropy of the density matrix of scgA in dimension d.
+    With approx=True the entropy is estimated by stochastic Lanczos
+    quadrature (see simpComp.entropy_slq) to an error of about
+    tol.  With return_error=True, returns (entropy, error); the error
+    of the exact computation is 0.
+    '''
+    LA = sc.compute_laplacian(scgA, d, sparse=True)
+    if approx:
+        (ent, error) = sc.entropy_slq(LA, beta, tol, **slq_args)
+    else:
+        ent = sd.entropy_laplacian(LA, beta)
+        error = 0.0
+    if return_error:
+        return (ent, error)
+    return ent
+
+########################################
+#### Batched Pairwise Divergences  #####
+########################################
+
+def pairwise_divergence(scgs_a, scgs_b, dims, betas, metric='KL', njobs=None):
+    '''
+    Computes the divergence between every pair of PySLSA simplicial
+    complexes from scgs_a and scgs_b, in every dimension and for every
+    beta, in one call.
+    The Laplacian spectrum of each SCG is computed once per dimension
+    (it is cached on the SCG) and every pair then costs one
+    KL_betas/JS_betas call for all betas.  The work runs in a thread
+    pool; PySLSA releases the GIL during these computations.
+    JS is symmetric, so when scgs_b holds the same SCGs as scgs_a only
+    the upper triangle is computed.
+
+    Parameters
+    ----------
+    scgs_a, scgs_b : list
+        PySLSA SCGs, e.g. the trials of two stimuli
+    dims : list
+        Laplacian dimensions
+    betas : list
+        Inverse temperatures
+    metric : str
+        'KL' or 'JS'
+    njobs : int
+        Number of threads.  None uses the ThreadPoolExecutor default
+
+    Returns
+    -------
+    divs : numpy array
+        (len(scgs_a), len(scgs_b), len(dims), len(betas)) array.
+        divs[i, j, l, k] is the divergence of scgs_a[i] from scgs_b[j]
+        in dimension dims[l] for betas[k]
+    '''
+    assert metric in ['KL', 'JS'], 'Unknown metric {}'.format(metric)
+    div_func = {'KL': pyslsa.KL_betas, 'JS': pyslsa.JS_betas}[metric]
+    betas = [float(beta) for beta in betas]
+    (na, nb) = (len(scgs_a), len(scgs_b))
+    divs = np.zeros((na, nb, len(dims), len(betas)))
+    symmetric = (metric == 'JS' and na == nb and
+                 all(a is b for (a, b) in zip(scgs_a, scgs_b)))
+
+    # Each SCG once, in each dimension
+    unique_scgs = list({id(scg): scg for scg in
+                        list(scgs_a) + list(scgs_b)}.values())
+    spectrum_tasks = [(scg, dim) for scg in unique_scgs for dim in dims]
+    pairs = [(i, j) for i in range(na) for j in range(nb)
+             if not (symmetric and j < i)]
+
+    def pair_divergences(pair):
+        (i, j) = pair
+        return [div_func(scgs_a[i], scgs_b[j], dim, betas) for dim in dims]
+
+    with ThreadPoolExecutor(njobs) as pool:
+        list(pool.map(lambda task: task[0].spectrum(task[1]),
+                      spectrum_tasks))
+        for ((i, j), pair_divs) in zip(pairs,
+                                       pool.map(pair_divergences, pairs)):
+            divs[i, j] = pair_divs
+            if symmetric:
+                divs[j, i] = pair_divs
+    return divs
+
+def pyslsa_sparse_laplacian(scg, dim):
+    '''
+    Laplacian of a PySLSA SCG in dimension dim as a sparse (CSR) matrix,
+    assembled from the sparse boundary operators of the SCG.
+    As pyslsa, an empty chain group gives a 1x1 zero matrix.
+    '''
+    def boundary(d):
+        (rows, cols, vals, shape) = scg.boundary(d)
+        return sp.csr_matrix((vals, (rows, cols)), shape=shape, dtype=float)
+
+    D = boundary(dim)
+    D1 = boundary(dim + 1)
+    L = sp.csr_matrix((D.T @ D) + (D1 @ D1.T))
+    if L.shape[0] == 0:
+        return sp.csr_matrix((1, 1))
+    return L
+
+def pyslsa_divergence_slq(scgA, scgB, dim, beta, metric='JS', tol=1e-3,
+                          **slq_args):
+    '''
+    Approximate KL or JS divergence between PySLSA SCGs in dimension dim,
+    for complexes too large for pyslsa.KL / pyslsa.JS, which need every
+    eigenvalue.  Estimated by stochastic Lanczos quadrature on the sparse
+    Laplacians to an error of about tol (see
+    simpComp.KLdivergence_slq and simpComp.JS_lap_slq; slq_args are
+    passed on).  JS uses the mean Laplacian, as pyslsa.JS.
+
+    Returns
+    -------
+    (div, error) : tuple
+    '''
+    assert metric in ['KL', 'JS'], 'Unknown metric {}'.format(metric)
+    (LA, LB) = [sp.coo_matrix(pyslsa_sparse_laplacian(scg, dim))
+                for scg in [scgA, scgB]]
+
+    # Expand both bases with zeros, keeping the order of A and B
+    n = max(LA.shape[0], LB.shape[0])
+    (LA, LB) = [sp.csr_matrix((L.data, (L.row, L.col)), shape=(n, n))
+                for L in [LA, LB]]
+    div_func = {'KL': sc.KLdivergence_slq, 'JS': sc.JS_lap_slq}[metric]
+    return div_func(LA, LB, beta, tol, **slq_args)
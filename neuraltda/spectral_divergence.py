@@ -0,0 +1,132 @@
+################################################################################
+## Spectral KL/JS divergences and entropies of Laplacian density matrices    ##
+## rho = exp(beta*L)/tr exp(beta*L), computed from symmetric eigen-          ##
+## decompositions of the Laplacians instead of matrix exponentials.         ##
+## Same values as simpComp.densityMatrix followed by simpComp.KLdivergence, ##
+## JSdivergence, JSdivergence_BDD and Entropy, and built on the same        ##
+## spectral helpers in simpComp.                                            ##
+################################################################################
+
+import numpy as np
+import scipy.linalg as spla
+
+from neuraltda import simpComp as sc
+
+##################################
+#### Density Matrix Spectra  #####
+##################################
+
+def density_eigvals(ev, betas):
+    '''
+    Sorted eigenvalues of exp(beta*L)/tr for each beta from the
+    eigenvalues ev of L, via simpComp.log_density_spectra.  The order
+    of ev is reversed for beta < 0, so each row is sorted again.
+
+    Returns
+    -------
+    p : numpy array
+        (len(betas), len(ev)) array
+    '''
+    return np.sort(np.exp(sc.log_density_spectra(ev, betas)), axis=1)
+
+def mixture_eigvals(pA, UA, pB, UB):
+    '''
+    Eigenvalues (ascending) of the mixture M = (rho + sigma)/2 of two
+    density matrices of the same shape, from the eigenvalues p and the
+    eigenvectors U they share with their Laplacians: rho = U diag(p) U^T.
+    M is assembled without matrix exponentials.
+    '''
+    M = 0.5*((UA * pA) @ UA.T + (UB * pB) @ UB.T)
+    return spla.eigh(M, eigvals_only=True, driver='evd', check_finite=False,
+                     overwrite_a=True)
+
+##################################
+#### Laplacian Divergences   #####
+##################################
+
+def _per_beta(values, betas):
+    values = np.asarray(values)
+    if np.ndim(betas) == 0:
+        return values[0]
+    return values
+
+def entropy_laplacian(L, betas):
+    '''
+    Von Neumann entropy (bits) of exp(beta*L)/tr for each beta,
+    as simpComp.Entropy(simpComp.densityMatrix(L, beta)).
+    One eigendecomposition for all betas.
+
+    Returns
+    -------
+    entropy : float or numpy array
+        One entropy per beta (a float if betas is a scalar)
+    '''
+    P = density_eigvals(sc.laplacian_spectrum(L), np.atleast_1d(betas))
+    return _per_beta([sc.entropy_eigvals(p) for p in P], betas)
+
+def KL_laplacians(LA, LB, betas):
+    '''
+    KL divergence (bits) between the density matrices of two Laplacians
+    of the same shape for each beta, as
+    simpComp.KLdivergence(densityMatrix(LA, beta), densityMatrix(LB, beta)).
+    One eigendecomposition per Laplacian for all betas.
+
+    Returns
+    -------
+    div : float or numpy array
+        One divergence per beta (a float if betas is a scalar)
+    '''
+    b = np.atleast_1d(betas)
+    PA = density_eigvals(sc.laplacian_spectrum(LA), b)
+    PB = density_eigvals(sc.laplacian_spectrum(LB), b)
+    return _per_beta([sc.KLdivergence_eigvals(r, s) for (r, s) in zip(PA, PB)],
+                     betas)
+
+def JS_laplacians(LA, LB, betas):
+    '''
+    JS divergence (bits) between the density matrices rho and sigma of
+    two Laplacians of the same shape for each beta, as
+    simpComp.JSdivergence(densityMatrix(LA, beta), densityMatrix(LB, beta)):
+    the mean of the KL divergences of rho and sigma from M = (rho + sigma)/2.
+    One eigendecomposition per Laplacian for all betas, and one of
+    the mixture per beta.
+
+    Returns
+    -------
+    div : float or numpy array
+        One divergence per beta (a float if betas is a scalar)
+    '''
+    b = np.atleast_1d(betas)
+    (evA, UA) = sc.laplacian_spectrum(LA, eigenvectors=True)
+    (evB, UB) = sc.laplacian_spectrum(LB, eigenvectors=True)
+    PA = np.exp(sc.log_density_spectra(evA, b))
+    PB = np.exp(sc.log_density_spectra(evB, b))
+    divs = []
+    for (pA, pB) in zip(PA, PB):
+        m = mixture_eigvals(pA, UA, pB, UB)
+        divs.append(0.5*(sc.KLdivergence_eigvals(np.sort(pA), m) +
+                         sc.KLdivergence_eigvals(np.sort(pB), m)))
+    return _per_beta(divs, betas)
+
+def JS_BDD_laplacians(LA, LB, betas):
+    '''
+    Entropy form of the JS divergence (bits): S(M) - (S(rho) + S(sigma))/2
+    with M = (rho + sigma)/2, as simpComp.JSdivergence_BDD on the density
+    matrices of two Laplacians of the same shape, for each beta.
+
+    Returns
+    -------
+    div : float or numpy array
+        One divergence per beta (a float if betas is a scalar)
+    '''
+    b = np.atleast_1d(betas)
+    (evA, UA) = sc.laplacian_spectrum(LA, eigenvectors=True)
+    (evB, UB) = sc.laplacian_spectrum(LB, eigenvectors=True)
+    PA = np.exp(sc.log_density_spectra(evA, b))
+    PB = np.exp(sc.log_density_spectra(evB, b))
+    divs = []
+    for (pA, pB) in zip(PA, PB):
+        m = mixture_eigvals(pA, UA, pB, UB)
+        divs.append(sc.entropy_eigvals(m) - 0.5*(sc.entropy_eigvals(pA) +
+                                                 sc.entropy_eigvals(pB)))
+    return _per_beta(divs, betas)
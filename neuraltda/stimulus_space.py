@@ -10,6 +10,8 @@ import networkx as nx
 from sklearn.manifold import MDS 
 from sklearn.decomposition import PCA
 
+import neuraltda.simpComp as sc
+
 ###############################################
 #### Graph and Population Tensor Functions ####
 ###############################################
@@ -159,6 +161,31 @@ def binarytomaxsimplex(binMat, rDup=False, clus=None, ):
 #             stims[cg] = stimulus[ind, :]
 #     return (MaxSimps, stims)
 
+def simplicialChainGroups(maxsimps, max_dim=None):
+    '''
+    Computes the generators of the chain groups of the complex generated
+    by maxsimps with the bitmask face closure in simpComp.
+
+    Parameters
+    ----------
+    maxsimps : list of tuples
+        list of the maximal simplices in the complex
+    max_dim : int
+        Highest simplex dimension to generate.  All if None
+
+    Returns
+    -------
+    E : list of lists
+        E[k] is the sorted list of simplices (tuples) with k vertices
+    '''
+    return sc.simplicialChainGroups(maxsimps, max_dim)
+
+def chain_group_arrays(maxsimps, max_dim=None):
+    '''
+    As simplicialChainGroups, but E[k] is an (n_k, k) array
+    '''
+    return sc.chain_group_arrays(maxsimps, max_dim)
+
 def adjacency2maxsimp(adjmat, basis):
     '''
     Converts an adjacency matrix to a list of maximum 1-simplices (edges),
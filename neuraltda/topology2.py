@@ -14,14 +14,22 @@ import logging
 import datetime
 import tqdm
 import tempfile
+import json
+import hashlib
+import shutil
+import fcntl
+import zlib
+import concurrent.futures
+from contextlib import contextmanager
 
 import numpy as np
+import pandas as pd
 import h5py
-from scipy.interpolate import interp1d
 
 from ephys import events, core
 
 import neuraltda.simpComp as sc
+import neuraltda.homology as hom
 
 ################################
 ###### Module Definitions ######
@@ -32,6 +40,25 @@ TOPOLOGY_LOG = logging.getLogger('NeuralTDA')
 # Path to MCMC Sampler from Young et al. 2017
 SCM_EXECUTABLE = '/home/brad/bin/mcmc_sampler'
 
+# Binning cache: bump the version whenever the binned file contents change
+BINNING_CACHE_VERSION = 1
+BINNING_CACHE_MANIFEST = 'binned_data/binning_cache.json'
+BINNING_CACHE_MAX_BYTES = 50*(1024**3)
+
+# build_activity_tensors_multi counts spikes on the gcd of the window steps
+# only if that bin is at least MULTI_MIN_FINE_BIN samples and the fine grid
+# has at most MULTI_MAX_FINE_RATIO times as many bins as all window sizes
+# together.  Otherwise each window size is binned separately.
+MULTI_MIN_FINE_BIN = 8
+MULTI_MAX_FINE_RATIO = 4
+
+# open_population_memmap reorders the population tensor to trial major
+# order reading at most this many bytes of trials at a time
+POPTENS_MEMMAP_BLOCK_BYTES = 256*(1024**2)
+
+# Betti number computation backends (see calc_bettis)
+BETTI_BACKENDS = ['perseus', 'native', 'incremental']
+
 #################################
 ###### Auxiliary Functions ######
 #################################
@@ -79,6 +106,57 @@ def setup_logging(func_name):
     # Log initialization
     logger.info('Starting {}.'.format(func_name))
 
+class SpikeIndex:
+    '''
+    Spike times and cluster IDs sorted by recording and time_samples,
+    so that the spikes in a time window can be found by binary search.
+    Build once per recording and reuse it for every trial.
+
+    Parameters
+    ----------
+    spikes : pandas DataFrame
+        Contains the spike data (see ephys.core)
+    '''
+
+    def __init__(self, spikes):
+        recs = pd.to_numeric(spikes['recording']).values
+        times = pd.to_numeric(spikes['time_samples']).values
+        clusters = pd.to_numeric(spikes['cluster']).values
+        order = np.lexsort((times, recs))
+        self.time_samples = np.ascontiguousarray(times[order])
+        self.clusters = np.ascontiguousarray(clusters[order])
+
+        # Offsets of each recording in the sorted arrays
+        recs = recs[order]
+        (rec_ids, starts) = np.unique(recs, return_index=True)
+        stops = np.append(starts[1:], len(recs))
+        self.offsets = {rec: (start, stop) for (rec, start, stop)
+                        in zip(rec_ids, starts, stops)}
+
+    def __len__(self):
+        return len(self.time_samples)
+
+    def window_bounds(self, window, rec):
+        '''
+        Returns the [start, stop) indices into the sorted arrays
+        of the spikes from recording rec within window (inclusive)
+        '''
+        if rec not in self.offsets:
+            return (0, 0)
+        (start, stop) = self.offsets[rec]
+        rec_times = self.time_samples[start:stop]
+        lo = start + np.searchsorted(rec_times, window[0], side='left')
+        hi = start + np.searchsorted(rec_times, window[1], side='right')
+        return (lo, hi)
+
+    def get_window(self, window, rec):
+        '''
+        Returns views of the spike times and cluster IDs
+        of the spikes from recording rec within window (inclusive)
+        '''
+        (lo, hi) = self.window_bounds(window, rec)
+        return (self.time_samples[lo:hi], self.clusters[lo:hi])
+
 def get_spikes_in_window(spikes, window, rec):
     '''
     Returns a spike DataFrame containing all spikes within a time window.
@@ -86,7 +164,7 @@ def get_spikes_in_window(spikes, window, rec):
 
     Parameters
     ----------
-    spikes : pandas DataFrame
+    spikes : pandas DataFrame or SpikeIndex
         Contains the spike data (see ephys.core)
     window : tuple
         The lower and upper bounds, in samples,
@@ -98,8 +176,12 @@ def get_spikes_in_window(spikes, window, rec):
     -------
     spikes_in_window : pandas DataFrame
         DataFrame with same layout as input spikes
-        but containing only spikes within window
+        but containing only spikes within window.
+        If spikes is a SpikeIndex, a tuple (time_samples, clusters)
+        of array views is returned instead.
     '''
+    if isinstance(spikes, SpikeIndex):
+        return spikes.get_window(window, rec)
     mask = ((spikes['time_samples'] <= window[1]) &
             (spikes['time_samples'] >= window[0]) &
             (spikes['recording'] == rec))
@@ -283,7 +365,7 @@ def calc_cell_groups(data_mat, clusters, thresh):
         cell_groups.append([win, clus_in_group])
     return cell_groups
 
-def calc_bettis(data_mat, clusters, pfile, thresh):
+def calc_bettis(data_mat, clusters, pfile, thresh, backend='perseus'):
     '''
     Calculate betti numbers from binned firing rates.
 
@@ -297,6 +379,12 @@ def calc_bettis(data_mat, clusters, pfile, thresh):
         name of file to store intermediate computations
     thresh : float
         Multiple of average firing rate to consider a cell 'active'
+    backend : str
+        'perseus' runs the Perseus executable on pfile.
+        'native' computes the bettis in process (see homology.py)
+        and does not write pfile.
+        'incremental' adds the cell groups window by window and
+        returns a betti vector for every window (see homology.py).
 
     Returns
     -------
@@ -305,7 +393,12 @@ def calc_bettis(data_mat, clusters, pfile, thresh):
         Each element is [<filtration_time>, <betti_vals_list>]
         Returns [-1, [-1]] on error
     '''
+    assert backend in BETTI_BACKENDS, 'Unknown backend: {}'.format(backend)
     cell_groups = calc_cell_groups(data_mat, clusters, thresh)
+    if backend == 'native':
+        return hom.calc_bettis_from_cell_groups(cell_groups)
+    if backend == 'incremental':
+        return hom.calc_bettis_incremental(cell_groups)
     build_perseus_persistent_input(cell_groups, pfile)
     betti_file = run_perseus(pfile)
     bettis = []
@@ -402,7 +495,7 @@ def prep_paths(analysis_id, binned_data_file, block_path, shuffle, nperms):
 
 def calc_CI_bettis_tensor(analysis_id, binned_data_file,
                           block_path, thresh, shuffle=False, nperms=0,
-                          ncellsperm=1, clusters=None):
+                          ncellsperm=1, clusters=None, backend='perseus'):
     '''
     Given a binned data file, compute the betti numbers of the Curto-Itskov
 
@@ -416,6 +509,11 @@ def calc_CI_bettis_tensor(analysis_id, binned_data_file,
         Path to the folder containing the data for the block
     thresh : float
         Threshold to use when identifying cell groups
+    clusters : list
+        Clusters to include.  All clusters if None.  Earlier versions
+        ignored this argument and always used every binned cluster.
+    backend : str
+        Betti computation backend (see calc_bettis)
     '''
     (analysis_id, analysis_path) = prep_paths(analysis_id, binned_data_file,
                                               block_path, shuffle, nperms)
@@ -430,10 +528,11 @@ def calc_CI_bettis_tensor(analysis_id, binned_data_file,
                                                 stim)
             bpd = dict()
             ### Compute Bettis
-            poptens = np.array(stim_trials['pop_tens'])
-            clusters = np.array(stim_trials['clusters'])
-            bpd = do_compute_betti(poptens, clusters, pfs, thresh,
-                                   shuffle, nperms, ncellsperm)
+            poptens = read_population_tensor(stim_trials, clusters=clusters)
+            stim_clusters = binned_clusters[select_clusters(binned_clusters,
+                                                            clusters)]
+            bpd = do_compute_betti(poptens, stim_clusters, pfs, thresh,
+                                   shuffle, nperms, ncellsperm, backend)
             bpd_withstim[stim] = bpd
             with open(bps, 'wb') as bpfile:
                 pickle.dump(bpd, bpfile)
@@ -446,7 +545,7 @@ def calc_CI_bettis_tensor(analysis_id, binned_data_file,
 
 def calc_CI_bettis_tensor_trialavg(analysis_id, binned_data_file,
                           block_path, thresh, shuffle=False, nperms=0,
-                          ncellsperm=1, clusters=None):
+                          ncellsperm=1, clusters=None, backend='perseus'):
     '''
     Given a binned data file, compute the betti numbers of the Curto-Itskov
     Average all trials for a given stim before computing bettis
@@ -460,6 +559,8 @@ def calc_CI_bettis_tensor_trialavg(analysis_id, binned_data_file,
         Path to the folder containing the data for the block
     thresh : float
         Threshold to use when identifying cell groups
+    backend : str
+        Betti computation backend (see calc_bettis)
     '''
     (analysis_id, analysis_path) = prep_paths(analysis_id, binned_data_file,
                                               block_path, shuffle, nperms)
@@ -474,13 +575,14 @@ def calc_CI_bettis_tensor_trialavg(analysis_id, binned_data_file,
                                                 stim)
             bpd = dict()
             ### Compute Bettis
-            poptens = np.array(stim_trials['pop_tens'])
+            poptens = read_population_tensor(stim_trials)
             clusters = np.array(stim_trials['clusters'])
 
             ## do trialaverage
             poptens = np.mean(poptens, axis=2)
             bpd = do_compute_betti(poptens[:, :, np.newaxis], clusters, pfs,
-                                   thresh, shuffle, nperms, ncellsperm)
+                                   thresh, shuffle, nperms, ncellsperm,
+                                   backend)
             bpd_withstim[stim] = bpd
             with open(bps, 'wb') as bpfile:
                 pickle.dump(bpd, bpfile)
@@ -491,12 +593,13 @@ def calc_CI_bettis_tensor_trialavg(analysis_id, binned_data_file,
         return (bpdws_sfn, bpd_withstim)
 
 def do_compute_betti(poptens, clusters, pfile_stem, thresh,
-                     shuffle, nperms, ncellsperm):
+                     shuffle, nperms, ncellsperm, backend='perseus'):
 
     '''
     Function to actually perform the betti number computation
+    backend selects how bettis are computed (see calc_bettis)
     '''
-    data_tensor = np.array(poptens)
+    data_tensor = np.asarray(poptens)
     clusters = np.array(clusters)
     levels = (data_tensor.shape)[2:] # First two axes are cells, windows.
     assert len(levels) == 1, 'Cant handle more than one level yet'
@@ -515,30 +618,33 @@ def do_compute_betti(poptens, clusters, pfile_stem, thresh,
                 if shuffle:
                     nmat = get_shuffle(nmat)
                 perm_clus = clusters[perm_cells[:, perm]]
-                bettis = calc_bettis(nmat, perm_clus, pfile, thresh)
+                bettis = calc_bettis(nmat, perm_clus, pfile, thresh,
+                                     backend)
                 bettipermdict[str(perm)] = {'bettis': bettis}
             bettidict[str(trial)] = bettipermdict
         else:
             if shuffle:
                 data_mat = get_shuffle(data_mat)
                 pfile = get_pfile_name(pfile_stem, rep=trial, shuffled=1)
-            bettis = calc_bettis(data_mat, clusters, pfile, thresh)
+            bettis = calc_bettis(data_mat, clusters, pfile, thresh, backend)
             bettidict[str(trial)] = {'0': {'bettis': bettis}}
     return bettidict
 
-def get_shuffle(data_mat):
+def get_shuffle(data_mat, rng=np.random):
     '''
     Shuffles a data matrix, each cell independently in time
+    rng is the random number generator to use (e.g. a RandomState)
     '''
     (cells, wins) = data_mat.shape
     for cell in range(cells):
-        np.random.shuffle(data_mat[cell, :])
+        rng.shuffle(data_mat[cell, :])
     return data_mat
 
-def get_perms(data_mat, nperms, ncellsperm):
+def get_perms(data_mat, nperms, ncellsperm, rng=np.random):
     '''
     Permutes the data matrix by building a data_tensor from random subsets
     of the population
+    rng is the random number generator to use (e.g. a RandomState)
     '''
     (cells, wins) = data_mat.shape
     if ncellsperm > cells:
@@ -546,18 +652,428 @@ def get_perms(data_mat, nperms, ncellsperm):
     new_tensor = np.zeros((ncellsperm, wins, nperms))
     perm_cells = np.zeros((ncellsperm, nperms)).astype(int)
     for perm in range(nperms):
-        celllist = np.random.permutation(cells)[:ncellsperm]
+        celllist = rng.permutation(cells)[:ncellsperm]
         new_tensor[:, :, perm] = data_mat[celllist, :]
         perm_cells[:, perm] = celllist
     return (new_tensor, perm_cells)
 
+######################################
+###### Parallel Betti Scheduler ######
+######################################
+
+# Topology variants computed by dag_topology: (shuffle, permute)
+BETTI_VARIANTS = {'raw': (False, False),
+                  'rawshuffled': (True, False),
+                  'permuted': (False, True),
+                  'shuffledpermuted': (True, True)}
+
+def get_task_seed(seed, variant, stim, trial, perm):
+    '''
+    Deterministic seed for one betti task, independent of the order
+    in which tasks are run
+    '''
+    task_str = '{}-{}-{}-{}-{}'.format(seed, variant, stim, trial, perm)
+    return zlib.crc32(task_str.encode())
+
+def build_betti_tasks(binned_data_file, thresh, variants, nperms, ncellsperm,
+                      pfile_dir, backend='perseus', seed=0, clusters=None):
+    '''
+    Builds the list of (variant, stim, trial, perm) betti tasks for
+    a binned data file.  Each task is a dict holding everything a worker
+    needs, including its own random seed and pfile.
+    Only the given clusters are used (all if None).
+    '''
+    tasks = []
+    with h5py.File(binned_data_file, 'r') as bdf:
+        for stim in bdf.keys():
+            try:
+                (ncell, nwin, ntrial) = population_tensor_shape(bdf[stim],
+                                                                clusters)
+            except ValueError:
+                continue
+            for variant in variants:
+                (shuffle, permute) = BETTI_VARIANTS[variant]
+                perms = range(nperms) if permute else [0]
+                for trial in range(ntrial):
+                    for perm in perms:
+                        pfile_stem = get_pfile_stem(variant, pfile_dir, stim)
+                        pfile = get_pfile_name(pfile_stem, rep=trial,
+                                               perm=perm)
+                        task = {'binned_data_file': binned_data_file,
+                                'stim': stim, 'trial': trial, 'perm': perm,
+                                'variant': variant, 'shuffle': shuffle,
+                                'permute': permute, 'thresh': thresh,
+                                'ncellsperm': ncellsperm, 'pfile': pfile,
+                                'backend': backend, 'clusters': clusters,
+                                'seed': get_task_seed(seed, variant, stim,
+                                                      trial, perm)}
+                        tasks.append(task)
+    return tasks
+
+def compute_betti_task(task):
+    '''
+    Computes the bettis of one trial of one variant.
+    Reads only its trial from the binned data file.
+
+    Returns
+    -------
+    result : tuple
+        (variant, stim, trial, perm, bettis)
+    '''
+    rng = np.random.RandomState(task['seed'])
+    with h5py.File(task['binned_data_file'], 'r') as bdf:
+        stimgrp = bdf[task['stim']]
+        data_mat = read_population_trial(stimgrp, task['trial'],
+                                         task['clusters'])
+        clusters = np.array(stimgrp['clusters'])
+        clusters = clusters[select_clusters(clusters, task['clusters'])]
+    if task['permute']:
+        (new_tensor, perm_cells) = get_perms(data_mat, 1,
+                                             task['ncellsperm'], rng)
+        data_mat = new_tensor[:, :, 0]
+        clusters = clusters[perm_cells[:, 0]]
+    if task['shuffle']:
+        data_mat = get_shuffle(data_mat, rng)
+    bettis = calc_bettis(data_mat, clusters, task['pfile'], task['thresh'],
+                         task['backend'])
+    return (task['variant'], task['stim'], task['trial'], task['perm'],
+            bettis)
+
+def run_betti_tasks(tasks, njobs=None, max_in_flight=None):
+    '''
+    Runs betti tasks on a process pool, keeping at most max_in_flight
+    tasks submitted at a time, and reports progress.
+
+    Parameters
+    ----------
+    tasks : list
+        Tasks from build_betti_tasks
+    njobs : int
+        Number of worker processes.  Defaults to the number of CPUs
+    max_in_flight : int
+        Maximum number of submitted tasks.  Defaults to 4*njobs
+
+    Returns
+    -------
+    bettidicts : dict
+        bettidicts[variant][stim] is the bettidict that do_compute_betti
+        returns: bettidict[str(trial)][str(perm)] = {'bettis': bettis}
+    '''
+    if njobs is None:
+        njobs = os.cpu_count()
+    if max_in_flight is None:
+        max_in_flight = 4*njobs
+    bettidicts = {}
+    task_iter = iter(tasks)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=njobs) as pool, \
+         tqdm.tqdm(total=len(tasks), desc='Bettis') as progress:
+        in_flight = set()
+        while True:
+            for task in task_iter:
+                in_flight.add(pool.submit(compute_betti_task, task))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            (done, in_flight) = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                (variant, stim, trial, perm, bettis) = future.result()
+                trialdict = bettidicts.setdefault(variant, {}) \
+                                      .setdefault(stim, {}) \
+                                      .setdefault(str(trial), {})
+                trialdict[str(perm)] = {'bettis': bettis}
+                progress.update(1)
+
+    # Put trials and perms back in order
+    for variant in bettidicts:
+        for stim in bettidicts[variant]:
+            bettidict = bettidicts[variant][stim]
+            bettidicts[variant][stim] = {
+                trial: {perm: bettidict[trial][perm]
+                        for perm in sorted(bettidict[trial], key=int)}
+                for trial in sorted(bettidict, key=int)}
+    return bettidicts
+
+def calc_CI_bettis_tensor_parallel(analysis_id, binned_data_file, block_path,
+                                   thresh, variants=None, nperms=0,
+                                   ncellsperm=1, njobs=None,
+                                   max_in_flight=None, backend='perseus',
+                                   seed=0, clusters=None):
+    '''
+    Parallel version of calc_CI_bettis_tensor computing several variants
+    at once.  Every (stim, trial, perm, variant) is an independent task
+    with its own seed and pfile, so results do not depend on njobs.
+
+    Parameters
+    ------
+    analysis_id : str
+        A string to identify this particular analysis run
+    binned_data_file : str
+        Path to the binned data file on which to compute topology
+    block_path : str
+        Path to the folder containing the data for the block
+    thresh : float
+        Threshold to use when identifying cell groups
+    variants : list
+        Keys of BETTI_VARIANTS to compute.  ['raw'] if None
+    nperms : int
+        Number of permutations for the permuted variants
+    ncellsperm : int
+        Number of cells in each permutation
+    njobs : int
+        Number of worker processes
+    max_in_flight : int
+        Maximum number of tasks submitted to the pool at a time
+    backend : str
+        Betti computation backend (see calc_bettis)
+    seed : int
+        Base random seed
+    clusters : list
+        Clusters to include.  All clusters if None
+
+    Returns
+    ------
+    results : dict
+        results[variant] = (bpdws_sfn, bpd_withstim), as returned by
+        calc_CI_bettis_tensor
+    '''
+    if variants is None:
+        variants = ['raw']
+    analysis_path = os.path.join(block_path,
+                                 'topology/{}/'.format(analysis_id))
+    if not os.path.exists(analysis_path):
+        os.makedirs(analysis_path)
+    pfile_dir = tempfile.mkdtemp(prefix='pfiles-', dir=analysis_path)
+    tasks = build_betti_tasks(binned_data_file, thresh, variants, nperms,
+                              ncellsperm, pfile_dir, backend, seed, clusters)
+    bettidicts = run_betti_tasks(tasks, njobs, max_in_flight)
+    if backend != 'perseus':
+        shutil.rmtree(pfile_dir, ignore_errors=True)
+
+    results = {}
+    for variant in variants:
+        (shuffle, permute) = BETTI_VARIANTS[variant]
+        (aid, apath) = prep_paths(analysis_id, binned_data_file, block_path,
+                                  shuffle, nperms if permute else 0)
+        bpd_withstim = bettidicts.get(variant, {})
+        for stim, bpd in bpd_withstim.items():
+            (bs, bps, pfs) = get_analysis_paths(aid, apath, stim)
+            with open(bps, 'wb') as bpfile:
+                pickle.dump(bpd, bpfile)
+        bpdws_sfn = os.path.join(apath, aid+'-bettiResultsDict.pkl')
+        with open(bpdws_sfn, 'wb') as bpdwsfile:
+            pickle.dump(bpd_withstim, bpdwsfile)
+        results[variant] = (bpdws_sfn, bpd_withstim)
+    return results
+
 ###############################
 ###### Binning Functions ######
 ###############################
 
+def get_clusters_to_bin(clusters, cluster_group):
+    '''
+    Selects the clusters whose sort quality is in cluster_group
+
+    Parameters
+    ------
+    clusters : Pandas DataFrame
+        Clusters frame from ephys.core
+    cluster_group : list
+        List containing cluster sort quality strings to include in embedding
+        Possible entries include 'Good', 'MUA'.  If None, use all clusters
+
+    Returns
+    ------
+    clusters_list : numpy array
+        Cluster IDs to bin
+    nclus : int
+        Number of clusters to bin
+    '''
+    mask = np.ones(len(clusters.index)) > 0
+    if cluster_group != None:
+        mask = np.ones(len(clusters.index)) < 0
+        for grp in cluster_group:
+            mask = np.logical_or(mask, clusters['quality'] == grp)
+    clusters_to_use = clusters[mask]
+    clusters_list = clusters_to_use['cluster'].unique()
+    nclus = len(clusters_to_use.index)
+    return (clusters_list, nclus)
+
+def write_population_tensor(stimgrp, poptens, clusters_list, fs, win_size,
+                            compression=None, store_counts=False):
+    '''
+    Writes a population tensor and its clusters into a stimulus group
+    of a binned file.
+
+    Parameters
+    ------
+    stimgrp : h5py Group
+        Stimulus group to write into
+    poptens : numpy array
+        Ncell x Nwin x NTrial tensor of firing rates
+    clusters_list : array
+        Cluster ids of the rows of poptens
+    fs : float
+        Sampling rate in Hz
+    win_size : float
+        Window size in milliseconds
+    compression : str
+        HDF5 compression filter ('lzf', 'gzip').  If not None, the tensor
+        is stored in one chunk per trial.
+    store_counts : bool
+        If True, store integer spike counts instead of rates.
+        Use read_population_tensor to get rates back.
+    '''
+    data = poptens
+    units = 'rates'
+    if store_counts:
+        data = np.rint(poptens * (win_size/1000.0)).astype(np.uint32)
+        units = 'counts'
+    chunks = None
+    if (compression is not None) and (np.ndim(data) == 3) \
+       and all(np.shape(data)):
+        (ncells, nwin, ntrial) = np.shape(data)
+        chunks = (ncells, nwin, 1)
+    poptens_dset = stimgrp.create_dataset('pop_tens', data=data,
+                                          chunks=chunks,
+                                          compression=compression)
+    stimgrp.create_dataset('clusters', data=clusters_list)
+    poptens_dset.attrs['fs'] = fs
+    poptens_dset.attrs['win_size'] = win_size
+    poptens_dset.attrs['units'] = units
+    return poptens_dset
+
+def counts_to_rates(data, poptens_dset):
+    '''
+    Converts data read from a pop_tens dataset to firing rates
+    '''
+    if poptens_dset.attrs.get('units', 'rates') == 'counts':
+        return data / (poptens_dset.attrs['win_size']/1000.0)
+    return data
+
+def select_clusters(binned_clusters, clusters):
+    '''
+    Returns the row indices of binned_clusters to keep for clusters.
+    All rows if clusters is None
+    '''
+    if clusters is None:
+        return slice(None)
+    return np.nonzero(np.isin(binned_clusters, clusters))[0]
+
+def read_population_tensor(stimgrp, trials=None, clusters=None):
+    '''
+    Reads the population tensor of a stimulus group as firing rates,
+    only loading the requested trials.
+
+    Parameters
+    ------
+    stimgrp : h5py Group
+        Stimulus group of a binned file
+    trials : slice or list
+        Trials to read.  All trials if None
+    clusters : list
+        Clusters to keep.  All clusters if None
+
+    Returns
+    ------
+    poptens : numpy array
+        Ncell x Nwin x NTrial tensor of firing rates
+    '''
+    poptens_dset = stimgrp['pop_tens']
+    if poptens_dset.ndim != 3:
+        return np.array(poptens_dset)
+    if trials is None:
+        trials = slice(None)
+    rows = select_clusters(np.array(stimgrp['clusters']), clusters)
+    if isinstance(rows, slice):
+        data = np.asarray(poptens_dset[:, :, trials], dtype=float)
+    else:
+        # Only the selected rows, one trial (chunk) at a time: h5py takes
+        # one increasing index list per read, and rows is increasing
+        (ncell, nwin, ntrial) = poptens_dset.shape
+        trial_inds = np.arange(ntrial)[trials]
+        data = np.zeros((len(rows), nwin, len(trial_inds)))
+        if len(rows):
+            for (k, trial) in enumerate(trial_inds):
+                data[:, :, k] = poptens_dset[rows, :, trial]
+    return counts_to_rates(data, poptens_dset)
+
+def read_population_trial(stimgrp, trial, clusters=None):
+    '''
+    Reads a single trial of the population tensor of a stimulus group.
+    With a per trial chunked binned file this reads only one chunk.
+
+    Returns
+    ------
+    popmat : numpy array
+        Ncell x Nwin matrix of firing rates
+    '''
+    return read_population_tensor(stimgrp, [trial], clusters)[:, :, 0]
+
+def population_tensor_shape(stimgrp, clusters=None):
+    '''
+    Returns the (ncell, nwin, ntrial) shape of a stimulus' population
+    tensor, after cluster selection, without reading it
+    '''
+    (ncell, nwin, ntrial) = stimgrp['pop_tens'].shape
+    if clusters is not None:
+        binned_clusters = np.array(stimgrp['clusters'])
+        ncell = len(select_clusters(binned_clusters, clusters))
+    return (ncell, nwin, ntrial)
+
+@contextmanager
+def open_population_memmap(binned_data_file, stim, clusters=None):
+    '''
+    Exposes the population tensor of a stimulus as a read only
+    memory-mapped array in trial major order: poptens[trial] is the
+    Ncell x Nwin matrix of a trial.  Workers receiving the array (e.g.
+    through joblib, which pickles memmaps by reference) read only the
+    pages of their trial instead of getting a copy of the whole tensor.
+    The binned files store the tensor as Ncell x Nwin x Ntrial, where a
+    trial is spread over every page.
+
+    The tensor is written as rates to a temporary .npy file,
+    POPTENS_MEMMAP_BLOCK_BYTES of trials at a time, which is deleted
+    on exit.
+
+    Usage:
+        with open_population_memmap(bf, stim) as poptens:
+            Parallel(n_jobs=14)(delayed(f)(poptens, trial) ...)
+
+    Parameters
+    ------
+    binned_data_file : str
+        Path to the binned data file
+    stim : str
+        Stimulus to read
+    clusters : list
+        Clusters to keep.  All clusters if None
+    '''
+    tmp_dir = tempfile.mkdtemp(prefix='poptens-')
+    try:
+        tmp_f = os.path.join(tmp_dir, 'pop_tens.npy')
+        with h5py.File(binned_data_file, 'r') as bdf:
+            stimgrp = bdf[stim]
+            (ncell, nwin, ntrial) = population_tensor_shape(stimgrp, clusters)
+            poptens = np.lib.format.open_memmap(tmp_f, mode='w+',
+                                                dtype=np.float64,
+                                                shape=(ntrial, ncell, nwin))
+            block = max(1, POPTENS_MEMMAP_BLOCK_BYTES // max(1, 8*ncell*nwin))
+            for start in range(0, ntrial, block):
+                trials = slice(start, min(start + block, ntrial))
+                data = read_population_tensor(stimgrp, trials, clusters)
+                poptens[trials] = np.transpose(data, (2, 0, 1))
+            poptens.flush()
+            del poptens
+        yield np.load(tmp_f, mmap_mode='r')
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
 def build_binned_file_quick(spikes, trials, clusters, win_size, fs,
                             cluster_group, segment_info,
-                            popvec_fname, dt_overlap=0.0):
+                            popvec_fname, dt_overlap=0.0,
+                            compression=None, store_counts=False):
     '''
     Embeds binned population activity into R^n
     resulting Tensor is Ncell x Nwin x NTrials
@@ -581,20 +1097,22 @@ def build_binned_file_quick(spikes, trials, clusters, win_size, fs,
         Dictionary containing parameters for segment generation
     popvec_fname : str
         File in which to store the embedding
+    dt_overlap : float
+        Window overlap in milliseconds
+    compression : str
+        HDF5 compression filter, stored in per trial chunks
+        (see write_population_tensor)
+    store_counts : bool
+        Store integer spike counts instead of rates
     '''
     with h5py.File(popvec_fname, "w") as popvec_f:
 
         # Extract clusters to bin
-        if cluster_group != None:
-            mask = np.ones(len(clusters.index)) < 0
-            for grp in cluster_group:
-                mask = np.logical_or(mask, clusters['quality'] == grp)
-        clusters_to_use = clusters[mask]
-        clusters_list = clusters_to_use['cluster'].unique()
-        nclus = len(clusters_to_use.index)
-
-        # Extract spikes
+        (clusters_list, nclus) = get_clusters_to_bin(clusters, cluster_group)
+
+        # Extract spikes and index them once for all stimuli
         spikes = spikes[spikes['cluster'].isin(list(clusters_list))]
+        spike_index = SpikeIndex(spikes)
 
         # Set binned file attributes
         popvec_f.attrs['win_size'] = win_size
@@ -621,16 +1139,105 @@ def build_binned_file_quick(spikes, trials, clusters, win_size, fs,
             segment = get_segment([0, trial_len], fs, segment_info)
 
             # Bin the stimulus data into a population tensor
-            poptens = build_activity_tensor_quick(stim_trials, spikes,
+            poptens = build_activity_tensor_quick(stim_trials, spike_index,
                                                   clusters_list, nclus,
                                                   win_size, subwin_len,
                                                   noverlap, segment)
 
             # Create the dataset and set attributes
-            poptens_dset = stimgrp.create_dataset('pop_tens', data=poptens)
-            stimgrp.create_dataset('clusters', data=clusters_list)
-            poptens_dset.attrs['fs'] = fs
-            poptens_dset.attrs['win_size'] = win_size
+            write_population_tensor(stimgrp, poptens, clusters_list, fs,
+                                    win_size, compression, store_counts)
+
+def get_windows_for_spikes(sptimes, subwin_len, noverlap, segment):
+    '''
+    Vectorized version of get_windows_for_spike.
+    Determines the bins into which each of an array of spikes should be placed
+
+    Parameters
+    ----------
+    sptimes : numpy array
+        Spike times (samples)
+    subwin_len : integer
+        window length in samples
+    noverlap : integer
+        Number of samples of overlap for each bin
+    segment : list
+        Beginning and end samples of time period
+
+    Returns
+    -------
+    spike_inds : numpy array
+        Index into sptimes of each (spike, bin) pair
+    wins : numpy array
+        Bin ID of each (spike, bin) pair
+    '''
+    skip = int(subwin_len - noverlap)
+    dur = segment[1] - segment[0]
+    J = int(int(subwin_len-1) / int(skip))
+    max_k = int(np.floor(float(dur)/float(skip)))
+
+    # int() truncates towards zero, so do the same here
+    rel = np.asarray(sptimes).astype(np.int64) - int(segment[0])
+    i0 = np.where(rel >= 0, rel // skip, -(-rel // skip))
+
+    spike_inds = []
+    wins = []
+    for j in range(J+1):
+        w = i0 - j
+        keep = np.logical_and(w >= 0, w < max_k)
+        spike_inds.append(np.nonzero(keep)[0])
+        wins.append(w[keep])
+    return (np.concatenate(spike_inds), np.concatenate(wins))
+
+def bin_spikes(sptimes, spclusters, clusters_list, subwin_len, noverlap,
+               segment, nwins):
+    '''
+    Counts the spikes of each cluster falling in each bin of a segment.
+    Overlapping bins are handled exactly as in get_windows_for_spike.
+
+    Parameters
+    ----------
+    sptimes : numpy array
+        Spike times (samples)
+    spclusters : numpy array
+        Cluster ID of each spike in sptimes
+    clusters_list : numpy array
+        Cluster IDs defining the rows of the output.
+        Spikes from clusters not in clusters_list are ignored
+    subwin_len : int
+        window (bin) length in samples
+    noverlap : int
+        bin overlap in samples
+    segment : list
+        Beginning and end samples of time period
+    nwins : int
+        Number of bins in the output
+
+    Returns
+    -------
+    counts : numpy array
+        Ncells x Nbins array of spike counts
+    '''
+    clusters_list = np.asarray(clusters_list)
+    spclusters = np.asarray(spclusters)
+    nclus = len(clusters_list)
+    if nclus == 0 or nwins <= 0 or len(sptimes) == 0:
+        return np.zeros((nclus, max(nwins, 0)), dtype=np.int64)
+
+    # Map cluster IDs to rows of the output
+    order = np.argsort(clusters_list, kind='mergesort')
+    sorted_clus = clusters_list[order]
+    pos = np.searchsorted(sorted_clus, spclusters)
+    pos[pos == nclus] = 0
+    valid = sorted_clus[pos] == spclusters
+    rows = order[pos]
+
+    (spike_inds, wins) = get_windows_for_spikes(sptimes, subwin_len,
+                                                noverlap, segment)
+    keep = np.logical_and(valid[spike_inds], wins < nwins)
+    flat = rows[spike_inds[keep]]*nwins + wins[keep]
+    counts = np.bincount(flat, minlength=nclus*nwins)
+    return np.reshape(counts, (nclus, nwins))
 
 def build_activity_tensor_quick(stim_trials, spikes, clusters_list, nclus,
                                 win_size, subwin_len, noverlap, segment):
@@ -643,10 +1250,11 @@ def build_activity_tensor_quick(stim_trials, spikes, clusters_list, nclus,
     stim_trials : pandas DataFrame
         Subset of trials dataframe from ephys_analysis containing
         all of the trial information from a single stimulus
-    spikes : pandas DataFrame
+    spikes : pandas DataFrame or SpikeIndex
         Subset of spikes dataframe from ephys_analysis containing
         all of the spike information for all the trials from a
-        single stimulus
+        single stimulus.  Pass a SpikeIndex to avoid re-sorting the spikes
+        for every stimulus
     clusters_list : list
         List of Cluster IDs to use in the binning
     nclus : int
@@ -681,27 +1289,213 @@ def build_activity_tensor_quick(stim_trials, spikes, clusters_list, nclus,
     print("skip = {}".format(skip))
     print("dur = {}".format(dur))
     print("nwins = {}".format(nwins))
+    if not isinstance(spikes, SpikeIndex):
+        spikes = SpikeIndex(spikes)
     poptens = np.zeros((nclus, nwins, nreps))
+    trial_starts = stim_trials['time_samples'].values
     for rep in range(nreps):
-        trial_start = stim_trials.iloc[rep]['time_samples']
-        trial_end = stim_trials.iloc[rep]['stimulus_end']
+        trial_start = trial_starts[rep]
         samp_period = (trial_start + segment[0], trial_start + segment[1])
         rec = stim_recs[rep]
-        stim_rec_spikes = get_spikes_in_window(spikes, samp_period, rec)
-        sptimes = stim_rec_spikes['time_samples'].values
-        clusters = stim_rec_spikes['cluster'].values
-        for sp, clu in zip(sptimes, clusters):
-            wins = get_windows_for_spike(sp, subwin_len, noverlap, samp_period)
-            poptens[clusters_list==clu, wins, rep] += 1
+        (sptimes, clusters) = get_spikes_in_window(spikes, samp_period, rec)
+        poptens[:, :, rep] = bin_spikes(sptimes, clusters, clusters_list,
+                                        subwin_len, noverlap, samp_period,
+                                        nwins)
     poptens /= (win_size/1000.0)
     return poptens
 
+def build_binned_files_multi(spikes, trials, clusters, win_sizes, fs,
+                             cluster_group, segment_info, popvec_fnames,
+                             dt_overlaps=None, compression=None,
+                             store_counts=False):
+    '''
+    Bins the data at several window sizes with a single pass over the spikes
+    of each trial.  Each binning is written to its own file, with the same
+    layout as build_binned_file_quick.
+
+    Parameters
+    ------
+    spikes : pandas dataframe
+        Spike frame from ephys.core
+    trials : pandas dataframe
+        Trials dataframe from ephys.trials
+    clusters : Pandas DataFrame
+        Clusters frame from ephys.core
+    win_sizes : list
+        Window sizes in milliseconds
+    fs : float
+        Sampling rate in Hz
+    cluster_group : list
+        List containing cluster sort quality strings to include in embedding
+        Possible entries include 'Good', 'MUA'
+    segment_info : list
+        Segment specifier (see get_segment)
+    popvec_fnames : list
+        Files in which to store each binning, one per window size
+    dt_overlaps : list
+        Window overlap in milliseconds for each window size.
+        Defaults to no overlap
+    compression : str
+        HDF5 compression filter (see write_population_tensor)
+    store_counts : bool
+        Store integer spike counts instead of rates
+    '''
+    if dt_overlaps is None:
+        dt_overlaps = len(win_sizes)*[0.0]
+    assert len(win_sizes) == len(dt_overlaps) == len(popvec_fnames)
+
+    (clusters_list, nclus) = get_clusters_to_bin(clusters, cluster_group)
+    spikes = spikes[spikes['cluster'].isin(list(clusters_list))]
+    spike_index = SpikeIndex(spikes)
+
+    subwin_lens = [int(np.round(w/1000. * fs)) for w in win_sizes]
+    noverlaps = [int(np.round(o/1000. * fs)) for o in dt_overlaps]
+
+    popvec_fs = [h5py.File(fname, 'w') for fname in popvec_fnames]
+    try:
+        for (popvec_f, win_size) in zip(popvec_fs, win_sizes):
+            popvec_f.attrs['win_size'] = win_size
+            popvec_f.attrs['fs'] = fs
+            popvec_f.attrs['nclus'] = nclus
+
+        for stim in trials['stimulus'].unique():
+            if str(stim) == 'nan':
+                continue
+            stim_trials = trials[trials['stimulus'] == stim]
+            trial_len = (stim_trials['stimulus_end'] \
+                         - stim_trials['time_samples']).unique()[0]
+            segment = get_segment([0, trial_len], fs, segment_info)
+            poptens_list = build_activity_tensors_multi(stim_trials,
+                                                        spike_index,
+                                                        clusters_list, nclus,
+                                                        win_sizes,
+                                                        subwin_lens,
+                                                        noverlaps, segment)
+            for (popvec_f, poptens, win_size) in zip(popvec_fs, poptens_list,
+                                                     win_sizes):
+                stimgrp = popvec_f.create_group(stim)
+                write_population_tensor(stimgrp, poptens, clusters_list, fs,
+                                        win_size, compression, store_counts)
+    finally:
+        for popvec_f in popvec_fs:
+            popvec_f.close()
+
+def build_activity_tensors_multi(stim_trials, spikes, clusters_list, nclus,
+                                 win_sizes, subwin_lens, noverlaps, segment):
+    '''
+    Bins population spike times into population activity tensors
+    at several window sizes at once.  Spikes are counted once per trial at
+    the finest common resolution (the gcd of the window steps), and the
+    counts for each window size are read off the cumulative counts.
+    If the window steps have no usefully large common divisor (see
+    MULTI_MIN_FINE_BIN), each size is binned with bin_spikes instead.
+    Gives the same tensors as build_activity_tensor_quick.
+
+    Parameters
+    ----------
+    stim_trials : pandas DataFrame
+        Subset of trials dataframe from ephys_analysis containing
+        all of the trial information from a single stimulus
+    spikes : pandas DataFrame or SpikeIndex
+        Spike data for all the trials from a single stimulus
+    clusters_list : list
+        List of Cluster IDs to use in the binning
+    nclus : int
+        Number of clusters
+    win_sizes : list
+        window (bin) sizes in milliseconds
+    subwin_lens : list
+        window (bin) lengths in samples
+    noverlaps : list
+        bin overlaps in samples
+    segment : list
+        return value of get_segment
+
+    Returns
+    ------
+    poptens_list : list
+        Ncells x Nbin x Ntrials population activity tensor
+        for each window size
+    '''
+    nreps = len(stim_trials.index)
+    stim_recs = stim_trials['recording'].values
+    trial_starts = stim_trials['time_samples'].values
+    dur = segment[1] - segment[0]
+    if dur <= 0:
+        print('Activity Tensor: Duration <= 0')
+        return [[] for win_size in win_sizes]
+    if not isinstance(spikes, SpikeIndex):
+        spikes = SpikeIndex(spikes)
+    clusters_list = np.asarray(clusters_list)
+    order = np.argsort(clusters_list, kind='mergesort')
+    sorted_clus = clusters_list[order]
+
+    # Window k of a binning covers [k*skip, (k+J+1)*skip) relative to the
+    # segment start (see get_windows_for_spike)
+    skips = [int(l - o) for (l, o) in zip(subwin_lens, noverlaps)]
+    Js = [int(int(l-1) / int(skip)) for (l, skip) in zip(subwin_lens, skips)]
+    max_ks = [int(np.floor(float(dur)/float(skip))) for skip in skips]
+    nwinss = [int(np.round(float(dur)/float(skip))) for skip in skips]
+    fine = int(np.gcd.reduce(skips))
+    nfine = max([(k + J)*skip // fine
+                 for (k, J, skip) in zip(max_ks, Js, skips)])
+    use_fine = (fine >= MULTI_MIN_FINE_BIN and
+                nfine <= MULTI_MAX_FINE_RATIO*sum(nwinss))
+    print("Nreps = {}".format(nreps))
+    if use_fine:
+        print("fine bin = {}".format(fine))
+    else:
+        print("fine bin = {}: binning each window size".format(fine))
+    print("nwins = {}".format(nwinss))
+
+    poptens_list = [np.zeros((nclus, nwins, nreps)) for nwins in nwinss]
+    for rep in range(nreps):
+        samp_period = (trial_starts[rep] + segment[0],
+                       trial_starts[rep] + segment[1])
+        (sptimes, clusters) = get_spikes_in_window(spikes, samp_period,
+                                                   stim_recs[rep])
+        if nclus == 0:
+            continue
+        if not use_fine:
+            for (poptens, subwin_len, noverlap, nwins) in zip(
+                    poptens_list, subwin_lens, noverlaps, nwinss):
+                poptens[:, :, rep] = bin_spikes(sptimes, clusters,
+                                                clusters_list, subwin_len,
+                                                noverlap, samp_period, nwins)
+            continue
+
+        # Count spikes at the finest resolution
+        rel = np.asarray(sptimes).astype(np.int64) - int(samp_period[0])
+        f = rel // fine
+        pos = np.searchsorted(sorted_clus, clusters)
+        pos[pos == nclus] = 0
+        keep = np.logical_and(sorted_clus[pos] == clusters,
+                              np.logical_and(rel >= 0, f < nfine))
+        flat = order[pos[keep]]*nfine + f[keep]
+        counts = np.bincount(flat, minlength=nclus*nfine)
+        cumcounts = np.zeros((nclus, nfine+1), dtype=np.int64)
+        np.cumsum(np.reshape(counts, (nclus, nfine)), axis=1,
+                  out=cumcounts[:, 1:])
+
+        # Aggregate to each window size
+        for (poptens, skip, J, max_k) in zip(poptens_list, skips, Js, max_ks):
+            k = np.arange(max_k)
+            lo = k*skip // fine
+            hi = np.minimum((k + J + 1)*skip // fine, nfine)
+            poptens[:, :max_k, rep] = cumcounts[:, hi] - cumcounts[:, lo]
+
+    for (poptens, win_size) in zip(poptens_list, win_sizes):
+        poptens /= (win_size/1000.0)
+    return poptens_list
+
 def build_poptens_given_windows(stim_trials, spikes, windows,
                                 clusters_list, segment):
     nreps = len(stim_trials.index)
     nclus = len(clusters_list)
     stim_recs = stim_trials['recording'].values 
     nwins = len(windows)
+    if not isinstance(spikes, SpikeIndex):
+        spikes = SpikeIndex(spikes)
     poptens = np.zeros((nclus, nwins, nreps))
     for rep in range(nreps):
         trial_start = stim_trials.iloc[rep]['time_samples']
@@ -709,10 +1503,8 @@ def build_poptens_given_windows(stim_trials, spikes, windows,
         samp_period = (trial_start + segment[0], 
                        trial_start + segment[1])
         rec = stim_recs[rep]
-        stim_rec_spikes = get_spikes_in_window(spikes, samp_period, rec)
-        clusters = stim_rec_spikes['cluster'].values 
-        sptimes = stim_rec_spikes['time_samples'].values - samp_period[0]
-        clusters = stim_rec_spikes['cluster'].values
+        (sptimes, clusters) = get_spikes_in_window(spikes, samp_period, rec)
+        sptimes = sptimes - samp_period[0]
         sptclur = np.tile(sptimes[:, np.newaxis], (1, nwins))
         swin = np.tile(windows[np.newaxis, :], (len(sptimes), 1))
         upper = (sptclur <= swin)[:, 1:]
@@ -768,12 +1560,10 @@ def extract_population_tensors(binned_datafile, shuffle=False, clusters=None):
         print(stims)
         stim_tensors = dict()
         for ind, stim in enumerate(stims):
-            binned_clusters = np.array(bdf[stim]['clusters'])
-            poptens = np.array(bdf[stim]['pop_tens'])
+            poptens = read_population_tensor(bdf[stim], clusters=clusters)
             print('Stim: {}, Clusters:{}'.format(stim, str(clusters)))
             try:
                 if clusters is not None:
-                    poptens = poptens[np.in1d(binned_clusters, clusters), :, :]
                     print("Selecting Clusters: poptens:" 
                             + str(np.shape(poptens)))
                 (ncell, nwin, ntrial) = np.shape(poptens)
@@ -797,19 +1587,17 @@ def extract_population_tensor(binned_data_file, stim,
     '''
     print('Extracting Population Activity Tensor...')
     with h5py.File(binned_data_file, 'r') as bdf:
-        binned_clusters = np.array(bdf[stim]['clusters'])
-        poptens = np.array(bdf[stim]['pop_tens'])
+        poptens = read_population_tensor(bdf[stim], clusters=clusters)
         print('Stim: {}, Clusters:{}'.format(stim, str(clusters)))
         try:
             if clusters is not None:
-                poptens = poptens[np.in1d(binned_clusters, clusters), :, :]
                 print("Selecting Clusters: poptens:" + str(np.shape(poptens)))
             (ncell, nwin, ntrial) = np.shape(poptens)
         except (ValueError, IndexError):
             print('Population Tensor Error')
             return []
         if shuffle:
-            poptens = tp2.build_shuffled_data_tensor(poptens, 1)
+            poptens = build_shuffled_data_tensor(poptens, 1)
             poptens = poptens[:, :, :, 0]
         if  nwin == 0:
             return []
@@ -910,6 +1698,47 @@ def get_scg_at_time(binmat, t):
 ###### Betti Curve Funcs #####
 ##############################
 
+def betti_step_values(dat, dims, t_vals):
+    '''
+    Evaluates the Betti step functions of one betti list at t_vals,
+    for all dims at once.  Same values as
+    interp1d(t, b, kind='zero', bounds_error=False,
+             fill_value=(b[0], b[-1]))
+
+    Parameters
+    ----------
+    dat : list
+        Betti list [[<filtration_time>, <betti_vals_list>], ...]
+    dims : list
+        Dimensions to evaluate
+    t_vals : numpy array
+        Filtration times at which to evaluate
+
+    Returns
+    -------
+    vals : numpy array
+        len(dims) x len(t_vals) array of Betti values
+    '''
+    vals = np.zeros((len(dims), len(t_vals)))
+    if len(dat) == 0:
+        return vals
+    t = np.array([int(x[0]) for x in dat])
+    b = np.zeros((len(dat), max(dims) + 1))
+    for ind, x in enumerate(dat):
+        ndim = min(len(x[1]), b.shape[1])
+        b[ind, :ndim] = x[1][:ndim]
+    b = b[:, dims]
+
+    order = np.argsort(t, kind='mergesort')
+    t_sorted = t[order]
+    inds = np.searchsorted(t_sorted, t_vals, side='right') - 1
+    inds = np.clip(inds, 0, len(t) - 1)
+    vals[:] = b[order[inds]].T
+    vals[:, t_vals < t_sorted[0]] = b[0][:, np.newaxis]
+    vals[:, t_vals > t_sorted[-1]] = b[-1][:, np.newaxis]
+    vals[:, np.isnan(t_vals)] = np.nan
+    return vals
+
 def betti_dict_to_betti_curves(betti_dict, dims, twin, windt, dtovr):
     '''
     Interpolates Betti values using step functions to produce
@@ -927,63 +1756,57 @@ def betti_dict_to_betti_curves(betti_dict, dims, twin, windt, dtovr):
         window size in milliseconds 
     dtovr : float 
         amount of window overlap in milliseconds
+
+    Returns
+    -------
+    stim_betticurves : dict
+        For each stim, a len(dims) x len(twin) x (ntrials*nperms) array
+    t_vals : numpy array
+        twin in filtration time units
+    t_vals_milliseconds : list
+        twin
     '''
+    t_vals = np.round((np.asarray(twin) - windt/2) /(windt-dtovr))
+    t_vals_milliseconds = twin
 
     stim_betticurves = {}
     for stim in betti_dict.keys():
-        betticurve_save = np.empty((len(dims), len(twin), 0))
-
         trials = betti_dict[stim]
+        ncurves = sum(len(trials[trial]) for trial in trials.keys())
+        betticurve_save = np.empty((len(dims), len(t_vals), ncurves))
+        curve = 0
         for trial in trials.keys():
             perms = trials[trial]
             for perm in perms.keys():
                 dat = perms[perm]['bettis']
-                t = np.array([int(x[0]) for x in dat])
-                t_milliseconds = t*((windt - dtovr)) + windt / 2.0
-                t_vals = np.round((twin - windt/2) /(windt-dtovr))
-                t_vals_milliseconds = twin
-                b = [x[1] for x in dat]
-                #t_vals = np.linspace(window[0], window[1], Ntimes)
-                #t_vals = np.linspace(np.amin(t), np.amax(t), Ntimes)
-                #t_vals_milliseconds = t_vals*((windt - dtovr)) + windt / 2.0
-                b = [np.pad(np.array(x), (0, 10),
-                            'constant', constant_values=0)
-                     for x in b]
-                betticurve_save_alldims = np.empty((0, len(twin)))
-                for dim in dims:
-                    b_val = np.array([x[dim] for x in b])
-                    b_func = interp1d(t, b_val,
-                                      kind='zero', bounds_error=False,
-                                      fill_value=(b_val[0], b_val[-1]))
-                    betti_curve_dim = b_func(t_vals)
-                    betticurve_save_alldims = np.vstack((betticurve_save_alldims,
-                                                        betti_curve_dim))
-                betticurve_save = np.concatenate((betticurve_save,
-                                                  betticurve_save_alldims[:, :,
-                                                  np.newaxis]), axis=2)
-        stim_betticurves[stim] = np.array(betticurve_save)
+                betticurve_save[:, :, curve] = betti_step_values(dat, dims,
+                                                                 t_vals)
+                curve += 1
+        stim_betticurves[stim] = betticurve_save
     return (stim_betticurves, t_vals, t_vals_milliseconds)
 
 def compute_betti_curves(analysis_id, block_path, bdf,
                          thresh, nperms, ncellsperm, dims, twin,
-                         windt, dtovr, shuffle=False):
+                         windt, dtovr, shuffle=False, backend='perseus'):
     '''
     Computes betti numbers and returns betti curves 
     '''
     (resf, betti_dict) = calc_CI_bettis_tensor(analysis_id, bdf,
                               block_path, thresh, shuffle=shuffle,
-                              nperms=nperms, ncellsperm=ncellsperm)
+                              nperms=nperms, ncellsperm=ncellsperm,
+                              backend=backend)
 
     return betti_dict_to_betti_curves(betti_dict, dims, twin, windt, dtovr)
 
 
 def compute_trialaverage_betti_curves(analysis_id, block_path, bdf,
                          thresh, nperms, ncellsperm, dims, twin,
-                         windt, dtovr, shuffle=False):
+                         windt, dtovr, shuffle=False, backend='perseus'):
 
     (resf, betti_dict) = calc_CI_bettis_tensor_trialavg(analysis_id, bdf,
                               block_path, thresh, shuffle=shuffle,
-                              nperms=nperms, ncellsperm=ncellsperm)
+                              nperms=nperms, ncellsperm=ncellsperm,
+                              backend=backend)
 
     return betti_dict_to_betti_curves(betti_dict, dims, twin, windt, dtovr)
 
@@ -1003,6 +1826,186 @@ def compute_mean_stderr_betti_curves(betti_curves):
         bc_plot_dict[stim] = (avg, stderr)
     return bc_plot_dict
 
+###########################
+###### Binning Cache ######
+###########################
+
+def hash_dataframe(df, columns):
+    '''
+    Returns a hex digest of the contents of the given columns of df
+    '''
+    columns = [c for c in columns if c in df.columns]
+    hashes = pd.util.hash_pandas_object(df[columns], index=False).values
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+def get_spike_file_identity(block_path):
+    '''
+    Returns the name, size and modification time of the
+    spike data files in block_path
+    '''
+    identity = []
+    for fname in sorted(glob.glob(os.path.join(block_path, '*.kwik'))):
+        stat = os.stat(fname)
+        identity.append([os.path.basename(fname), stat.st_size,
+                         stat.st_mtime])
+    return identity
+
+def binning_data_digests(block_path, spikes, trials):
+    '''
+    Identifies the data going into a binning: the spike file identity and
+    the contents of the spikes and trials frames.  Hashing the frames is
+    the expensive part of a cache key, so compute this once per call and
+    pass it to binning_cache_key for every window size.
+    '''
+    return {'spike_files': get_spike_file_identity(block_path),
+            'spikes': hash_dataframe(spikes, ['cluster', 'time_samples',
+                                              'recording']),
+            'trials': hash_dataframe(trials, ['stimulus', 'time_samples',
+                                              'stimulus_end', 'recording'])}
+
+def binning_cache_key(data_digests, clusters_list, fs, winsize,
+                      segment_info, dt_overlap, compression=None,
+                      store_counts=False, comment=''):
+    '''
+    Computes the key identifying a binning in the binning cache.
+    The key is a hash of everything that determines the binned file:
+    the spike file identity and contents, the trials selection
+    (data_digests, from binning_data_digests), the clusters binned,
+    the sampling rate, the window parameters and the storage options.
+    The comment is part of the key as it names the binned folder
+    (see get_cached_binned_file).
+
+    Returns
+    -------
+    key : str
+        hex digest identifying the binning
+    params : dict
+        the parameters that went into the key
+    '''
+    params = {'version': BINNING_CACHE_VERSION,
+              'spike_files': data_digests['spike_files'],
+              'spikes': data_digests['spikes'],
+              'trials': data_digests['trials'],
+              'clusters': sorted(int(c) for c in clusters_list),
+              'fs': float(fs),
+              'winsize': float(winsize),
+              'dt_overlap': float(dt_overlap),
+              'segment_info': [float(x) for x in segment_info],
+              'compression': compression,
+              'store_counts': bool(store_counts),
+              'comment': comment}
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+    return (key.hexdigest(), params)
+
+class BinningCacheManifest:
+    '''
+    Locked read-modify-write access to the binning cache manifest
+    of a block.  Use as a context manager:
+
+        with BinningCacheManifest(block_path) as manifest:
+            manifest['entries'][key] = ...
+    '''
+
+    def __init__(self, block_path):
+        self.fname = os.path.join(block_path, BINNING_CACHE_MANIFEST)
+
+    def __enter__(self):
+        folder = os.path.dirname(self.fname)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.lock_f = open(self.fname + '.lock', 'w')
+        fcntl.flock(self.lock_f, fcntl.LOCK_EX)
+        self.manifest = {'entries': {}, 'hits': 0, 'misses': 0}
+        if os.path.exists(self.fname):
+            with open(self.fname, 'r') as f:
+                self.manifest = json.load(f)
+        return self.manifest
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                tmp_fname = self.fname + '.tmp'
+                with open(tmp_fname, 'w') as f:
+                    json.dump(self.manifest, f, indent=1, sort_keys=True)
+                os.replace(tmp_fname, self.fname)
+        finally:
+            fcntl.flock(self.lock_f, fcntl.LOCK_UN)
+            self.lock_f.close()
+        return False
+
+def binning_cache_lookup(block_path, key):
+    '''
+    Looks up a binning in the cache, recording a hit or a miss.
+
+    Returns
+    -------
+    binned_file : str
+        Path to the cached binned file, or None on a miss
+    '''
+    with BinningCacheManifest(block_path) as manifest:
+        entry = manifest['entries'].get(key)
+        if entry is not None and os.path.exists(entry['file']):
+            entry['last_used'] = time.time()
+            manifest['hits'] += 1
+            TOPOLOGY_LOG.info('Binning cache hit: {}'.format(entry['file']))
+            print('Binning cache hit: {}'.format(entry['file']))
+            return entry['file']
+        manifest['entries'].pop(key, None)
+        manifest['misses'] += 1
+    TOPOLOGY_LOG.info('Binning cache miss: {}'.format(key))
+    print('Binning cache miss: {}'.format(key))
+    return None
+
+def binning_cache_add(block_path, key, binned_file, params,
+                      max_bytes=BINNING_CACHE_MAX_BYTES):
+    '''
+    Adds a binned file to the cache and evicts the least recently used
+    entries until the cache fits in max_bytes
+    '''
+    with BinningCacheManifest(block_path) as manifest:
+        entries = manifest['entries']
+        now = time.time()
+        entries[key] = {'file': binned_file,
+                        'size': os.path.getsize(binned_file),
+                        'created': now, 'last_used': now, 'params': params}
+        total = sum(entry['size'] for entry in entries.values())
+        lru = sorted(entries.keys(), key=lambda k: entries[k]['last_used'])
+        for old_key in lru:
+            if total <= max_bytes or old_key == key:
+                break
+            old_entry = entries.pop(old_key)
+            total -= old_entry['size']
+            TOPOLOGY_LOG.info('Binning cache evict: {}'.format(
+                old_entry['file']))
+            shutil.rmtree(os.path.dirname(old_entry['file']),
+                          ignore_errors=True)
+
+def binning_cache_report(block_path):
+    '''
+    Returns a summary of the binning cache of a block:
+    number of entries, total size in bytes, and hit and miss counts
+    '''
+    with BinningCacheManifest(block_path) as manifest:
+        entries = manifest['entries']
+        return {'entries': len(entries),
+                'bytes': sum(entry['size'] for entry in entries.values()),
+                'hits': manifest['hits'],
+                'misses': manifest['misses']}
+
+def get_cached_binned_file(block_path, key, winsize, dt_overlap,
+                           segment_info, comment=''):
+    '''
+    Formats the path of the binned file for cache entry key.
+    Entries live in a subfolder of the usual binned folder, so each
+    bfdict['raw'] folder holds exactly one binned file.
+    '''
+    binned_folder = get_binned_folder(block_path, winsize, dt_overlap,
+                                      segment_info, comment)
+    entry_folder = os.path.join(binned_folder, key[:16])
+    return os.path.join(entry_folder,
+                        '{}-{}-{}.binned'.format(key[:16], winsize,
+                                                 dt_overlap))
+
 ##############################
 ###### Computation Dags ######
 ##############################
@@ -1037,6 +2040,10 @@ def bin_data(block_path, winsize, segment_info, **kwargs):
             MILLISECONDS of overlap for each window 
         comment : str 
             A string to tag the resultant binned file with 
+        compression : str
+            HDF5 compression filter for the binned file, e.g. 'lzf'
+        store_counts : bool
+            Store integer spike counts instead of rates
     '''
     (spikes, trials, clusters, fs) = db_load_data(block_path)
     bfdict = do_dag_bin_lazy(block_path, spikes, trials, clusters,
@@ -1050,14 +2057,32 @@ def dag_bin(block_path, winsize, segment_info, **kwargs):
                              fs, winsize, segment_info, **kwargs)
     return bfdict
 
+def get_binned_folder(block_path, winsize, dt_overlap, segment_info,
+                      comment=''):
+    '''
+    Formats the folder in which to store a binning with the given parameters
+    '''
+    #cg_string = '-'.join(cluster_group)
+    seg_string = '-'.join(map(str, segment_info))
+    if comment:
+        seg_string = seg_string+ '-'+comment
+    bin_string = 'binned_data/win-{}_dtovr-{}_seg-{}/'.format(winsize,
+                                                              dt_overlap,
+                                                              seg_string)
+    return os.path.join(block_path, bin_string)
+
 def do_dag_bin_lazy(block_path, spikes, trials, clusters, fs, winsize,
                     segment_info, cluster_group=['Good', 'MUA'], 
-                    dt_overlap=0.0, comment=''):
+                    dt_overlap=0.0, comment='',
+                    cache_max_bytes=BINNING_CACHE_MAX_BYTES,
+                    compression=None, store_counts=False):
     '''
     Take data structures from ephys_analysis and bin them into
     population tensors.
-    This version checks to see if a binning with the same parameters already
-    exists and returns the path to that file if so.
+    This version checks the binning cache of the block for a binning
+    of the same data with the same parameters and returns the folder
+    of that binning if so.  The cache key covers the spike data, the trials
+    and clusters selected and the binning parameters (see binning_cache_key).
 
     Parameters
     ----------
@@ -1083,55 +2108,190 @@ def do_dag_bin_lazy(block_path, spikes, trials, clusters, fs, winsize,
         time in milliseconds for windows to overlap
     comment : str
         string identifying anything special about this binning.
+    cache_max_bytes : int
+        Size limit of the binning cache on disk.
+        Least recently used binnings are deleted beyond this.
+    compression : str
+        HDF5 compression filter for the binned file, e.g. 'lzf'
+    store_counts : bool
+        Store integer spike counts instead of rates
 
     Returns
     -------
     bfdict : dict
         dictionary containing paths to binned folders.
+        bfdict['cache'] is 'hit' or 'miss'
 
     '''
     #setup_logging('Dag Bin')
     block_path = os.path.abspath(block_path)
-    # Create directories and filenames
     analysis_id = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-    raw_binned_fname = analysis_id + '-{}-{}.binned'.format(winsize, dt_overlap)
     analysis_id_forward = analysis_id + '-{}-{}'.format(winsize, dt_overlap)
     bfdict = {'analysis_id': analysis_id_forward}
 
-    #cg_string = '-'.join(cluster_group)
-    seg_string = '-'.join(map(str, segment_info))
-    if comment:
-        seg_string = seg_string+ '-'+comment
-    bin_string = 'binned_data/win-{}_dtovr-{}_seg-{}/'.format(winsize,
-                                                              dt_overlap,
-                                                              seg_string)
-    binned_folder = os.path.join(block_path, bin_string)
-    if not os.path.exists(binned_folder):
-        os.makedirs(binned_folder)
-    existing_binned = glob.glob(os.path.join(binned_folder, '*.binned'))
-
-    if len(existing_binned) == 0:
+    (clusters_list, nclus) = get_clusters_to_bin(clusters, cluster_group)
+    (key, params) = binning_cache_key(binning_data_digests(block_path, spikes,
+                                                           trials),
+                                      clusters_list, fs, winsize,
+                                      segment_info, dt_overlap,
+                                      compression, store_counts, comment)
+    raw_binned_f = binning_cache_lookup(block_path, key)
+    bfdict['cache'] = 'hit'
+    if raw_binned_f is None:
         # not already binned!
         # Bin the raw data
         print('Data Not already binned')
-        raw_binned_f = os.path.join(binned_folder, raw_binned_fname)
+        bfdict['cache'] = 'miss'
+        raw_binned_f = get_cached_binned_file(block_path, key, winsize,
+                                              dt_overlap, segment_info,
+                                              comment)
+        if not os.path.exists(os.path.dirname(raw_binned_f)):
+            os.makedirs(os.path.dirname(raw_binned_f))
+        tmp_binned_f = raw_binned_f + '.{}.tmp'.format(os.getpid())
         build_binned_file_quick(spikes, trials, clusters, winsize, fs,
                               cluster_group, segment_info,
-                              raw_binned_f, dt_overlap)
-    else:
-        raw_binned_f = existing_binned[0]
+                              tmp_binned_f, dt_overlap,
+                              compression, store_counts)
+        os.replace(tmp_binned_f, raw_binned_f)
+        binning_cache_add(block_path, key, raw_binned_f, params,
+                          cache_max_bytes)
 
-    bfdict['raw'] = binned_folder
+    bfdict['raw'] = os.path.dirname(raw_binned_f)
     return bfdict
 
+def bin_data_multi(block_path, winsizes, segment_info, **kwargs):
+    '''
+    Bins spiking data into population tensors at several window sizes.
+    The data is loaded once and every window size is produced
+    from a single pass over the spikes.
+
+    Parameters
+    ----------
+    block_path : str 
+        Path to directory containing Kwik file of spike data 
+    winsizes : list 
+        Widths of the binning windows in MILLISECONDS
+    segment_info : list 
+        [a, b] gives a MILLISECONDS after stimulus start 
+        and b MILLISECONDS before stimulus end 
+    kwargs :
+        cluster_group : list 
+            Quality of clusters to include. e.g. ['Good', 'MUA']
+            includes all Good and MUA clusters 
+        dt_overlaps : list 
+            MILLISECONDS of overlap for each window size
+        comment : str 
+            A string to tag the resultant binned files with 
+        compression : str
+            HDF5 compression filter for the binned files, e.g. 'lzf'
+        store_counts : bool
+            Store integer spike counts instead of rates
+
+    Returns
+    -------
+    bfdicts : list
+        bfdict (see do_dag_bin_lazy) for each window size
+    '''
+    (spikes, trials, clusters, fs) = db_load_data(block_path)
+    bfdicts = do_dag_bin_multi_lazy(block_path, spikes, trials, clusters,
+                                    fs, winsizes, segment_info, **kwargs)
+    return bfdicts
+
+def do_dag_bin_multi_lazy(block_path, spikes, trials, clusters, fs, winsizes,
+                          segment_info, cluster_group=['Good', 'MUA'],
+                          dt_overlaps=None, comment='',
+                          cache_max_bytes=BINNING_CACHE_MAX_BYTES,
+                          compression=None, store_counts=False):
+    '''
+    Multi-resolution version of do_dag_bin_lazy.
+    Window sizes missing from the binning cache are binned together
+    by build_binned_files_multi.
+
+    Returns
+    -------
+    bfdicts : list
+        bfdict (see do_dag_bin_lazy) for each window size
+    '''
+    block_path = os.path.abspath(block_path)
+    if dt_overlaps is None:
+        dt_overlaps = len(winsizes)*[0.0]
+    analysis_id = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    (clusters_list, nclus) = get_clusters_to_bin(clusters, cluster_group)
+    data_digests = binning_data_digests(block_path, spikes, trials)
+
+    bfdicts = []
+    to_bin = []
+    for (winsize, dt_overlap) in zip(winsizes, dt_overlaps):
+        analysis_id_forward = analysis_id + '-{}-{}'.format(winsize,
+                                                            dt_overlap)
+        (key, params) = binning_cache_key(data_digests, clusters_list, fs,
+                                          winsize, segment_info, dt_overlap,
+                                          compression, store_counts,
+                                          comment)
+        raw_binned_f = binning_cache_lookup(block_path, key)
+        cache_status = 'hit'
+        if raw_binned_f is None:
+            cache_status = 'miss'
+            raw_binned_f = get_cached_binned_file(block_path, key, winsize,
+                                                  dt_overlap, segment_info,
+                                                  comment)
+            if not os.path.exists(os.path.dirname(raw_binned_f)):
+                os.makedirs(os.path.dirname(raw_binned_f))
+            to_bin.append((winsize, dt_overlap, raw_binned_f, key, params))
+        bfdicts.append({'analysis_id': analysis_id_forward,
+                        'raw': os.path.dirname(raw_binned_f),
+                        'cache': cache_status})
+
+    if to_bin:
+        print('Data Not already binned: {}'.format([x[0] for x in to_bin]))
+        (bin_winsizes, bin_overlaps, bin_fnames, keys, params) = zip(*to_bin)
+        tmp_fnames = [f + '.{}.tmp'.format(os.getpid()) for f in bin_fnames]
+        build_binned_files_multi(spikes, trials, clusters, list(bin_winsizes),
+                                 fs, cluster_group, segment_info,
+                                 tmp_fnames, list(bin_overlaps),
+                                 compression, store_counts)
+        for (tmp_f, binned_f, key, param) in zip(tmp_fnames, bin_fnames,
+                                                 keys, params):
+            os.replace(tmp_f, binned_f)
+            binning_cache_add(block_path, key, binned_f, param,
+                              cache_max_bytes)
+    return bfdicts
+
 def dag_topology(block_path, thresh, bfdict, raw=True,
                  shuffle=False, shuffleperm=False, nperms=0, ncellsperm=1,
-                 **kwargs):
+                 njobs=None, **kwargs):
+    '''
+    Computes the topology of the binned data in bfdict['raw'] for the
+    requested variants.  If njobs is given, all variants are computed
+    together with calc_CI_bettis_tensor_parallel on njobs processes.
+    '''
 
     aid = bfdict['analysis_id']
     analysis_dict = dict()
     raw_folder = bfdict['raw']
 
+    if njobs:
+        variants = []
+        if 'raw' in bfdict.keys() and raw:
+            variants.append('raw')
+        if shuffle:
+            variants.append('rawshuffled')
+        if nperms:
+            variants.append('permuted')
+        if shuffleperm:
+            variants.append('shuffledpermuted')
+        tpid_raw = aid + '-{}'.format(thresh)
+        raw_data_files = glob.glob(os.path.join(raw_folder, '*.binned'))
+        for rdf in raw_data_files:
+            results = calc_CI_bettis_tensor_parallel(tpid_raw, rdf,
+                                                     block_path, thresh,
+                                                     variants, nperms,
+                                                     ncellsperm, njobs,
+                                                     **kwargs)
+            for variant in variants:
+                analysis_dict[variant] = results[variant][1]
+        raw = shuffle = nperms = shuffleperm = False
+
     if 'raw' in bfdict.keys() and raw:
         tpid_raw = aid +'-{}-raw'.format(thresh)
         raw_data_files = glob.glob(os.path.join(raw_folder, '*.binned'))
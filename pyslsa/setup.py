@@ -1,9 +1,12 @@
 from distutils.core import setup, Extension
 
 pyslsa_module = Extension('pyslsa',
-                          libraries = ['gsl', 'gslcblas', 'm'],
+                          libraries = ['gsl', 'gslcblas', 'lapack', 'blas', 'm'],
                           sources = ['pyslsa.c', 'simplex.c',
                                      'hash_table.c', 'boundary_op.c',
-                                     'slse.c'])
+                                     'slse.c'],
+                          depends = ['pyslsa_scg.h'],
+                          extra_compile_args = ['-O2', '-fopenmp'],
+                          extra_link_args = ['-fopenmp'])
 setup(name='pyslsa', version='0.1', 
       ext_modules=[pyslsa_module])
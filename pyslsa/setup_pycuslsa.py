@@ -1,9 +1,19 @@
+import os
 from distutils.core import setup, Extension
 
+# SLSA_NOCUDA=1: link against the CPU-only libslsa (make cpu)
+define_macros = []
+if os.environ.get('SLSA_NOCUDA'):
+    define_macros.append(('NOCUDA', None))
+
 pyslsa_module = Extension('pycuslsa',
 						  include_dirs = ['/home/brad/code/NeuralTDA/pyslsa/slsa/'],
 						  library_dirs= ['/home/brad/code/NeuralTDA/lib'],
                           libraries = ['gsl', 'gslcblas', 'm', 'slsa'],
-                          sources = ['./slsa/pycuslsa.c'])
+                          sources = ['./slsa/pycuslsa.c'],
+                          depends = ['./slsa/pyslsa_scg.h'],
+                          define_macros = define_macros,
+                          extra_compile_args = ['-O2', '-fopenmp'],
+                          extra_link_args = ['-fopenmp'])
 setup(name='pycuslsa', version='0.1', 
       ext_modules=[pyslsa_module])
\ No newline at end of file
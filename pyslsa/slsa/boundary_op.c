@@ -18,6 +18,7 @@
 
 #include <stdlib.h>
 #include <stdio.h>
+#include <string.h>
 
 #include <gsl/gsl_matrix.h>
 #include <gsl/gsl_blas.h>
@@ -120,8 +121,11 @@ unsigned int bdry_check_hash(struct bdry_op_dict * tab,
     /* Linear Search the table for the hash */
     /* From Knuth Vol 3 */
     unsigned int i2 = i;
+    unsigned int nprobe;
     //int eq;
-    while ( i2 != i+1) {
+    /* Probe each entry at most once: i+1 is never reached when i is
+     * the last entry, so stop on the probe count */
+    for (nprobe = 0; nprobe < NR_BDRY_HASH; nprobe++) {
 
         /* Hash table entry is empty - simplex is not in hash table */
         if (!tab->table[i2].sp) break;
@@ -152,104 +156,204 @@ unsigned int bdry_check_hash(struct bdry_op_dict * tab,
 }
 
 int * bdry_canonical_coordinates(struct bdry_op_dict * bdry_op,
-                                 struct simplex_list *basis, int targ_dim)
+                                 SCG * scg, int targ_dim)
 {
     /* Return the components of the boundary chain vector in
      * canonical coordinates, that is, in the basis given by 
-     * the variable basis */
+     * the chain group of scg in dimension targ_dim */
 
     /* Create result vector */
-    int * out_vec = calloc(targ_dim, sizeof(int));
+    int * out_vec = calloc(scg->cg_dim[targ_dim] + 1, sizeof(int));
     if (!out_vec) {
         printf("Unable to allocate boundary canonical coordinate vector\n");
         return out_vec;
     }
 
-    /* Loop through simplex list, extracting sign */
-    int pos = 0;
+    /* Loop through the chain group, extracting sign */
+    struct Simplex basis;
     unsigned int indx;
-    while (basis) {
-        // printf("bdry_canonical_coordinates: interating over basis\n");
-        if (bdry_check_hash(bdry_op, basis->s, &indx)) {
+    basis.dim = targ_dim;
+    for (int pos = 0; pos < scg->cg_dim[targ_dim]; pos++) {
+        memcpy(basis.vertices, SCG_BASIS_SIMPLEX(scg, targ_dim, pos),
+               (targ_dim + 1) * sizeof(int));
+        if (bdry_check_hash(bdry_op, &basis, &indx)) {
             out_vec[pos] = bdry_op->table[indx].sgn; 
-            // printf("bdry_canonical_coordinates: %d\n", bdry_op->table[indx].sgn);      
         }
-        basis = basis->next;
-        pos++;
     }
     return out_vec;
 }
 
+/*
+ *  Faces of the simplex with sorted vertices v in dimension dim.
+ *  Face i omits vertex i, has sign (-1)^i and its vertices
+ *  are faces[i*dim] ... faces[i*dim + dim-1]
+ */
+static void simplex_faces(const int * v, int dim, int * faces)
+{
+    for (int i = 0; i <= dim; i++) {
+        int * f = faces + i*dim;
+        for (int j = 0; j <= dim; j++) {
+            if (j != i) *f++ = v[j];
+        }
+    }
+}
+
+struct bdry_matrix * compute_boundary_operator_sparse(SCG * scg, int dim)
+{
+    /* Returns the sparse boundary operator for the simplicial complex scg
+     * in dimension dim, in the chain group bases (see SCG_BASIS_ROW).
+     * The rows of the faces are found in an index of the target chain
+     * group, built once: dim+1 lookups per column */
+
+    struct bdry_matrix * D = calloc(1, sizeof(struct bdry_matrix));
+    if (!D) {
+        printf("Unable to allocate boundary matrix\n");
+        return D;
+    }
+
+    if ((dim <= 0) || (dim >= MAXDIM)) {
+        /* Boundary operator in dimension zero is zero map */
+        if (dim == 0) D->ncols = scg->cg_dim[0];
+        return D;
+    }
+    D->nrows = scg->cg_dim[dim-1];
+    D->ncols = scg->cg_dim[dim];
+    D->nnz_col = dim + 1;
+    if ((D->nrows == 0) || (D->ncols == 0)) {
+        /* empty chain groups */
+        D->nnz_col = 0;
+        return D;
+    }
+
+    size_t nnz = (size_t)D->ncols * D->nnz_col;
+    D->rows = malloc(nnz * sizeof(int));
+    D->vals = malloc(nnz * sizeof(int));
+    struct simplex_hash_table * index = get_chain_group_index_D(scg, dim-1);
+
+    int faces[MAXDIM*MAXDIM];
+    for (int j = 0; j < D->ncols; j++) {
+        simplex_faces(SCG_BASIS_SIMPLEX(scg, dim, j), dim, faces);
+        for (int k = 0; k <= dim; k++) {
+            int r = find_hash_D(index, faces + k*dim, dim-1);
+            D->rows[j*D->nnz_col + k] = (r < 0) ? r :
+                                        SCG_BASIS_ROW(scg, dim-1, r);
+            D->vals[j*D->nnz_col + k] = (k % 2) ? -1 : 1;
+        }
+    }
+    free_hash_table_D(index);
+    return D;
+}
+
+void free_bdry_matrix(struct bdry_matrix * D)
+{
+    if (!D) return;
+    free(D->rows);
+    free(D->vals);
+    free(D);
+}
+
 gsl_matrix * compute_boundary_operator_matrix(SCG * scg, int dim)
 {
     /* Returns the boundary operator matrix for the simplicial complex scg
      * in dimension dim */
 
     gsl_matrix *bdry_mat;
+    struct bdry_matrix * D = compute_boundary_operator_sparse(scg, dim);
 
-    if (dim <= 0) {
-        /* Boundary operator in dimension zero is zero map */
+    if ((D->nrows == 0) || (D->ncols == 0)) {
+        /* Zero map or empty chain groups */
+        free_bdry_matrix(D);
         bdry_mat = gsl_matrix_calloc(1, 1);
         return bdry_mat;
     }
 
-    int targ_dim = scg->cg_dim[dim-1];
-    int source_dim = scg->cg_dim[dim];
-
-    if ((targ_dim == 0) || (source_dim == 0)) {
-        /* empty chain groups */
-        bdry_mat = gsl_matrix_calloc(1, 1);
-        return bdry_mat;
+    bdry_mat = gsl_matrix_calloc(D->nrows, D->ncols);
+    for (int j = 0; j < D->ncols; j++) {
+        for (int k = 0; k < D->nnz_col; k++) {
+            int r = D->rows[j*D->nnz_col + k];
+            if (r >= 0) {
+                gsl_matrix_set(bdry_mat, r, j, D->vals[j*D->nnz_col + k]);
+            }
+        }
     }
+    free_bdry_matrix(D);
+    return bdry_mat;
+}
 
-    /* int *bdry_mat = calloc(targ_dim*source_dim, sizeof(int));*/
-    bdry_mat = gsl_matrix_alloc(targ_dim, source_dim);
+/*
+ *  Add D D^T to the dense matrix L (D->nrows square)
+ *  Each column of D contributes the products of its entries
+ */
+static void add_bdry_outer(gsl_matrix * L, struct bdry_matrix * D)
+{
+    for (int j = 0; j < D->ncols; j++) {
+        int * rows = D->rows + j*D->nnz_col;
+        int * vals = D->vals + j*D->nnz_col;
+        for (int a = 0; a < D->nnz_col; a++) {
+            if (rows[a] < 0) continue;
+            for (int b = 0; b < D->nnz_col; b++) {
+                if (rows[b] < 0) continue;
+                double *x = gsl_matrix_ptr(L, rows[a], rows[b]);
+                *x += vals[a]*vals[b];
+            }
+        }
+    }
+}
 
-    struct simplex_list * source;
-    struct simplex_list * targ;
-    source = scg->x[dim];
-    targ = scg->x[dim-1];
+/*
+ *  Add D^T D to the dense matrix L (D->ncols square)
+ *  The columns sharing each row contribute the products of their entries
+ */
+static void add_bdry_inner(gsl_matrix * L, struct bdry_matrix * D)
+{
+    /* Transpose D: columns of each row, compressed */
+    int * rowptr = calloc(D->nrows + 1, sizeof(int));
+    int * cols = malloc(((size_t)D->ncols * D->nnz_col + 1) * sizeof(int));
+    int * vals = malloc(((size_t)D->ncols * D->nnz_col + 1) * sizeof(int));
+    size_t nnz = (size_t)D->ncols * D->nnz_col;
+
+    for (size_t e = 0; e < nnz; e++) {
+        if (D->rows[e] >= 0) rowptr[D->rows[e] + 1]++;
+    }
+    for (int r = 0; r < D->nrows; r++) {
+        rowptr[r+1] += rowptr[r];
+    }
+    int * fill = malloc((D->nrows + 1) * sizeof(int));
+    memcpy(fill, rowptr, D->nrows * sizeof(int));
+    for (size_t e = 0; e < nnz; e++) {
+        int r = D->rows[e];
+        if (r < 0) continue;
+        cols[fill[r]] = e / D->nnz_col;
+        vals[fill[r]] = D->vals[e];
+        fill[r]++;
+    }
 
-    struct bdry_op_dict *bdry_op;
-    int * bdry_vec;
-    
-    int i=0, j=0;
-    while (source) {
-        bdry_op = compute_boundary_operator(source->s);
-        bdry_vec = bdry_canonical_coordinates(bdry_op, targ, targ_dim);
-        for (j = 0; j < targ_dim; j++) {
-            gsl_matrix_set(bdry_mat, j, i, bdry_vec[j]);
-            /* bdry_mat[j*source_dim + i] = bdry_vec[j];*/
-            // printf("bdry_vec: %d, %f\n", j, bdry_vec[j]);
+    for (int r = 0; r < D->nrows; r++) {
+        for (int a = rowptr[r]; a < rowptr[r+1]; a++) {
+            for (int b = rowptr[r]; b < rowptr[r+1]; b++) {
+                double *x = gsl_matrix_ptr(L, cols[a], cols[b]);
+                *x += vals[a]*vals[b];
+            }
         }
-        i++;
-        source = source->next;
-        free_bdry_op_dict(bdry_op);
-        free(bdry_vec);
     }
-    return bdry_mat;
+    free(rowptr);
+    free(cols);
+    free(vals);
+    free(fill);
 }
 
 gsl_matrix * compute_simplicial_laplacian(SCG * scg, int dim)
 {
     /* Computes the simplicial laplacian for the simplicial complex scg
-     * in dimension dim */
+     * in dimension dim:
+     * L = \partial_{dim}^T \partial_{dim} + \partial_{dim+1} \partial_{dim+1}^T
+     * accumulated from the sparse boundary operators */
 
-    gsl_matrix * D_dim;   /* \partial_{dim} */
-    gsl_matrix * D_dim_1; /* \partial_{dim+1} */
     gsl_matrix * laplacian;
-
-    /* Check dimensions */
-    int L_dim = scg->cg_dim[dim];
-    int d_dim;
-    if (dim > 0) {
-        d_dim = scg->cg_dim[dim-1];
-    } else {
-        d_dim = 0;
-    }
-    int d_1_dim = scg->cg_dim[dim+1];
+    struct bdry_matrix * D;
 
     /* Allocate result */
+    int L_dim = scg->cg_dim[dim];
     if (L_dim > 0) {
         laplacian = gsl_matrix_calloc(L_dim, L_dim);
     } else {
@@ -257,22 +361,19 @@ gsl_matrix * compute_simplicial_laplacian(SCG * scg, int dim)
         return laplacian;
     }
 
-    /* Compute Boundary Operators */
-    D_dim = compute_boundary_operator_matrix(scg, dim);
-    D_dim_1 = compute_boundary_operator_matrix(scg, dim+1);
-
-    /* Compute Laplacian */ 
-    if (d_dim > 0) {
-        gsl_blas_dgemm(CblasTrans, CblasNoTrans, 1.0,
-                       D_dim, D_dim, 0.0, laplacian);
-    }
-    if (d_1_dim > 0) {
-        gsl_blas_dgemm(CblasNoTrans, CblasTrans, 1.0,
-                       D_dim_1, D_dim_1, 1.0, laplacian);
+    /* \partial_{dim}^T \partial_{dim} */
+    D = compute_boundary_operator_sparse(scg, dim);
+    if (D->nrows > 0) {
+        add_bdry_inner(laplacian, D);
     }
+    free_bdry_matrix(D);
 
-    gsl_matrix_free(D_dim);
-    gsl_matrix_free(D_dim_1);
+    /* \partial_{dim+1} \partial_{dim+1}^T */
+    D = compute_boundary_operator_sparse(scg, dim+1);
+    if (D->ncols > 0) {
+        add_bdry_outer(laplacian, D);
+    }
+    free_bdry_matrix(D);
     return laplacian;
 }
 
@@ -329,4 +430,8 @@ void reconcile_laplacians(gsl_matrix * L1, gsl_matrix * L2,
         gsl_matrix_free(L1);
         return; 
     }
+
+    /* Same size: nothing to expand */
+    *L1new = L1;
+    *L2new = L2;
 }
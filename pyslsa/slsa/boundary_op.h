@@ -37,6 +37,17 @@ struct bdry_op_dict {
 };
 
 
+/* Sparse boundary operator: column j has the nnz_col entries
+ * rows[j*nnz_col + i] with values vals[j*nnz_col + i].
+ * A row of -1 marks a face missing from the target chain group. */
+struct bdry_matrix {
+    int nrows;
+    int ncols;
+    int nnz_col;
+    int * rows;
+    int * vals;
+};
+
 struct bdry_op_dict * get_empty_bdry_op_dict(void);
 
 void free_bdry_op_dict(struct bdry_op_dict * d);
@@ -49,7 +60,11 @@ unsigned int bdry_check_hash(struct bdry_op_dict * tab, struct Simplex *sp,
                              unsigned int *indx);
 
 int * bdry_canonical_coordinates(struct bdry_op_dict * bdry_op,
-                                 struct simplex_list *basis, int targ_dim);
+                                 SCG * scg, int targ_dim);
+
+struct bdry_matrix * compute_boundary_operator_sparse(SCG * scg, int dim);
+
+void free_bdry_matrix(struct bdry_matrix * D);
 
 gsl_matrix * compute_boundary_operator_matrix(SCG * scg, int dim);
 
@@ -18,6 +18,7 @@
 
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 
 #include "simplex.h"
 #include "hash_table.h"
@@ -47,12 +48,40 @@ struct simplex_hash_entry **get_empty_hash_table()
 }
 
 struct simplex_hash_table * get_empty_hash_table_D()
+{
+    return get_hash_table_D(0);
+}
+
+/*
+ *  Number of slots holding nsimplices at a load factor of at most 1/2
+ */
+static size_t hash_table_size_D(size_t nsimplices)
+{
+    size_t size = NR_HASH_D_MIN;
+    while (size < 2*nsimplices + 2) {
+        size *= 2;
+    }
+    return size;
+}
+
+/*
+ *  Allocate an SCG hash table with room for nsimplices simplices
+ */
+struct simplex_hash_table * get_hash_table_D(size_t nsimplices)
 {
     struct simplex_hash_table *out = calloc(1,
             sizeof(struct simplex_hash_table));
 
     if (!out) {
         printf("Unable to allocate table \n");
+        return out;
+    }
+    out->size = hash_table_size_D(nsimplices);
+    out->table = calloc(out->size, sizeof(struct simplex_hash_slot));
+    if (!out->table) {
+        printf("Unable to allocate table \n");
+        free(out);
+        return NULL;
     }
     return out;
 }
@@ -76,9 +105,49 @@ void free_hash_table(struct simplex_hash_entry **table)
 
 void free_hash_table_D(struct simplex_hash_table * table)
 {
+    if (!table) return;
+    free(table->table);
     free(table);
 }
 
+/*
+ *  Tables kept for reuse by hash_table_pool_get_D.
+ *  The pool is not thread safe: the python modules only use it while
+ *  holding the GIL.
+ */
+static struct simplex_hash_table * table_pool[NR_HASH_D_POOL];
+static int n_table_pool = 0;
+
+/*
+ *  Get a clear SCG hash table with room for nsimplices simplices,
+ *  reusing a pooled table if there is one
+ */
+struct simplex_hash_table * hash_table_pool_get_D(size_t nsimplices)
+{
+    struct simplex_hash_table * table;
+
+    if (n_table_pool == 0) {
+        return get_hash_table_D(nsimplices);
+    }
+    table = table_pool[--n_table_pool];
+    hash_table_reserve_D(table, nsimplices);
+    return table;
+}
+
+/*
+ *  Clear a table and return it to the pool (free it if the pool is full)
+ */
+void hash_table_pool_put_D(struct simplex_hash_table * table)
+{
+    if (!table) return;
+    if (n_table_pool == NR_HASH_D_POOL) {
+        free_hash_table_D(table);
+        return;
+    }
+    hash_table_clear_D(table);
+    table_pool[n_table_pool++] = table;
+}
+
 int check_hash(struct simplex_hash_entry **table, struct Simplex * sp)
 {
     /* Returns 1 if simplex found in hash table, 0 otherwise */
@@ -91,7 +160,7 @@ int check_hash(struct simplex_hash_entry **table, struct Simplex * sp)
     /* index into hash table */
     unsigned int index = sp_hash % NR_HASH;
     struct simplex_hash_entry *list = table[index];
-    struct simplex_hash_entry *prev;
+    struct simplex_hash_entry *prev = list;
 
     /* check for presence of simplex */
     while (list != NULL) {
@@ -127,54 +196,197 @@ void add_to_hash_list(struct simplex_hash_entry *list, struct Simplex *sp)
     list->next = s_new;
 }
 
-unsigned int simplex_hash(struct Simplex *s)
+unsigned int vertices_hash(const int * vertices, int dim)
 {
-    /* Computes hash value for simplex s */
+    /* Computes hash value for the simplex with the given vertices */
     int i;
-    int dim = s->dim;
     unsigned int hc = dim + 1;
     for (i=0; i<=dim; i++) {
-        hc = hc*314159 + s->vertices[i];
+        hc = hc*314159 + vertices[i];
     }
     return hc;
 }
 
-int check_hash_D(struct simplex_hash_table *table, struct Simplex * sp)
+unsigned int simplex_hash(struct Simplex *s)
 {
-    /* Linear probing.  Knuth V3 6.4 Alg. L */
-    /* Returns 1 if simplex is in hash table */
-    /* if not, it adds the simplex */
-    if (!sp)
-        return 1;
-
     /* Computes hash value for simplex s */
-    int j;
-    int dim = sp->dim;
-    unsigned int hc = dim + 1;
-    for (j=0; j<=dim; j++) {
-        hc = hc*314159 + sp->vertices[j];
+    return vertices_hash(s->vertices, s->dim);
+}
+
+/*
+ *  Slot index of a hash value in a table of size slots.
+ *  The hash is mixed so all its bits reach the low bits used as index.
+ */
+static size_t slot_index_D(unsigned int hc, size_t size)
+{
+    hc ^= hc >> 16;
+    hc *= 0x45d9f3b;
+    hc ^= hc >> 16;
+    return hc & (size - 1);
+}
+
+/*
+ *  Find the slot of a simplex of scg, or the empty slot where it goes.
+ *  Linear probing.  Knuth V3 6.4 Alg. L
+ *  The table is never full, so the probe ends on an empty slot.
+ *  Returns 1 if the simplex is in the hash table
+ */
+static int probe_hash_D(struct simplex_hash_table *table, SCG * scg,
+                        const int * vertices, int dim, size_t *indx)
+{
+    size_t i = slot_index_D(vertices_hash(vertices, dim), table->size);
+    struct simplex_hash_slot * slot;
+
+    while (1) {
+        slot = &table->table[i];
+        if (!slot->id) break;
+
+        if ((slot->dim == dim) &&
+            vertices_equal(SCG_SIMPLEX(scg, dim, slot->id - 1),
+                           vertices, dim)) {
+            *indx = i;
+            return 1;
+        }
+
+        /* Move to the previous slot, wrapping around */
+        i = (i - 1) & (table->size - 1);
     }
-    unsigned int index = hc % NR_HASH;
-    
-    unsigned int i = index;
-    while (i != index + 1) {
-        if (!(table->table[i])) break;
+    *indx = i;
+    return 0;
+}
 
-        if (simplex_equals(table->table[i], sp)) return 1;
+/*
+ *  Grow the table so it holds nsimplices simplices at a load factor
+ *  of at most 1/2, rehashing the simplices already in it
+ */
+void hash_table_reserve_D(struct simplex_hash_table *table, size_t nsimplices)
+{
+    size_t size = hash_table_size_D(nsimplices);
+    struct simplex_hash_slot * old = table->table;
+    size_t old_size = table->size;
+    size_t indx;
+
+    if (size <= old_size) return;
+
+    table->table = calloc(size, sizeof(struct simplex_hash_slot));
+    if (!table->table) {
+        printf("Unable to grow table \n");
+        table->table = old;
+        return;
+    }
+    table->size = size;
+    for (size_t i = 0; i < old_size; i++) {
+        if (!old[i].id) continue;
+        probe_hash_D(table, table->scg,
+                     SCG_SIMPLEX(table->scg, old[i].dim, old[i].id - 1),
+                     old[i].dim, &indx);
+        table->table[indx] = old[i];
+    }
+    free(old);
+}
 
-        if (i == 0) {
-            i = NR_HASH - 1;
-        } else {
-            i -= 1;
+/*
+ *  Remove all the simplices from the table, keeping its slots
+ */
+void hash_table_clear_D(struct simplex_hash_table *table)
+{
+    memset(table->table, 0, table->size * sizeof(struct simplex_hash_slot));
+    memset(table->nseen, 0, sizeof(table->nseen));
+    table->N = 0;
+    table->scg = NULL;
+}
+
+/*
+ *  Make table index the simplices of scg.  A table used with another
+ *  SCG is cleared first.  Simplices added to scg since the last call
+ *  are added to the table.
+ */
+void hash_table_sync_D(struct simplex_hash_table *table, SCG * scg)
+{
+    size_t indx;
+    size_t nsimplices = 0;
+
+    if (table->scg != scg) {
+        if (table->N > 0) {
+            hash_table_clear_D(table);
         }
+        table->scg = scg;
     }
-    if (table->N == (NR_HASH-1)) {
-        printf("Table Overflow!\n");
-        return 0;
-    } else {
-        table->N++;
-        table->table[i] = sp;
+    for (int dim = 0; dim < MAXDIM; dim++) {
+        nsimplices += scg->cg_dim[dim] - table->nseen[dim];
     }
+    hash_table_reserve_D(table, table->N + nsimplices);
+
+    for (int dim = 0; dim < MAXDIM; dim++) {
+        for (int k = table->nseen[dim]; k < scg->cg_dim[dim]; k++) {
+            if (probe_hash_D(table, scg, SCG_SIMPLEX(scg, dim, k), dim,
+                             &indx)) {
+                continue;
+            }
+            table->table[indx].dim = dim;
+            table->table[indx].id = k + 1;
+            table->N++;
+        }
+        table->nseen[dim] = scg->cg_dim[dim];
+    }
+}
+
+int check_hash_D(struct simplex_hash_table *table, SCG * scg,
+                 const int * vertices, int dim)
+{
+    /* Returns 1 if the simplex is in scg */
+    /* if not, it adds the simplex to scg and to the hash table */
+    /* The table must index scg (see hash_table_sync_D) */
+    size_t indx;
+
+    if (2*(table->N + 1) + 2 > table->size) {
+        hash_table_reserve_D(table, 2*(table->N + 1));
+    }
+    if (probe_hash_D(table, scg, vertices, dim, &indx))
+        return 1;
+
+    int k = scg_append(scg, vertices, dim);
+    table->table[indx].dim = dim;
+    table->table[indx].id = k + 1;
+    table->nseen[dim] = scg->cg_dim[dim];
+    table->N++;
     return 0;
 }
 
+/*
+ *  Hash table indexing the chain group of scg in dimension dim only,
+ *  for lookups with find_hash_D
+ */
+struct simplex_hash_table * get_chain_group_index_D(SCG * scg, int dim)
+{
+    struct simplex_hash_table * table = get_hash_table_D(scg->cg_dim[dim]);
+    size_t indx;
+
+    if (!table) return NULL;
+    table->scg = scg;
+    for (int k = 0; k < scg->cg_dim[dim]; k++) {
+        if (probe_hash_D(table, scg, SCG_SIMPLEX(scg, dim, k), dim, &indx)) {
+            continue;
+        }
+        table->table[indx].dim = dim;
+        table->table[indx].id = k + 1;
+        table->N++;
+    }
+    table->nseen[dim] = scg->cg_dim[dim];
+    return table;
+}
+
+/*
+ *  Index of a simplex in its chain group of the SCG indexed by table,
+ *  -1 if it is not in the table.  The table is not modified.
+ */
+int find_hash_D(struct simplex_hash_table *table, const int * vertices,
+                int dim)
+{
+    size_t indx;
+
+    if (probe_hash_D(table, table->scg, vertices, dim, &indx)) {
+        return table->table[indx].id - 1;
+    }
+    return -1;
+}
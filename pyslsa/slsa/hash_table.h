@@ -22,15 +22,31 @@
 #include "simplex.h"
 
 #define NR_HASH 1048547
+#define NR_HASH_D_MIN 1024 /* Initial number of slots of an SCG hash table */
+#define NR_HASH_D_POOL 8   /* Number of SCG hash tables kept for reuse */
 
 struct simplex_hash_entry {
     struct Simplex * s;
     struct simplex_hash_entry * next;
 };
 
+/* Slot of an SCG hash table: simplex index+1 in chain group dim,
+ * 0 if the slot is empty */
+struct simplex_hash_slot {
+    int dim;
+    int id;
+};
+
+/* Open addressing hash table of the simplices of an SCG.
+ * The number of slots is a power of two and the table grows to keep
+ * the load factor below 1/2.
+ * Rows of scg->x[d] below nseen[d] have been added to the table. */
 struct simplex_hash_table {
-    struct Simplex *table[NR_HASH];
-    int N;
+    struct simplex_hash_slot * table;
+    size_t size;
+    size_t N;
+    struct SCG * scg;
+    int nseen[MAXDIM];
 };
 
 
@@ -44,11 +60,31 @@ void add_to_hash_list(struct simplex_hash_entry *list, struct Simplex *sp);
 
 unsigned int simplex_hash(struct Simplex *s);
 
-int check_hash_D(struct simplex_hash_table *table, struct Simplex * sp);
+unsigned int vertices_hash(const int * vertices, int dim);
+
+int check_hash_D(struct simplex_hash_table *table, struct SCG * scg,
+                 const int * vertices, int dim);
+
+void hash_table_sync_D(struct simplex_hash_table *table, struct SCG * scg);
+
+struct simplex_hash_table * get_chain_group_index_D(struct SCG * scg, int dim);
+
+int find_hash_D(struct simplex_hash_table *table, const int * vertices,
+                int dim);
 
 struct simplex_hash_table * get_empty_hash_table_D(void);
 
+struct simplex_hash_table * get_hash_table_D(size_t nsimplices);
+
+void hash_table_reserve_D(struct simplex_hash_table *table, size_t nsimplices);
+
+void hash_table_clear_D(struct simplex_hash_table *table);
+
 void free_hash_table_D(struct simplex_hash_table * table);
 
+struct simplex_hash_table * hash_table_pool_get_D(size_t nsimplices);
+
+void hash_table_pool_put_D(struct simplex_hash_table * table);
+
 
 #endif
@@ -25,6 +25,7 @@
 #include "simplex.h"
 #include "boundary_op.h"
 #include "slse.h"
+#include "pyslsa_scg.h"
 
 /* 
  *  Python Simplex object definition
@@ -52,20 +53,20 @@ static PyObject * Simplex_new(PyTypeObject * type,
 }
 
 /*
- *  Destroy a python simplex by calling the appropriate "free" method
- *  as defined in the pyslsa_SimplexType structure
+ *  Free the C simplex stored in the python simplex object
  */
-static void Simplex_dealloc(pyslsa_SimplexObject * self)
+static void Simplex_free(pyslsa_SimplexObject * self)
 {
-    Py_TYPE(self)->tp_free((PyObject *)self);
+    free_simplex(self->s);     
 }
 
 /*
- *  Free the C simplex stored in the python simplex object
+ *  Destroy a python simplex: free the C simplex, then the object
  */
-static void Simplex_free(pyslsa_SimplexObject * self)
+static void Simplex_dealloc(pyslsa_SimplexObject * self)
 {
-    free_simplex(self->s);     
+    Simplex_free(self);
+    Py_TYPE(self)->tp_free((PyObject *)self);
 }
 
 /*
@@ -110,7 +111,7 @@ static PyMethodDef Simplex_methods[] = {
  */
 static PyTypeObject pyslsa_SimplexType = {
     PyVarObject_HEAD_INIT(NULL, 0)
-    "pyslsa.Simplex",
+    "pycuslsa.Simplex",
     sizeof(pyslsa_SimplexObject),
     0,
     (destructor)Simplex_dealloc,
@@ -147,53 +148,13 @@ static PyTypeObject pyslsa_SimplexType = {
     0,
     0,
     Simplex_new,
-    (freefunc)Simplex_free,      
+    0, /* tp_free: default, see Simplex_dealloc */
 };
 
 /* ************************************************************************* */
 /* Simplicial Complex Object Definitions                                     */
 /* ************************************************************************* */
 
-/*
- *  Define the Simplicial Complex (SCG - "Simplicial Chain Group") python object
- *  A Python SCG consists of a C SCG wrapped in python stuff
- */
-typedef struct {
-    PyObject_HEAD
-    SCG * scg;
-} pyslsa_SCGObject;
-
-/*
- *  Destroy a Python SCG object
- */
-static void SCG_dealloc(pyslsa_SCGObject * self)
-{
-    Py_TYPE(self)->tp_free((PyObject *)self);
-}
-
-/*
- *  Free the SCG stored in a Python SCG object
- */
-static void SCG_free(pyslsa_SCGObject * self)
-{
-    free_SCG(self->scg);     
-}
-
-/*
- *  Create a new Python SCG object by creating an empty C SCG
- */
-static PyObject * SCG_new(PyTypeObject * type,
-                          PyObject * args, PyObject * kwds)
-{
-    pyslsa_SCGObject * self;
-    self = (pyslsa_SCGObject *)type->tp_alloc(type, 0);
-    if (self != NULL) {
-        self->scg = get_empty_SCG();
-
-    }
-    return (PyObject *)self;
-}
-
 /*
  *  Adds a top-level simplex to the SCG, recomputing the chain groups of each
  * dimension
@@ -206,6 +167,7 @@ static PyObject * PySCG_add_max_simplex(pyslsa_SCGObject * self,
         return NULL;
 
     scg_add_max_simplex(self->scg, maxsimp->s);
+    SCG_clear_spectra(self);
     Py_RETURN_NONE;
 }
 
@@ -294,6 +256,21 @@ static PyMethodDef SCG_methods[] = {
     {"print_D", (PyCFunction)PySCG_print_boundary_op, METH_VARARGS,
         "Print the boundary operator of dimension d"
     },
+    {"spectrum", (PyCFunction)PySCG_spectrum, METH_VARARGS,
+        "Sorted eigenvalues of the laplacian of dimension d (cached)"
+    },
+    {"boundary", (PyCFunction)PySCG_boundary, METH_VARARGS,
+        "Sparse boundary operator of dimension d: rows, cols, vals, shape"
+    },
+    {"to_bytes", (PyCFunction)PySCG_to_bytes, METH_NOARGS,
+        "Serialize the simplicial complex to bytes"
+    },
+    {"from_bytes", (PyCFunction)PySCG_from_bytes, METH_VARARGS | METH_CLASS,
+        "Build a simplicial complex from the output of to_bytes"
+    },
+    {"__reduce__", (PyCFunction)PySCG_reduce, METH_NOARGS,
+        "Pickle support"
+    },
     {"L_dim", (PyCFunction)PySCG_get_laplacian_dim, METH_VARARGS,
         "Print the dimension of the d-Laplacian matrix"
     },
@@ -305,8 +282,8 @@ static PyMethodDef SCG_methods[] = {
  */
 static PyTypeObject pyslsa_SCGType = {
     PyVarObject_HEAD_INIT(NULL, 0)
-    "pyslsa.SCG",
-    sizeof(pyslsa_SCGType),
+    "pycuslsa.SCG",
+    sizeof(pyslsa_SCGObject),
     0,
     (destructor)SCG_dealloc,
     0,
@@ -342,7 +319,7 @@ static PyTypeObject pyslsa_SCGType = {
     0,
     0,
     SCG_new,
-    (freefunc)SCG_free,
+    0, /* tp_free: default, see SCG_dealloc */
 };
 
 /* ************************************************************************* */
@@ -351,45 +328,6 @@ static PyTypeObject pyslsa_SCGType = {
 
 static char pyslsa_docs[] = "PyCuSLSA: CUDA-Accelerated Simplicial Laplacian Spectral Analyzer";
 
-/*
- *  Python method to build a simplicial complex from a list of top-level (max)
- *  simplices
- */
-static PyObject * build_SCG(PyObject * self, PyObject * args)
-{
-    Py_ssize_t ind, vert_ind;
-    PyObject * max_simps;
-    PyObject * simp_verts;
-    struct Simplex * new_sp;
-    pyslsa_SCGObject * out;
-
-    if (!PyArg_ParseTuple(args, "O", &max_simps))
-        return NULL;
-
-    int n_max_simp = PyList_Size(max_simps);
-
-    /* Get a new SCG and allocate max simp list */
-    out = (pyslsa_SCGObject *)SCG_new(&pyslsa_SCGType, NULL, NULL);
-    struct Simplex **max_simp_list = malloc(n_max_simp * 
-                                            sizeof(struct Simplex *));
-
-    for (ind = 0; ind < n_max_simp; ind++) {
-        new_sp = create_empty_simplex();
-        simp_verts = PyList_GetItem(max_simps, ind);
-
-        for (vert_ind = 0; vert_ind < PyTuple_Size(simp_verts); vert_ind++) {
-            add_vertex(new_sp, (int)PyLong_AsLong(PyTuple_GetItem(simp_verts,
-                                                                  vert_ind)));
-        }
-        max_simp_list[ind] = new_sp;
-    }
-    
-    compute_chain_groups(max_simp_list, n_max_simp, out->scg);
-
-    free(max_simp_list);
-    return (PyObject *)out;
-}
-
 /*
  *  Compute the union of two python simplicial complexes
  */
@@ -397,49 +335,27 @@ static PyObject * SCG_union(PyObject * self, PyObject * args)
 {
     pyslsa_SCGObject *pyslsa_scg1, *pyslsa_scg2;
 
-    if (!PyArg_ParseTuple(args, "OO", &pyslsa_scg1, &pyslsa_scg2))
+    if (!PyArg_ParseTuple(args, "O&O&", SCG_converter, &pyslsa_scg1,
+                          SCG_converter, &pyslsa_scg2))
         return NULL;
 
     SCG * scg1 = pyslsa_scg1->scg;
     SCG * scg2 = pyslsa_scg2->scg;
 
-    struct simplex_hash_table *table = get_empty_hash_table_D();
+    struct simplex_hash_table *table = hash_table_pool_get_D(
+            scg_nsimplices(scg1) + scg_nsimplices(scg2));
     scg_list_union_hash(scg1, scg2, table);
-    free_hash_table_D(table);
+    hash_table_pool_put_D(table);
+    SCG_clear_spectra(pyslsa_scg2);
 
+    Py_INCREF(pyslsa_scg2);
     return (PyObject *)pyslsa_scg2;
 }
 
 /*
  *  Compute the KL divergence between two python Simplicial Complexes 
  *  in dimension dim and with inverse temperature beta.
- *  NOT CUDA ACCELERATED
- */
-static PyObject * KL(PyObject * self, PyObject * args)
-{
-    double beta, div;
-    int dim;
-    pyslsa_SCGObject *scg1, *scg2;
-
-    if (!PyArg_ParseTuple(args, "OOid", &scg1, &scg2, &dim, &beta))
-        return NULL;
-    gsl_matrix * L1 = compute_simplicial_laplacian(scg1->scg, (size_t)dim);
-    gsl_matrix * L2 = compute_simplicial_laplacian(scg2->scg, (size_t)dim);
-
-    reconcile_laplacians(L1, L2, &L1, &L2); 
-
-    div = KL_divergence(L1, L2, beta);
-    
-    gsl_matrix_free(L1);
-    gsl_matrix_free(L2);
-
-    return Py_BuildValue("d", div);
-}
-
-/*
- *  Compute the KL divergence between two python Simplicial Complexes 
- *  in dimension dim and with inverse temperature beta.
- *  CUDA version of the above function
+ *  CUDA version of KL (pyslsa_scg.h)
  */
 static PyObject * cuKL(PyObject * self, PyObject * args)
 {
@@ -447,7 +363,8 @@ static PyObject * cuKL(PyObject * self, PyObject * args)
     int dim;
     pyslsa_SCGObject *scg1, *scg2;
 
-    if (!PyArg_ParseTuple(args, "OOid", &scg1, &scg2, &dim, &beta))
+    if (!PyArg_ParseTuple(args, "O&O&id", SCG_converter, &scg1,
+                          SCG_converter, &scg2, &dim, &beta))
         return NULL;
     gsl_matrix * L1 = compute_simplicial_laplacian(scg1->scg, (size_t)dim);
     gsl_matrix * L2 = compute_simplicial_laplacian(scg2->scg, (size_t)dim);
@@ -465,71 +382,28 @@ static PyObject * cuKL(PyObject * self, PyObject * args)
 /*
  *  Compute the Jensen-Shannon divergence between two python SCGs
  *  in dimension dim and with inverse temperature beta.
- *  NOT CUDA ACCELERATED
- */
-static PyObject * JS(PyObject * self, PyObject * args)
-{
-    /* Compute the JS divergence between two simplices */
-    double beta, div, div1, div2;
-    int dim;
-    pyslsa_SCGObject *scg1, *scg2;
-
-    if (!PyArg_ParseTuple(args, "OOid", &scg1, &scg2, &dim, &beta))
-        return NULL;
-    gsl_matrix * L1 = compute_simplicial_laplacian(scg1->scg, (size_t)dim);
-    gsl_matrix * L2 = compute_simplicial_laplacian(scg2->scg, (size_t)dim);
-
-    reconcile_laplacians(L1, L2, &L1, &L2); 
-    gsl_matrix * M = gsl_matrix_alloc(L1->size1, L1->size2);
-    gsl_matrix_memcpy(M, L1);
-
-    /* Compute P + Q */
-    gsl_matrix_add(M, L2);
-    gsl_matrix_scale(M, 0.5);
-
-    div1 = KL_divergence(L1, M, beta);
-    div2 = KL_divergence(L2, M, beta);
-    div = 0.5*div1 + 0.5*div2;
-    
-    gsl_matrix_free(L1);
-    gsl_matrix_free(L2);
-    gsl_matrix_free(M);
-
-    return Py_BuildValue("d", div);
-}
-
-/*
- *  Compute the Jensen-Shannon divergence between two python SCGs
- *  in dimension dim and with inverse temperature beta.
- *  CUDA version of above function
+ *  CUDA version of JS (pyslsa_scg.h)
  */
 static PyObject * cuJS(PyObject * self, PyObject * args)
 {
     /* Compute the JS divergence between two simplices */
-    double beta, div, div1, div2;
+    double beta, div;
     int dim;
     pyslsa_SCGObject *scg1, *scg2;
 
-    if (!PyArg_ParseTuple(args, "OOid", &scg1, &scg2, &dim, &beta))
+    if (!PyArg_ParseTuple(args, "O&O&id", SCG_converter, &scg1,
+                          SCG_converter, &scg2, &dim, &beta))
         return NULL;
     gsl_matrix * L1 = compute_simplicial_laplacian(scg1->scg, (size_t)dim);
     gsl_matrix * L2 = compute_simplicial_laplacian(scg2->scg, (size_t)dim);
 
     reconcile_laplacians(L1, L2, &L1, &L2); 
-    gsl_matrix * M = gsl_matrix_alloc(L1->size1, L1->size2);
-    gsl_matrix_memcpy(M, L1);
-
-    /* Compute P + Q */
-    gsl_matrix_add(M, L2);
-    gsl_matrix_scale(M, 0.5);
 
-    div1 = KL_divergence_cuda(L1, M, beta);
-    div2 = KL_divergence_cuda(L2, M, beta);
-    div = 0.5*div1 + 0.5*div2;
+    /* Decomposes L1, L2 and their mean once each */
+    div = JS_divergence_cuda(L1, L2, beta);
     
     gsl_matrix_free(L1);
     gsl_matrix_free(L2);
-    gsl_matrix_free(M);
 
     return Py_BuildValue("d", div);
 }
@@ -540,10 +414,15 @@ static PyObject * cuJS(PyObject * self, PyObject * args)
 static PyMethodDef pyslsa_funcs[] = {
     {"KL", (PyCFunction)KL, METH_VARARGS, NULL},
     {"JS", (PyCFunction)JS, METH_VARARGS, NULL},
+    {"KL_betas", (PyCFunction)KL_betas, METH_VARARGS, NULL},
+    {"JS_betas", (PyCFunction)JS_betas, METH_VARARGS, NULL},
+    {"KL_batch", (PyCFunction)KL_batch, METH_VARARGS, NULL},
+    {"JS_batch", (PyCFunction)JS_batch, METH_VARARGS, NULL},
     {"cuKL", (PyCFunction)cuKL, METH_VARARGS, NULL},
     {"cuJS", (PyCFunction)cuJS, METH_VARARGS, NULL},
     {"build_SCG", (PyCFunction)build_SCG, METH_VARARGS, NULL},
     {"union", (PyCFunction)SCG_union, METH_VARARGS, NULL},
+    {"union_many", (PyCFunction)SCG_union_many, METH_VARARGS, NULL},
     {NULL}
 };
 
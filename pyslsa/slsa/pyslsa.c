@@ -24,6 +24,7 @@
 #include "simplex.h"
 #include "boundary_op.h"
 #include "slse.h"
+#include "pyslsa_scg.h"
 
 /* ************************************************************************* */
 /* Simplex Object Definition                                                 */
@@ -47,14 +48,15 @@ static PyObject * Simplex_new(PyTypeObject * type,
     return (PyObject *)self;
 }
 
-static void Simplex_dealloc(pyslsa_SimplexObject * self)
+static void Simplex_free(pyslsa_SimplexObject * self)
 {
-    Py_TYPE(self)->tp_free((PyObject *)self);
+    free_simplex(self->s);     
 }
 
-static void Simplex_free(pyslsa_SimplexObject * self)
+static void Simplex_dealloc(pyslsa_SimplexObject * self)
 {
-    free_simplex(self->s);     
+    Simplex_free(self);
+    Py_TYPE(self)->tp_free((PyObject *)self);
 }
 
 static PyObject * Simplex_add_vertex(pyslsa_SimplexObject * self,
@@ -121,40 +123,13 @@ static PyTypeObject pyslsa_SimplexType = {
     0,
     0,
     Simplex_new,
-    (freefunc)Simplex_free,      
+    0, /* tp_free: default, see Simplex_dealloc */
 };
 
 /* ************************************************************************* */
 /* Simplicial Complex Object Definitions                                     */
 /* ************************************************************************* */
 
-typedef struct {
-    PyObject_HEAD
-    SCG * scg;
-} pyslsa_SCGObject;
-
-static void SCG_dealloc(pyslsa_SCGObject * self)
-{
-    Py_TYPE(self)->tp_free((PyObject *)self);
-}
-
-static void SCG_free(pyslsa_SCGObject * self)
-{
-    free_SCG(self->scg);     
-}
-
-static PyObject * SCG_new(PyTypeObject * type,
-                          PyObject * args, PyObject * kwds)
-{
-    pyslsa_SCGObject * self;
-    self = (pyslsa_SCGObject *)type->tp_alloc(type, 0);
-    if (self != NULL) {
-        self->scg = get_empty_SCG();
-
-    }
-    return (PyObject *)self;
-}
-
 static PyObject * PySCG_add_max_simplex(pyslsa_SCGObject * self,
                                       PyObject * args, PyObject *kwds)
 {
@@ -163,6 +138,7 @@ static PyObject * PySCG_add_max_simplex(pyslsa_SCGObject * self,
         return NULL;
 
     scg_add_max_simplex(self->scg, maxsimp->s);
+    SCG_clear_spectra(self);
     Py_RETURN_NONE;
 }
 
@@ -223,6 +199,21 @@ static PyMethodDef SCG_methods[] = {
     {"print_D", (PyCFunction)PySCG_print_boundary_op, METH_VARARGS,
         "Print the boundary operator of dimension d"
     },
+    {"spectrum", (PyCFunction)PySCG_spectrum, METH_VARARGS,
+        "Sorted eigenvalues of the laplacian of dimension d (cached)"
+    },
+    {"boundary", (PyCFunction)PySCG_boundary, METH_VARARGS,
+        "Sparse boundary operator of dimension d: rows, cols, vals, shape"
+    },
+    {"to_bytes", (PyCFunction)PySCG_to_bytes, METH_NOARGS,
+        "Serialize the simplicial complex to bytes"
+    },
+    {"from_bytes", (PyCFunction)PySCG_from_bytes, METH_VARARGS | METH_CLASS,
+        "Build a simplicial complex from the output of to_bytes"
+    },
+    {"__reduce__", (PyCFunction)PySCG_reduce, METH_NOARGS,
+        "Pickle support"
+    },
     {NULL}
 };
 
@@ -230,7 +221,7 @@ static PyMethodDef SCG_methods[] = {
 static PyTypeObject pyslsa_SCGType = {
     PyVarObject_HEAD_INIT(NULL, 0)
     "pyslsa.SCG",
-    sizeof(pyslsa_SCGType),
+    sizeof(pyslsa_SCGObject),
     0,
     (destructor)SCG_dealloc,
     0,
@@ -266,7 +257,7 @@ static PyTypeObject pyslsa_SCGType = {
     0,
     0,
     SCG_new,
-    (freefunc)SCG_free,
+    0, /* tp_free: default, see SCG_dealloc */
 };
 
 /* ************************************************************************* */
@@ -275,99 +266,15 @@ static PyTypeObject pyslsa_SCGType = {
 
 static char pyslsa_docs[] = "PySLSA: Simplicial Laplacian Spectral Analyzer";
 
-static PyObject * build_SCG(PyObject * self, PyObject * args)
-{
-    Py_ssize_t ind, vert_ind;
-    PyObject * max_simps;
-    PyObject * simp_verts;
-    struct Simplex * new_sp;
-    pyslsa_SCGObject * out;
-
-    if (!PyArg_ParseTuple(args, "O", &max_simps))
-        return NULL;
-
-    int n_max_simp = PyList_Size(max_simps);
-
-    /* Get a new SCG and allocate max simp list */
-    out = SCG_new(&pyslsa_SCGType, NULL, NULL);
-    struct Simplex **max_simp_list = malloc(n_max_simp * 
-                                            sizeof(struct Simplex *));
-
-    for (ind = 0; ind < n_max_simp; ind++) {
-        new_sp = create_empty_simplex();
-        simp_verts = PyList_GetItem(max_simps, ind);
-
-        for (vert_ind = 0; vert_ind < PyTuple_Size(simp_verts); vert_ind++) {
-            add_vertex(new_sp, (int)PyLong_AsLong(PyTuple_GetItem(simp_verts,
-                                                                  vert_ind)));
-        }
-        max_simp_list[ind] = new_sp;
-    }
-    
-    compute_chain_groups(max_simp_list, n_max_simp, out->scg);
-
-    free(max_simp_list);
-    return (PyObject *)out;
-}
-
-/* Computes the KL divergence between two Simplicial Complexes in dimension
- * dim and with beta */
-static PyObject * KL(PyObject * self, PyObject * args)
-{
-    double beta, div;
-    int dim;
-    pyslsa_SCGObject *scg1, *scg2;
-
-    if (!PyArg_ParseTuple(args, "OOid", &scg1, &scg2, &dim, &beta))
-        return NULL;
-    gsl_matrix * L1 = compute_simplicial_laplacian(scg1->scg, (size_t)dim);
-    gsl_matrix * L2 = compute_simplicial_laplacian(scg2->scg, (size_t)dim);
-
-    reconcile_laplacians(L1, L2, &L1, &L2); 
-
-    div = KL_divergence(L1, L2, beta);
-    
-    gsl_matrix_free(L1);
-    gsl_matrix_free(L2);
-
-    return Py_BuildValue("d", div);
-}
-
-static PyObject * JS(PyObject * self, PyObject * args)
-{
-    /* Compute the JS divergence between two simplices */
-    double beta, div, div1, div2;
-    int dim;
-    pyslsa_SCGObject *scg1, *scg2;
-
-    if (!PyArg_ParseTuple(args, "OOid", &scg1, &scg2, &dim, &beta))
-        return NULL;
-    gsl_matrix * L1 = compute_simplicial_laplacian(scg1->scg, (size_t)dim);
-    gsl_matrix * L2 = compute_simplicial_laplacian(scg2->scg, (size_t)dim);
-
-    reconcile_laplacians(L1, L2, &L1, &L2); 
-    gsl_matrix * M = gsl_matrix_alloc(L1->size1, L1->size2);
-    gsl_matrix_memcpy(M, L1);
-
-    /* Compute P + Q */
-    gsl_matrix_add(M, L2);
-    gsl_matrix_scale(M, 0.5);
-
-    div1 = KL_divergence(L1, M, beta);
-    div2 = KL_divergence(L2, M, beta);
-    div = 0.5*div1 + 0.5*div2;
-    
-    gsl_matrix_free(L1);
-    gsl_matrix_free(L2);
-    gsl_matrix_free(M);
-
-    return Py_BuildValue("d", div);
-}
-
 static PyMethodDef pyslsa_funcs[] = {
     {"KL", (PyCFunction)KL, METH_VARARGS, NULL},
     {"JS", (PyCFunction)JS, METH_VARARGS, NULL},
+    {"KL_betas", (PyCFunction)KL_betas, METH_VARARGS, NULL},
+    {"JS_betas", (PyCFunction)JS_betas, METH_VARARGS, NULL},
+    {"KL_batch", (PyCFunction)KL_batch, METH_VARARGS, NULL},
+    {"JS_batch", (PyCFunction)JS_batch, METH_VARARGS, NULL},
     {"build_SCG", (PyCFunction)build_SCG, METH_VARARGS, NULL},
+    {"union_many", (PyCFunction)SCG_union_many, METH_VARARGS, NULL},
     {NULL}
 };
 
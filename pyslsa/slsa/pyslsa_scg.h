@@ -0,0 +1,805 @@
+/*
+ * =====================================================================================
+ *
+ *       Filename:  pyslsa_scg.h
+ *
+ *    Description:  Python SCG objects and divergence functions shared by the
+ *                  pyslsa and pycuslsa modules.  Included once by pyslsa.c
+ *                  and pycuslsa.c, which each define their own SCG type
+ *                  object pyslsa_SCGType (with the module's name and
+ *                  methods) and module method table.
+ *
+ *        Version:  1.0
+ *       Revision:  none
+ *       Compiler:  gcc
+ *
+ * =====================================================================================
+ */
+
+#ifndef PYSLSA_SCG_H
+#define PYSLSA_SCG_H
+
+#include <Python.h>
+
+#include <string.h>
+
+#include "simplex.h"
+#include "hash_table.h"
+#include "boundary_op.h"
+#include "slse.h"
+
+/* ************************************************************************* */
+/* Simplicial Complex Objects                                                */
+/* ************************************************************************* */
+
+/* Same layout in pyslsa and pycuslsa */
+typedef struct {
+    PyObject_HEAD
+    SCG * scg;
+    gsl_vector * spectra[MAXDIM]; /* Cached Laplacian spectra by dimension */
+} pyslsa_SCGObject;
+
+/* Defined by the including module */
+static PyTypeObject pyslsa_SCGType;
+
+/*
+ *  Return 1 if obj is an SCG of pyslsa or pycuslsa (their SCGs share
+ *  their layout, so either module's functions accept both), else 0
+ */
+static int is_SCG(PyObject * obj)
+{
+    const char * tp_name = strrchr(Py_TYPE(obj)->tp_name, '.');
+    return (tp_name != NULL) && !strcmp(tp_name, ".SCG");
+}
+
+/*
+ *  PyArg_ParseTuple "O&" converter for SCG arguments: stores the SCG in
+ *  *(pyslsa_SCGObject **)out, or sets a TypeError and returns 0
+ */
+static int SCG_converter(PyObject * obj, void * out)
+{
+    if (!is_SCG(obj)) {
+        PyErr_Format(PyExc_TypeError, "expected an SCG, got %.200s",
+                     Py_TYPE(obj)->tp_name);
+        return 0;
+    }
+    *(pyslsa_SCGObject **)out = (pyslsa_SCGObject *)obj;
+    return 1;
+}
+
+/*
+ *  Drop the cached Laplacian spectra of an SCG (when its simplices change)
+ */
+static void SCG_clear_spectra(pyslsa_SCGObject * self)
+{
+    for (int d = 0; d < MAXDIM; d++) {
+        if (self->spectra[d]) {
+            gsl_vector_free(self->spectra[d]);
+            self->spectra[d] = NULL;
+        }
+    }
+}
+
+static void SCG_free(pyslsa_SCGObject * self)
+{
+    SCG_clear_spectra(self);
+    free_SCG(self->scg);     
+}
+
+/*
+ *  Destroy a python SCG: free the C SCG and cached spectra, then the object
+ */
+static void SCG_dealloc(pyslsa_SCGObject * self)
+{
+    SCG_free(self);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+/*
+ *  Create a python SCG object holding an empty C SCG
+ */
+static PyObject * SCG_new(PyTypeObject * type,
+                          PyObject * args, PyObject * kwds)
+{
+    pyslsa_SCGObject * self;
+    self = (pyslsa_SCGObject *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->scg = get_empty_SCG();
+        for (int d = 0; d < MAXDIM; d++) {
+            self->spectra[d] = NULL;
+        }
+    }
+    return (PyObject *)self;
+}
+
+/*
+ *  Return the sorted eigenvalues of the Laplacian of an SCG in dimension
+ *  dim.  They are computed on first use and cached on the SCG object, so
+ *  divergences for many betas and many pairs only decompose each 
+ *  Laplacian once.  Returns NULL with a python exception set if dim is
+ *  out of range.
+ */
+static gsl_vector * SCG_spectrum(pyslsa_SCGObject * self, int dim)
+{
+    if ((dim < 0) || (dim >= MAXDIM - 1)) {
+        PyErr_Format(PyExc_ValueError, "Dimension %d out of range", dim);
+        return NULL;
+    }
+    if (self->spectra[dim] == NULL) {
+        gsl_vector * ev;
+        Py_BEGIN_ALLOW_THREADS
+        gsl_matrix * L = compute_simplicial_laplacian(self->scg, dim);
+        ev = laplacian_spectrum(L);
+        gsl_matrix_free(L);
+        Py_END_ALLOW_THREADS
+        /* Another thread may have filled the cache meanwhile */
+        if (self->spectra[dim] == NULL) {
+            self->spectra[dim] = ev;
+        } else {
+            gsl_vector_free(ev);
+        }
+    }
+    return self->spectra[dim];
+}
+
+/*
+ *  Copies of the cached spectra of two SCGs in dimension dim (see
+ *  SCG_spectrum), for use with the GIL released: another thread may
+ *  replace or free the caches meanwhile.  The caller frees *ev1 and *ev2.
+ *  Returns 0 with a python exception set on error.
+ */
+static int SCG_pin_spectra(pyslsa_SCGObject * scg1, pyslsa_SCGObject * scg2,
+                           int dim, gsl_vector ** ev1, gsl_vector ** ev2)
+{
+    gsl_vector * c1;
+    gsl_vector * c2;
+
+    if (!(c1 = SCG_spectrum(scg1, dim)) || !(c2 = SCG_spectrum(scg2, dim)))
+        return 0;
+    *ev1 = gsl_vector_alloc(c1->size);
+    *ev2 = gsl_vector_alloc(c2->size);
+    gsl_vector_memcpy(*ev1, c1);
+    gsl_vector_memcpy(*ev2, c2);
+    return 1;
+}
+
+/*
+ *  Return the sorted eigenvalues of the Laplacian in dimension d as a list
+ */
+static PyObject * PySCG_spectrum(pyslsa_SCGObject * self, PyObject *args)
+{
+    int d;
+    if (!PyArg_ParseTuple(args, "i", &d))
+        return NULL;
+
+    gsl_vector * ev = SCG_spectrum(self, d);
+    if (ev == NULL)
+        return NULL;
+
+    PyObject * out = PyList_New(ev->size);
+    for (size_t i = 0; i < ev->size; i++) {
+        PyList_SET_ITEM(out, i, PyFloat_FromDouble(gsl_vector_get(ev, i)));
+    }
+    return out;
+}
+
+/*
+ *  Return the boundary operator in dimension d as sparse
+ *  (rows, cols, vals, (nrows, ncols)) lists
+ */
+static PyObject * PySCG_boundary(pyslsa_SCGObject * self, PyObject *args)
+{
+    int d;
+    if (!PyArg_ParseTuple(args, "i", &d))
+        return NULL;
+    if ((d < 0) || (d >= MAXDIM)) {
+        PyErr_SetString(PyExc_ValueError, "Dimension out of range");
+        return NULL;
+    }
+
+    struct bdry_matrix * D = compute_boundary_operator_sparse(self->scg, d);
+    Py_ssize_t nnz = 0;
+    for (Py_ssize_t e = 0; e < (Py_ssize_t)D->ncols * D->nnz_col; e++) {
+        if (D->rows[e] >= 0) nnz++;
+    }
+    PyObject * rows = PyList_New(nnz);
+    PyObject * cols = PyList_New(nnz);
+    PyObject * vals = PyList_New(nnz);
+    Py_ssize_t pos = 0;
+    for (Py_ssize_t e = 0; e < (Py_ssize_t)D->ncols * D->nnz_col; e++) {
+        if (D->rows[e] < 0) continue;
+        PyList_SET_ITEM(rows, pos, PyLong_FromLong(D->rows[e]));
+        PyList_SET_ITEM(cols, pos, PyLong_FromLong(e / D->nnz_col));
+        PyList_SET_ITEM(vals, pos, PyLong_FromLong(D->vals[e]));
+        pos++;
+    }
+    PyObject * out = Py_BuildValue("(NNN(ii))", rows, cols, vals,
+                                   D->nrows, D->ncols);
+    free_bdry_matrix(D);
+    return out;
+}
+
+/*
+ *  Serialize the SCG to bytes: per dimension flat int32 vertex arrays
+ *  (native byte order), see scg_serialize
+ */
+static PyObject * PySCG_to_bytes(pyslsa_SCGObject * self)
+{
+    size_t n = scg_serialized_size(self->scg);
+    PyObject * out = PyBytes_FromStringAndSize(NULL, n * sizeof(int32_t));
+    if (out == NULL)
+        return NULL;
+
+    int32_t * buf = malloc(n * sizeof(int32_t));
+    scg_serialize(self->scg, buf);
+    memcpy(PyBytes_AS_STRING(out), buf, n * sizeof(int32_t));
+    free(buf);
+    return out;
+}
+
+/*
+ *  Build an SCG from the output of to_bytes (any bytes-like object)
+ */
+static PyObject * PySCG_from_bytes(PyTypeObject * type, PyObject * args)
+{
+    Py_buffer view;
+    int32_t * buf;
+    SCG * scg;
+
+    if (!PyArg_ParseTuple(args, "y*", &view))
+        return NULL;
+    if (view.len % sizeof(int32_t)) {
+        PyBuffer_Release(&view);
+        PyErr_SetString(PyExc_ValueError, "Invalid serialized SCG length");
+        return NULL;
+    }
+    /* Copy for alignment */
+    buf = malloc(view.len + 1);
+    memcpy(buf, view.buf, view.len);
+    scg = scg_deserialize(buf, view.len / sizeof(int32_t));
+    free(buf);
+    PyBuffer_Release(&view);
+    if (scg == NULL) {
+        PyErr_SetString(PyExc_ValueError, "Invalid serialized SCG");
+        return NULL;
+    }
+
+    pyslsa_SCGObject * out = (pyslsa_SCGObject *)SCG_new(type, NULL, NULL);
+    if (out == NULL) {
+        free_SCG(scg);
+        return NULL;
+    }
+    free_SCG(out->scg);
+    out->scg = scg;
+    return (PyObject *)out;
+}
+
+/*
+ *  Pickle support: SCGs are rebuilt with from_bytes(to_bytes())
+ */
+static PyObject * PySCG_reduce(pyslsa_SCGObject * self)
+{
+    PyObject * from_bytes = PyObject_GetAttrString((PyObject *)Py_TYPE(self),
+                                                   "from_bytes");
+    if (from_bytes == NULL)
+        return NULL;
+    PyObject * data = PySCG_to_bytes(self);
+    if (data == NULL) {
+        Py_DECREF(from_bytes);
+        return NULL;
+    }
+    return Py_BuildValue("(N(N))", from_bytes, data);
+}
+
+/* ************************************************************************* */
+/* Module Functions                                                          */
+/* ************************************************************************* */
+
+/*
+ *  Build a simplicial complex from a list of max simplices (tuples of
+ *  vertices), with chain groups up to dimension max_dim (all if -1)
+ */
+static PyObject * build_SCG(PyObject * self, PyObject * args)
+{
+    Py_ssize_t ind, vert_ind;
+    PyObject * max_simps;
+    PyObject * simp_verts;
+    struct Simplex * new_sp;
+    pyslsa_SCGObject * out;
+    int max_dim = -1;
+
+    if (!PyArg_ParseTuple(args, "O|i", &max_simps, &max_dim))
+        return NULL;
+
+    int n_max_simp = PyList_Size(max_simps);
+
+    /* Get a new SCG and allocate max simp list */
+    out = (pyslsa_SCGObject *)SCG_new(&pyslsa_SCGType, NULL, NULL);
+    struct Simplex **max_simp_list = malloc(n_max_simp * 
+                                            sizeof(struct Simplex *));
+
+    for (ind = 0; ind < n_max_simp; ind++) {
+        new_sp = create_empty_simplex();
+        simp_verts = PyList_GetItem(max_simps, ind);
+
+        for (vert_ind = 0; vert_ind < PyTuple_Size(simp_verts); vert_ind++) {
+            add_vertex(new_sp, (int)PyLong_AsLong(PyTuple_GetItem(simp_verts,
+                                                                  vert_ind)));
+        }
+        max_simp_list[ind] = new_sp;
+    }
+    
+    Py_BEGIN_ALLOW_THREADS
+    compute_chain_groups_capped(max_simp_list, n_max_simp, max_dim,
+                                out->scg);
+    Py_END_ALLOW_THREADS
+
+    for (ind = 0; ind < n_max_simp; ind++) {
+        free_simplex(max_simp_list[ind]);
+    }
+    free(max_simp_list);
+    return (PyObject *)out;
+}
+
+/*
+ *  Compute the union of a sequence of python simplicial complexes
+ *  as a new simplicial complex.  Linear in the total number of simplices.
+ */
+static PyObject * SCG_union_many(PyObject * self, PyObject * args)
+{
+    PyObject * scgs_obj;
+    PyObject * seq;
+    pyslsa_SCGObject * out;
+    struct simplex_hash_table * table;
+    size_t nmax = 0;
+
+    if (!PyArg_ParseTuple(args, "O", &scgs_obj))
+        return NULL;
+    seq = PySequence_Fast(scgs_obj, "scgs must be a sequence");
+    if (seq == NULL)
+        return NULL;
+
+    Py_ssize_t n = PySequence_Fast_GET_SIZE(seq);
+    SCG ** scgs = malloc((n + 1) * sizeof(SCG *));
+    for (Py_ssize_t i = 0; i < n; i++) {
+        PyObject * item = PySequence_Fast_GET_ITEM(seq, i);
+        if (!is_SCG(item)) {
+            PyErr_SetString(PyExc_TypeError, "scgs must hold SCG objects");
+            free(scgs);
+            Py_DECREF(seq);
+            return NULL;
+        }
+        scgs[i] = ((pyslsa_SCGObject *)item)->scg;
+        size_t ns = scg_nsimplices(scgs[i]);
+        nmax = ns > nmax ? ns : nmax;
+    }
+
+    out = (pyslsa_SCGObject *)SCG_new(&pyslsa_SCGType, NULL, NULL);
+    if (out == NULL) {
+        free(scgs);
+        Py_DECREF(seq);
+        return NULL;
+    }
+    table = hash_table_pool_get_D(nmax);
+
+    /* seq keeps the complexes alive */
+    Py_BEGIN_ALLOW_THREADS
+    scg_union_many(scgs, (int)n, out->scg, table);
+    Py_END_ALLOW_THREADS
+
+    hash_table_pool_put_D(table);
+    free(scgs);
+    Py_DECREF(seq);
+    return (PyObject *)out;
+}
+
+/*
+ *  Convert a python sequence of betas to a C array of nbetas doubles
+ */
+static double * parse_betas(PyObject * betas_obj, Py_ssize_t * nbetas)
+{
+    PyObject * seq = PySequence_Fast(betas_obj, "betas must be a sequence");
+    if (seq == NULL)
+        return NULL;
+
+    Py_ssize_t n = PySequence_Fast_GET_SIZE(seq);
+    double * betas = malloc((n + 1) * sizeof(double));
+    for (Py_ssize_t i = 0; i < n; i++) {
+        betas[i] = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(seq, i));
+    }
+    Py_DECREF(seq);
+    if (PyErr_Occurred()) {
+        free(betas);
+        return NULL;
+    }
+    *nbetas = n;
+    return betas;
+}
+
+/*
+ *  Return an array of n divergences as a python list
+ */
+static PyObject * divergence_list(double * divs, Py_ssize_t n)
+{
+    PyObject * out = PyList_New(n);
+    for (Py_ssize_t i = 0; i < n; i++) {
+        PyList_SET_ITEM(out, i, PyFloat_FromDouble(divs[i]));
+    }
+    return out;
+}
+
+/*
+ *  Sorted eigenvalues of the mean (L1 + L2)/2 of the dim Laplacians 
+ *  of two SCGs, after reconciling their bases.  Needed for JS, and
+ *  not a function of the two spectra alone, so it is not cached.
+ */
+static gsl_vector * mean_laplacian_spectrum(pyslsa_SCGObject * scg1,
+                                            pyslsa_SCGObject * scg2,
+                                            int dim,
+                                            struct spectrum_workspace * ws)
+{
+    gsl_matrix * L1 = compute_simplicial_laplacian(scg1->scg, dim);
+    gsl_matrix * L2 = compute_simplicial_laplacian(scg2->scg, dim);
+    gsl_vector * evM;
+
+    reconcile_laplacians(L1, L2, &L1, &L2); 
+    gsl_matrix_add(L1, L2);
+    gsl_matrix_scale(L1, 0.5);
+    evM = laplacian_spectrum_ws(L1, ws);
+
+    gsl_matrix_free(L1);
+    gsl_matrix_free(L2);
+    return evM;
+}
+
+/*
+ *  Compute the KL divergence between two python SCGs in dimension dim
+ *  and with inverse temperature beta
+ */
+static PyObject * KL(PyObject * self, PyObject * args)
+{
+    double beta, div;
+    int dim;
+    pyslsa_SCGObject *scg1, *scg2;
+    gsl_vector *ev1, *ev2;
+
+    if (!PyArg_ParseTuple(args, "O&O&id", SCG_converter, &scg1,
+                          SCG_converter, &scg2, &dim, &beta))
+        return NULL;
+    if (!SCG_pin_spectra(scg1, scg2, dim, &ev1, &ev2))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    KL_divergence_spectra(ev1, ev2, &beta, 1, &div);
+    Py_END_ALLOW_THREADS
+    gsl_vector_free(ev1);
+    gsl_vector_free(ev2);
+    return Py_BuildValue("d", div);
+}
+
+/*
+ *  Compute the JS divergence between two python SCGs in dimension dim
+ *  and with inverse temperature beta
+ */
+static PyObject * JS(PyObject * self, PyObject * args)
+{
+    /* Compute the JS divergence between two simplices */
+    double beta, div;
+    int dim;
+    pyslsa_SCGObject *scg1, *scg2;
+    gsl_vector *ev1, *ev2, *evM;
+
+    if (!PyArg_ParseTuple(args, "O&O&id", SCG_converter, &scg1,
+                          SCG_converter, &scg2, &dim, &beta))
+        return NULL;
+    if (!SCG_pin_spectra(scg1, scg2, dim, &ev1, &ev2))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    evM = mean_laplacian_spectrum(scg1, scg2, dim, NULL);
+    JS_divergence_spectra(ev1, ev2, evM, &beta, 1, &div);
+    gsl_vector_free(evM);
+    Py_END_ALLOW_THREADS
+    gsl_vector_free(ev1);
+    gsl_vector_free(ev2);
+
+    return Py_BuildValue("d", div);
+}
+
+/*
+ *  Compute the KL divergence between two python SCGs in dimension dim
+ *  for every beta in a sequence.  Returns a list of divergences.
+ *  Each Laplacian spectrum is computed once and cached on the SCG.
+ *  The GIL is released during the computation, so calls on different
+ *  pairs can run in parallel threads.
+ */
+static PyObject * KL_betas(PyObject * self, PyObject * args)
+{
+    int dim;
+    pyslsa_SCGObject *scg1, *scg2;
+    PyObject *betas_obj, *out;
+    gsl_vector *ev1, *ev2;
+    Py_ssize_t nbetas;
+    double *betas, *divs;
+
+    if (!PyArg_ParseTuple(args, "O&O&iO", SCG_converter, &scg1,
+                          SCG_converter, &scg2, &dim, &betas_obj))
+        return NULL;
+    if (!(betas = parse_betas(betas_obj, &nbetas)))
+        return NULL;
+    if (!SCG_pin_spectra(scg1, scg2, dim, &ev1, &ev2)) {
+        free(betas);
+        return NULL;
+    }
+
+    divs = malloc((nbetas + 1) * sizeof(double));
+    Py_BEGIN_ALLOW_THREADS
+    KL_divergence_spectra(ev1, ev2, betas, nbetas, divs);
+    Py_END_ALLOW_THREADS
+    out = divergence_list(divs, nbetas);
+
+    gsl_vector_free(ev1);
+    gsl_vector_free(ev2);
+    free(betas);
+    free(divs);
+    return out;
+}
+
+/*
+ *  Compute the JS divergence between two python SCGs in dimension dim
+ *  for every beta in a sequence.  Returns a list of divergences.
+ *  One eigendecomposition (the mean Laplacian) per call.
+ */
+static PyObject * JS_betas(PyObject * self, PyObject * args)
+{
+    int dim;
+    pyslsa_SCGObject *scg1, *scg2;
+    PyObject *betas_obj, *out;
+    gsl_vector *ev1, *ev2, *evM;
+    Py_ssize_t nbetas;
+    double *betas, *divs;
+
+    if (!PyArg_ParseTuple(args, "O&O&iO", SCG_converter, &scg1,
+                          SCG_converter, &scg2, &dim, &betas_obj))
+        return NULL;
+    if (!(betas = parse_betas(betas_obj, &nbetas)))
+        return NULL;
+    if (!SCG_pin_spectra(scg1, scg2, dim, &ev1, &ev2)) {
+        free(betas);
+        return NULL;
+    }
+
+    divs = malloc((nbetas + 1) * sizeof(double));
+    Py_BEGIN_ALLOW_THREADS
+    evM = mean_laplacian_spectrum(scg1, scg2, dim, NULL);
+    JS_divergence_spectra(ev1, ev2, evM, betas, nbetas, divs);
+    Py_END_ALLOW_THREADS
+    out = divergence_list(divs, nbetas);
+
+    gsl_vector_free(ev1);
+    gsl_vector_free(ev2);
+    gsl_vector_free(evM);
+    free(betas);
+    free(divs);
+    return out;
+}
+
+/*
+ *  Collect the SCG objects of a python sequence into a C array holding
+ *  a reference to each, so they outlive the sequence (which may be a
+ *  temporary built from an iterator).  Release with scg_array_free.
+ *  Returns NULL with a python exception set on error.
+ */
+static pyslsa_SCGObject ** scg_array(PyObject * scgs_obj, Py_ssize_t * n)
+{
+    PyObject * seq = PySequence_Fast(scgs_obj, "scgs must be a sequence");
+    if (seq == NULL)
+        return NULL;
+
+    *n = PySequence_Fast_GET_SIZE(seq);
+    pyslsa_SCGObject ** scgs = malloc((*n + 1) * sizeof(pyslsa_SCGObject *));
+    for (Py_ssize_t i = 0; i < *n; i++) {
+        PyObject * item = PySequence_Fast_GET_ITEM(seq, i);
+        if (!is_SCG(item)) {
+            PyErr_SetString(PyExc_TypeError, "scgs must hold SCG objects");
+            while (i-- > 0) {
+                Py_DECREF(scgs[i]);
+            }
+            free(scgs);
+            Py_DECREF(seq);
+            return NULL;
+        }
+        Py_INCREF(item);
+        scgs[i] = (pyslsa_SCGObject *)item;
+    }
+    Py_DECREF(seq);
+    return scgs;
+}
+
+/*
+ *  Release the array of scg_array.  Must be called with the GIL held.
+ */
+static void scg_array_free(pyslsa_SCGObject ** scgs, Py_ssize_t n)
+{
+    if (!scgs) return;
+    for (Py_ssize_t i = 0; i < n; i++) {
+        Py_DECREF(scgs[i]);
+    }
+    free(scgs);
+}
+
+/*
+ *  Spectra in dimension dim of every SCG in scgs, for use with the GIL
+ *  released.  Returns an array of nuniq spectra, one per distinct SCG,
+ *  and sets idx[i] to the spectrum of scgs[i].  The spectra are copies
+ *  that belong to the caller (free with free_spectra), so another thread
+ *  may replace the caches meanwhile.  Missing spectra are computed in an
+ *  OpenMP parallel loop without the GIL and added to the caches.
+ *  Must be called with the GIL held.
+ */
+static gsl_vector ** pin_spectra(pyslsa_SCGObject ** scgs, Py_ssize_t n,
+                                 int dim, Py_ssize_t * idx, Py_ssize_t * nuniq)
+{
+    pyslsa_SCGObject ** uniq = malloc((n + 1) * sizeof(pyslsa_SCGObject *));
+    gsl_vector ** evs = malloc((n + 1) * sizeof(gsl_vector *));
+    Py_ssize_t nu = 0;
+
+    /* Each distinct SCG once, copying the cached spectra */
+    for (Py_ssize_t i = 0; i < n; i++) {
+        Py_ssize_t j = 0;
+        while ((j < nu) && (uniq[j] != scgs[i])) {
+            j++;
+        }
+        idx[i] = j;
+        if (j < nu) continue;
+
+        uniq[nu] = scgs[i];
+        evs[nu] = NULL;
+        if (scgs[i]->spectra[dim]) {
+            evs[nu] = gsl_vector_alloc(scgs[i]->spectra[dim]->size);
+            gsl_vector_memcpy(evs[nu], scgs[i]->spectra[dim]);
+        }
+        nu++;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    #pragma omp parallel
+    {
+        /* One eigensolver workspace per thread, reused across SCGs */
+        struct spectrum_workspace * ws = spectrum_workspace_alloc();
+        #pragma omp for schedule(dynamic)
+        for (Py_ssize_t j = 0; j < nu; j++) {
+            if (evs[j]) continue;
+            gsl_matrix * L = compute_simplicial_laplacian(uniq[j]->scg, dim);
+            evs[j] = laplacian_spectrum_ws(L, ws);
+            gsl_matrix_free(L);
+        }
+        spectrum_workspace_free(ws);
+    }
+    Py_END_ALLOW_THREADS
+
+    for (Py_ssize_t j = 0; j < nu; j++) {
+        if (uniq[j]->spectra[dim] == NULL) {
+            uniq[j]->spectra[dim] = gsl_vector_alloc(evs[j]->size);
+            gsl_vector_memcpy(uniq[j]->spectra[dim], evs[j]);
+        }
+    }
+    free(uniq);
+    *nuniq = nu;
+    return evs;
+}
+
+/*
+ *  Free the spectra of pin_spectra
+ */
+static void free_spectra(gsl_vector ** evs, Py_ssize_t n)
+{
+    for (Py_ssize_t j = 0; j < n; j++) {
+        gsl_vector_free(evs[j]);
+    }
+    free(evs);
+}
+
+/*
+ *  Batch divergences: for each pair (scgs1[i], scgs2[i]) compute the
+ *  KL (js = 0) or JS (js = 1) divergence in dimension dim for every beta.
+ *  Pairs are evaluated in an OpenMP parallel loop with the GIL released.
+ *  Returns a list (one per pair) of lists (one per beta).
+ */
+static PyObject * divergence_batch(PyObject * args, int js)
+{
+    int dim;
+    PyObject *scgs1_obj, *scgs2_obj, *betas_obj, *out;
+    pyslsa_SCGObject **scgs1, **scgs2;
+    gsl_vector **evs1, **evs2;
+    Py_ssize_t *idx1, *idx2;
+    Py_ssize_t n1 = 0, n2 = 0, nu1, nu2, nbetas;
+    double *betas, *divs;
+
+    if (!PyArg_ParseTuple(args, "OOiO", &scgs1_obj, &scgs2_obj,
+                          &dim, &betas_obj))
+        return NULL;
+    if ((dim < 0) || (dim >= MAXDIM - 1)) {
+        PyErr_Format(PyExc_ValueError, "Dimension %d out of range", dim);
+        return NULL;
+    }
+    if (!(betas = parse_betas(betas_obj, &nbetas)))
+        return NULL;
+    scgs1 = scg_array(scgs1_obj, &n1);
+    scgs2 = scgs1 ? scg_array(scgs2_obj, &n2) : NULL;
+    if (!scgs1 || !scgs2) {
+        free(betas);
+        scg_array_free(scgs1, n1);
+        return NULL;
+    }
+    if (n1 != n2) {
+        PyErr_SetString(PyExc_ValueError, "scgs1 and scgs2 differ in length");
+        free(betas);
+        scg_array_free(scgs1, n1);
+        scg_array_free(scgs2, n2);
+        return NULL;
+    }
+
+    idx1 = malloc((n1 + 1) * sizeof(Py_ssize_t));
+    idx2 = malloc((n2 + 1) * sizeof(Py_ssize_t));
+    evs1 = pin_spectra(scgs1, n1, dim, idx1, &nu1);
+    evs2 = pin_spectra(scgs2, n2, dim, idx2, &nu2);
+
+    divs = malloc((n1*nbetas + 1) * sizeof(double));
+    Py_BEGIN_ALLOW_THREADS
+    #pragma omp parallel
+    {
+        struct spectrum_workspace * ws = spectrum_workspace_alloc();
+        #pragma omp for schedule(dynamic)
+        for (Py_ssize_t i = 0; i < n1; i++) {
+            gsl_vector * ev1 = evs1[idx1[i]];
+            gsl_vector * ev2 = evs2[idx2[i]];
+            if (js) {
+                gsl_vector * evM = mean_laplacian_spectrum(scgs1[i], scgs2[i],
+                                                           dim, ws);
+                JS_divergence_spectra(ev1, ev2, evM, betas, nbetas,
+                                      divs + i*nbetas);
+                gsl_vector_free(evM);
+            } else {
+                KL_divergence_spectra(ev1, ev2, betas, nbetas,
+                                      divs + i*nbetas);
+            }
+        }
+        spectrum_workspace_free(ws);
+    }
+    Py_END_ALLOW_THREADS
+
+    out = PyList_New(n1);
+    for (Py_ssize_t i = 0; i < n1; i++) {
+        PyList_SET_ITEM(out, i, divergence_list(divs + i*nbetas, nbetas));
+    }
+    free_spectra(evs1, nu1);
+    free_spectra(evs2, nu2);
+    free(idx1);
+    free(idx2);
+    free(betas);
+    free(divs);
+    scg_array_free(scgs1, n1);
+    scg_array_free(scgs2, n2);
+    return out;
+}
+
+/*
+ *  KL divergences of many SCG pairs: KL_batch(scgs1, scgs2, dim, betas)
+ *  returns [KL_betas(scgs1[i], scgs2[i], dim, betas) for each i]
+ */
+static PyObject * KL_batch(PyObject * self, PyObject * args)
+{
+    return divergence_batch(args, 0);
+}
+
+/*
+ *  JS divergences of many SCG pairs: JS_batch(scgs1, scgs2, dim, betas)
+ *  returns [JS_betas(scgs1[i], scgs2[i], dim, betas) for each i]
+ */
+static PyObject * JS_batch(PyObject * self, PyObject * args)
+{
+    return divergence_batch(args, 1);
+}
+
+#endif
@@ -52,7 +52,7 @@ unsigned int num_ones(unsigned int N)
  */
 int check_bit(unsigned int N, unsigned int i)
 {
-    if ( N & (1 << i) ) {
+    if ( N & (1u << i) ) {
         return 1;
     } else {
         return 0;
@@ -63,9 +63,11 @@ struct Simplex *get_simplex_from_integer(unsigned int N)
 {
     /* Returns a pointer to a simplex struct
      * built from the integer N */
-    int dim = num_ones(N) - 1;
-    struct Simplex *out = malloc(sizeof(struct Simplex));
-    out->dim = dim;
+    struct Simplex *out = create_empty_simplex();
+    if (!out) {
+        return NULL;
+    }
+    out->dim = num_ones(N) - 1;
     return out;
 }
 
@@ -78,29 +80,30 @@ struct Simplex *get_simplex_from_integer(unsigned int N)
  */
 void get_faces_common(unsigned int N, int *verts, int dim, SCG * scg_temp)
 {
-   struct Simplex * s_new;
+   int face[MAXDIM];
+   int fdim;
 
    /* Loop through every possible face */
-   for (int k = 1; k <= N; k++) {
+   for (unsigned int k = 1; k <= N; k++) {
 
         /* (k & N) == k is true if the face k is in the simplex N */
         if ( (k & N) == k ) {
-            s_new = create_empty_simplex();
+            fdim = -1;
 
-            /* Loop through each possible vertex */
+            /* Loop through each possible vertex
+             * verts is sorted, so the face vertices are sorted */
             for ( int j = 0; j < dim+1; j++) {
 
                 /* Add the vertex if it is in the face */
                 if (check_bit(k, j)) {
-                    add_vertex(s_new, verts[j]);
+                    face[++fdim] = verts[j];
                 }
             }
 
             /* Add the face simplex to the scg
              * We do not check to see if it's already present, cause it's not
-             * This is probably bad..
              */
-            scg_add_simplex_nocheck(scg_temp, s_new);
+            scg_append(scg_temp, face, fdim);
        }
    } 
 }
@@ -108,32 +111,83 @@ void get_faces_common(unsigned int N, int *verts, int dim, SCG * scg_temp)
 unsigned int integer_from_simplex(struct Simplex * simp)
 {
     unsigned int N;
-    N = (1 << (simp->dim + 1)) - 1;
+    N = (1u << (simp->dim + 1)) - 1;
     return N;
 }
 
 /*
  *  Construct a Simplicial Complex (SCG) containing all the faces of a simplex 
+ *  The faces are the bit patterns of an unsigned int, so simplices with
+ *  more vertices than bits are expanded by combinations instead
  */
 SCG * get_faces(struct Simplex * simp)
 {
-    SCG * out = get_empty_SCG();
-    int N;
+    SCG * out;
+    unsigned int N;
 
+    if (simp->dim + 1 >= (int)(8*sizeof(unsigned int))) {
+        return get_faces_capped(simp, simp->dim);
+    }
+    out = get_empty_SCG();
     N = integer_from_simplex(simp);
     get_faces_common(N, simp->vertices, simp->dim, out);
     return out;
 }
 
+/*
+ *  Construct a Simplicial Complex (SCG) containing the faces of a simplex 
+ *  up to dimension max_dim.  Faces of each dimension are enumerated as
+ *  combinations of the vertices, so faces above max_dim are never built.
+ *  The vertices of simp must be sorted.
+ */
+SCG * get_faces_capped(struct Simplex * simp, int max_dim)
+{
+    SCG * out = get_empty_SCG();
+    int comb[MAXDIM];
+    int nverts = simp->dim + 1;
+    int top = simp->dim < max_dim ? simp->dim : max_dim;
+    int face[MAXDIM];
+
+    for (int d = 0; d <= top; d++) {
+        int k = d + 1;
+
+        /* first combination: 0, 1, ..., k-1 */
+        for (int i = 0; i < k; i++) {
+            comb[i] = i;
+        }
+        while (1) {
+            for (int i = 0; i < k; i++) {
+                face[i] = simp->vertices[comb[i]];
+            }
+            scg_append(out, face, d);
+
+            /* advance to the next combination in lexicographic order */
+            int i = k - 1;
+            while (i >= 0 && comb[i] == nverts - k + i) {
+                i--;
+            }
+            if (i < 0) break;
+            comb[i]++;
+            for (int j = i + 1; j < k; j++) {
+                comb[j] = comb[j-1] + 1;
+            }
+        }
+    }
+    return out;
+}
+
 /* 
- *  Messed up method to compare integers for sorting
+ *  Compare integers for sorting
  *  0 if a = b
  *  > 0 if a > b
  *  < 0 if a < b
+ *  (the difference a - b overflows for labels of opposite sign)
  */
 int int_cmp(const void * a, const void * b)
 {
-    return ( *(int*)a - *(int*)b );
+    int x = *(const int *)a;
+    int y = *(const int *)b;
+    return (x > y) - (x < y);
 }
 
 /*
@@ -175,7 +229,7 @@ struct Simplex * create_empty_simplex()
  */
 void add_vertex(struct Simplex * s, int v)
 {
-    if (s->dim == MAXDIM) return;
+    if (s->dim >= MAXDIM - 1) return;
     s->dim++;
     s->vertices[s->dim] = v;
     qsort(s->vertices, s->dim+1, sizeof(int), int_cmp);
@@ -186,8 +240,11 @@ void add_vertex(struct Simplex * s, int v)
  */
 struct Simplex * create_simplex(unsigned int *vertices, int dim)
 {
-    struct Simplex * s_out = malloc(sizeof(struct Simplex));
-    memcpy(s_out->vertices, vertices, MAXDIM*sizeof(unsigned int));
+    struct Simplex * s_out = create_empty_simplex();
+    if (!s_out) {
+        return NULL;
+    }
+    memcpy(s_out->vertices, vertices, (dim+1)*sizeof(unsigned int));
     s_out->dim = dim;
     return s_out;
 }
@@ -195,6 +252,9 @@ struct Simplex * create_simplex(unsigned int *vertices, int dim)
 /*
  *  Determine if two simplices are identical
  *  Returns 1 if they are identical, 0 if not
+ *  Vertices are always kept sorted (see add_vertex), so the simplices
+ *  are compared without sorting them.  This keeps simplex_equals read
+ *  only, so SCGs can be shared between threads.
  */
 int simplex_equals(struct Simplex * s1, struct Simplex * s2)
 {
@@ -207,18 +267,21 @@ int simplex_equals(struct Simplex * s1, struct Simplex * s2)
     if (s1->dim != s2->dim) {
         return 0;
     }
-    
-    /* Sort the vertices */
-    qsort(s1->vertices, s1->dim+1, sizeof(int), int_cmp);
-    qsort(s2->vertices, s2->dim+1, sizeof(int), int_cmp);
 
-    /* Check if arrays are equal */
-    for (int i = 0; i <= s1->dim; i++) {
-        if (s1->vertices[i] != s2->vertices[i]) {
+    return vertices_equal(s1->vertices, s2->vertices, s1->dim);
+}
+
+/*
+ *  Compare the sorted vertex arrays of two simplices of dimension dim
+ *  Returns 1 if they are identical, 0 if not
+ */
+int vertices_equal(const int * v1, const int * v2, int dim)
+{
+    for (int i = 0; i <= dim; i++) {
+        if (v1[i] != v2[i]) {
             return 0;
         }
     }
-    /* if we make it here, they are the same */
     return 1;
 }
 
@@ -232,22 +295,15 @@ int simplex_equals(struct Simplex * s1, struct Simplex * s2)
 void scg_list_union(SCG * scg1, SCG * scg2)
 {
     /*  form the union of scg lists */
-    /*  The output is in list2 */
+    /*  The output is in scg2 */
     int dim;
     for ( dim = 0; dim < MAXDIM; dim++) {
-        struct simplex_list * list1d = scg1->x[dim];
-        struct simplex_list * list2d = scg2->x[dim];
-
-        /*  Check and see if there is a null list */
-        if ((list1d->s == NULL) && (list2d->s) == NULL) continue;
-
-        struct simplex_list * l1 = list1d;
-        struct simplex_list * l2 = list2d;
-
-        /* Add each simplex from l1 to l2 */
-        while (l1 != NULL) {
-            add_simplex(l2, l1->s);
-            l1 = l1->next;
+        /* Add each simplex from scg1 to scg2, in basis order */
+        for (int k = 0; k < scg1->cg_dim[dim]; k++) {
+            int * v = SCG_BASIS_SIMPLEX(scg1, dim, k);
+            if (scg_find_simplex(scg2, v, dim) < 0) {
+                scg_append(scg2, v, dim);
+            }
         }
     }
 }
@@ -257,279 +313,186 @@ void scg_list_union(SCG * scg1, SCG * scg2)
  *  This means for each dimension, compute the union of the sets of generators
  *  This amounts to stitching the complexes together along common simplices
  *  This function uses the hash tables for faster unions.
- *  The result is stored in scg2
- *  scg1 is destroyed in the process
+ *  The result is stored in scg2, scg1 is not modified.
+ *  table may be reused across calls with the same scg2.
+ *  If table is NULL, a temporary table is used.
  */
 void scg_list_union_hash(SCG * scg1, SCG * scg2,
-                         struct simplex_hash_table *table2)
+                         struct simplex_hash_table *table)
 {
     int dim;
-    struct simplex_hash_table * table;
-    for (dim = 0; dim < MAXDIM; dim++) {
-        struct simplex_list * list1d = scg1->x[dim];
-        struct simplex_list * list2d = scg2->x[dim];
-
-        /*  Check and see if there is a null list */
-        if ((list1d->s == NULL) && (list2d->s) == NULL) continue;
-
-        struct simplex_list * l1 = list1d;
-        struct simplex_list * l2 = list2d;
-        
-        //table = get_empty_hash_table_D();
-        table = table2;
-        
-        /* add list1 to temp list */
-        while (l2 != NULL) {
-            if (l2->s) {
-                check_hash_D(table, l2->s);
-            }
-            l2 = l2->next;
-        }
-       
-        /* add list2 to temp list, checking hash table */ 
-        while (l1 != NULL) {
-            int present = check_hash_D(table, l1->s);
-            if (l1->s && !present) {
-                add_simplex_nocheck(list2d, l1->s);
-                scg2->cg_dim[dim]++; /* Increment Chain Group Dimension */
-            }
-            if (present) {
-                /* simplex is already present, remove from l1 */
-                free_simplex(l1->s);
-            }
-            l1 = l1->next;
-            /* taking a guess */
-        }
-        //free_hash_table_D(table);
+    struct simplex_hash_table * tmp_table = NULL;
+
+    if (!table) {
+        tmp_table = get_hash_table_D(scg_nsimplices(scg1) +
+                                     scg_nsimplices(scg2));
+        table = tmp_table;
     }
-}
 
-/*
- *  Create an empty simplex list.  
- *  A simplex list is a double-linked-list of simplexes
- */
-struct simplex_list * get_empty_simplex_list() 
-{
-    /*  returns an empty simplex list */
-    struct simplex_list *out = malloc(sizeof(struct simplex_list));
-    out->s = NULL;
-    out->prev = NULL;
-    out->next = NULL;
-    return out;
-}
+    /* add scg2 to the table */
+    hash_table_sync_D(table, scg2);
 
-/* 
- *  Destroy a simplex list
- *  Destroys every simplex in the list and then destroys the list
- */
-void simplex_list_free(struct simplex_list * sl)
-{
-    /* TODO: Check for beginning of list */
-    while (sl->prev != NULL) {
-        sl = sl->prev;
-    }
-#ifdef DEBUG_MEM
-    printf("freeing simplexlist: %d\n", sl);
-#endif
-    struct simplex_list * nx = sl->next;
-    if (!nx) {
-        free_simplex(sl->s);
-        free(sl);
-        return;
+    /* add scg1 to scg2 in basis order, checking hash table */
+    for (dim = 0; dim < MAXDIM; dim++) {
+        for (int k = 0; k < scg1->cg_dim[dim]; k++) {
+            check_hash_D(table, scg2, SCG_BASIS_SIMPLEX(scg1, dim, k), dim);
+        }
     }
-    while(nx) {
-        free_simplex(sl->s);   
-        free(sl);
-        sl = nx;
-        nx = sl->next;
+
+    if (tmp_table) {
+        free_hash_table_D(tmp_table);
     }
-    free_simplex(sl->s);
-    free(sl);
 }
 
-/* 
- *  Destroy a simplex list without destroying the simplices
+/*
+ *  Compute the union of n SCGs.
+ *  The result is stored in scg_out, the scgs are not modified.
+ *  The simplices are added in row order, so the union of a single SCG
+ *  into an empty one is a copy with the same basis.
+ *  Every simplex is hashed once, so the union is linear in the total
+ *  number of simplices.  If table is NULL, a temporary table is used.
  */
-void simplex_list_free_lite(struct simplex_list * sl)
+void scg_union_many(SCG ** scgs, int n, SCG * scg_out,
+                    struct simplex_hash_table *table)
 {
-    /*  Frees a simplex list without freeing simplices */
-    while (sl->prev != NULL) {
-        sl = sl->prev;
+    struct simplex_hash_table * tmp_table = NULL;
+    size_t nmax = 0;
+
+    /* Size the table for the largest complex, it grows as needed */
+    for (int i = 0; i < n; i++) {
+        size_t ns = scg_nsimplices(scgs[i]);
+        nmax = ns > nmax ? ns : nmax;
     }
-#ifdef DEBUG_MEM
-    printf("freeing simplexlist lite: %d\n", sl);
-#endif
-    struct simplex_list *nx = sl->next;
-    if (!nx) {
-        free(sl);
-        return;
+    if (!table) {
+        tmp_table = get_hash_table_D(nmax + scg_nsimplices(scg_out));
+        table = tmp_table;
     }
-    while(nx) {
-        free(sl);
-        sl = nx;
-        nx = sl->next;
+    hash_table_sync_D(table, scg_out);
+    hash_table_reserve_D(table, nmax + table->N);
+
+    for (int i = 0; i < n; i++) {
+        for (int dim = 0; dim < MAXDIM; dim++) {
+            for (int k = 0; k < scgs[i]->cg_dim[dim]; k++) {
+                check_hash_D(table, scg_out, SCG_SIMPLEX(scgs[i], dim, k),
+                             dim);
+            }
+        }
     }
-    free(sl);
-}
 
-/*
- *  Checks if a simplex is already in a simplex list
- *  If so, it returns a pointer to the list entry 
- */
-struct simplex_list * simplex_list_isin(struct simplex_list *slist,
-                                        struct Simplex *s)
-{
-    struct simplex_list * retcode = NULL;
-    while ( slist != NULL ) {
-        if (simplex_equals(slist->s, s)) {
-            retcode = slist;
-            return retcode;
-        }
-        slist = slist->next;
+    if (tmp_table) {
+        free_hash_table_D(tmp_table);
     }
-    return retcode;
 }
 
 /*
- *  Removes a simplex from a simplex list 
+ *  Return pointer to an empty simplicial complex (SCG)
  */
-struct simplex_list * remove_simplex(struct simplex_list *slist,
-                                     struct Simplex *s)
-{
-    struct simplex_list *entry = simplex_list_isin(slist, s);
-    struct simplex_list *ret = slist;
-    if (entry != NULL) {
-        if (entry->prev != NULL) {
-            /* Entry is not first in list */
-            entry->prev->next = entry->next;
-        }
-        if (entry->next != NULL) {
-            /* Entry is not last in list */
-            entry->next->prev = entry->prev;
-        }
-        if (entry->prev == NULL) {
-            /* Entry is first in list */
-            ret = entry->next;
-        }
-    }
-    return ret;
+SCG * get_empty_SCG()
+{
+    /* Chain groups are allocated on the first scg_append */
+    SCG * out = calloc(1, sizeof(SCG));
+    return out;
 }
 
 /*
- *  Adds a simplex to a simplex list without checking whether
- *  the simplex is already in the list 
+ *  Destroy a simplicial complex, destroying all simplices within
  */
-void add_simplex_nocheck(struct simplex_list *slist, struct Simplex *s)
+void free_SCG(SCG * scg)
 {
-    if (!slist->s) {
-            slist->s = s;
-            return;
-    }
-
-    /* Add to second spot in list */
-    if (slist != NULL) {
-        struct simplex_list *s_new = get_empty_simplex_list();
-        struct simplex_list *eltwo = slist->next;
-
-#ifdef DEBUG_MEM
-        printf("add_simplex_nocheck: s_new = %d\n", s_new);
-        print_simplex(s);
-#endif
-        s_new->s = s;
-        slist->next = s_new;
-        s_new->prev = slist;
-        s_new->next = eltwo;
-        if (eltwo) {
-            eltwo->prev = s_new;
-        }
+    if (!scg) return;
+    for (int dim = 0; dim < MAXDIM; dim++) {
+        free(scg->x[dim]);
     }
-    return;
+    free(scg);
 }
 
-
 /*
- *  Add a simplex to a simplex list if the simplex is not already present
- *  in the list 
+ *  Total number of simplices in the simplicial complex
  */
-void add_simplex(struct simplex_list *slist, struct Simplex *s)
+size_t scg_nsimplices(SCG * scg)
 {
-    if (slist->s == NULL) {
-        /* Empty list */
-        slist->s = s;
-        return;
-    }
-
-    if (!simplex_list_isin(slist, s)) {
-        struct simplex_list *new = get_empty_simplex_list();
-        new->s = s;
-        /* Advance to end of list */
-        while (slist->next != NULL) {
-            slist = slist->next;
-        }
-        /* Add new simplex */
-        slist->next = new;
-        new->prev = slist;
+    size_t n = 0;
+    for (int dim = 0; dim < MAXDIM; dim++) {
+        n += scg->cg_dim[dim];
     }
+    return n;
 }
 
 /*
- *  Return pointer to an empty simplicial complex (SCG)
+ *  Number of bytes used by the simplicial complex
  */
-SCG * get_empty_SCG() 
+size_t scg_nbytes(SCG * scg)
 {
-    SCG * out = calloc(1, sizeof(SCG));
-    for (int dim = 0; dim < MAXDIM; dim++)
-    {
-        out->x[dim] = get_empty_simplex_list();
-        out->cg_dim[dim] = 0;
+    size_t n = sizeof(SCG);
+    for (int dim = 0; dim < MAXDIM; dim++) {
+        n += (size_t)scg->cap[dim] * (dim + 1) * sizeof(int);
     }
-    return out;
+    return n;
 }
 
 /*
- *  Destroy a simplicial complex, destroying all simplices within
+ *  Append the simplex with sorted vertices to chain group dim
+ *  without checking if it's already present.
+ *  Returns the index of the new simplex in the chain group.
  */
-void free_SCG(SCG * scg)
+int scg_append(SCG * scg, const int * vertices, int dim)
 {
-    for (int dim = 0; dim < MAXDIM; dim++) {
-        simplex_list_free(scg->x[dim]);
+    int k = scg->cg_dim[dim];
+
+    if (k == scg->cap[dim]) {
+        /* Grow the chain group geometrically */
+        int cap = scg->cap[dim] ? 2*scg->cap[dim] : 16;
+        int * x = realloc(scg->x[dim], (size_t)cap * (dim + 1) * sizeof(int));
+        if (!x) {
+            printf("Unable to grow chain group %d\n", dim);
+            return -1;
+        }
+        scg->x[dim] = x;
+        scg->cap[dim] = cap;
     }
-    free(scg);
+    memcpy(SCG_SIMPLEX(scg, dim, k), vertices, (dim + 1) * sizeof(int));
+    scg->cg_dim[dim]++; /* Increment Chain Group Dimension */
+    return k;
 }
 
 /*
- *  Destroy a simplicial complex without destroying the simplices within
+ *  Index of the simplex with sorted vertices in chain group dim,
+ *  -1 if it is not in the simplicial complex.  Linear search.
  */
-void free_SCG_lite(SCG * scg)
+int scg_find_simplex(SCG * scg, const int * vertices, int dim)
 {
-    /* frees the SCG without freeing the simplices */
-    for (int dim =0; dim < MAXDIM; dim++) {
-        simplex_list_free_lite(scg->x[dim]);
+    if ((dim < 0) || (dim >= MAXDIM)) return -1;
+
+    for (int k = 0; k < scg->cg_dim[dim]; k++) {
+        if (vertices_equal(SCG_SIMPLEX(scg, dim, k), vertices, dim)) {
+            return k;
+        }
     }
-    free(scg);
+    return -1;
 }
 
-/* 
- *  Add a simplex to a simplicial complex 
+/*
+ *  Add a simplex to a simplicial complex if it's not already present
+ *  The vertices are copied: s still belongs to the caller
  */
 void scg_add_simplex(SCG * scg, struct Simplex * s)
 {
     int d = s->dim;
-    if (d >= 0) {
-        add_simplex(scg->x[d], s);
+    if ((d >= 0) && (scg_find_simplex(scg, s->vertices, d) < 0)) {
+        scg_append(scg, s->vertices, d);
     }
 }
 
 /*
  *  Add a simplex to a simplicial complex without checking if it's
- *  already present 
+ *  already present
+ *  The vertices are copied: s still belongs to the caller
  */
 void scg_add_simplex_nocheck(SCG * scg, struct Simplex * s)
 {
     int d = s->dim;
     if (d >= 0) {
-        add_simplex_nocheck(scg->x[d], s);
-        scg->cg_dim[d]++;
+        scg_append(scg, s->vertices, d);
     }
 }
 
@@ -551,30 +514,23 @@ void print_simplex(struct Simplex * s)
     printf("\n");
 }
 
-void print_simplex_list(struct simplex_list *sl)
-{
-    if (sl->s == NULL) return;
-
-    printf("SIMPLEX LIST\n");
-    printf("------------\n");
-
-    while (sl != NULL)
-    {
-        print_simplex(sl->s);
-        sl = sl->next;
-    }
-    printf("\n");
-}
-
 void print_SCG(SCG * scg)
 {
     printf("SCG\n");
     printf("---\n");
     for (int i = 0; i < MAXDIM; i++) {
-        if (scg->x[i]->s != NULL) {
-            printf("Dimension %d\n", i);
-            print_simplex_list(scg->x[i]);
+        if (scg->cg_dim[i] == 0) continue;
+
+        printf("Dimension %d\n", i);
+        for (int k = 0; k < scg->cg_dim[i]; k++) {
+            int * v = SCG_BASIS_SIMPLEX(scg, i, k);
+            printf("SIMPLEX | D = %d | Vertices: ", i);
+            for (int j = 0; j <= i; j++) {
+                printf("%d, ", v[j]);
+            }
+            printf("\n");
         }
+        printf("\n");
     }
     printf("\n");
 }
@@ -585,6 +541,18 @@ void print_SCG(SCG * scg)
 void compute_chain_groups(struct Simplex ** max_simps,
                           int n_max_simps, SCG * scg_out)
 {
+    compute_chain_groups_capped(max_simps, n_max_simps, -1, scg_out);
+}
+
+/* Compute the chain group generators for the complex
+ * defined by the max_simps, up to dimension max_dim.
+ * A negative max_dim computes all dimensions.
+ * A Laplacian in dimension d only needs generators up to d+1.
+ */
+void compute_chain_groups_capped(struct Simplex ** max_simps,
+                                 int n_max_simps, int max_dim,
+                                 SCG * scg_out)
+{
 
     /* Find the maximum dimension */
     int maxdim = 0;
@@ -593,12 +561,17 @@ void compute_chain_groups(struct Simplex ** max_simps,
     }
 
     /* for each max simp, get the faces and add to the scg */
-    struct simplex_hash_table *table = get_empty_hash_table_D();
+    struct simplex_hash_table *table = get_hash_table_D(n_max_simps);
     for (int i=0; i<n_max_simps; i++) {
-        SCG * faces = get_faces(max_simps[i]);
+        SCG * faces;
+        if (max_dim < 0) {
+            faces = get_faces(max_simps[i]);
+        } else {
+            faces = get_faces_capped(max_simps[i], max_dim);
+        }
         /* take the union of face lists */
         scg_list_union_hash(faces, scg_out, table); 
-        free_SCG_lite(faces);
+        free_SCG(faces);
     }
     free_hash_table_D(table);
 }
@@ -607,4 +580,97 @@ void scg_add_max_simplex(SCG * scg, struct Simplex * max_s)
 {
     SCG * faces = get_faces(max_s);
     scg_list_union_hash(faces, scg, NULL);
+    free_SCG(faces);
+}
+
+/* ************************************************************************* */
+/* SCG Serialization                                                         */
+/* ************************************************************************* */
+
+/*
+ *  Number of dimensions holding simplices (top dimension + 1)
+ */
+static int scg_ndims(SCG * scg)
+{
+    int ndims = 0;
+    for (int d = 0; d < MAXDIM; d++) {
+        if (scg->cg_dim[d] > 0) ndims = d + 1;
+    }
+    return ndims;
+}
+
+/*
+ *  Number of int32 words in the serialized form of scg:
+ *  [SCG_SERIAL_MAGIC, ndims, then for each dimension d < ndims
+ *   the number of simplices n_d followed by their n_d*(d+1) vertices]
+ */
+size_t scg_serialized_size(SCG * scg)
+{
+    int ndims = scg_ndims(scg);
+    size_t size = 2;
+    for (int d = 0; d < ndims; d++) {
+        size += 1 + (size_t)scg->cg_dim[d] * (d + 1);
+    }
+    return size;
+}
+
+/*
+ *  Write the serialized form of scg into buf, which must hold
+ *  scg_serialized_size(scg) words.  Simplices are written in row order,
+ *  so scg_deserialize restores the same basis.
+ */
+void scg_serialize(SCG * scg, int32_t * buf)
+{
+    int ndims = scg_ndims(scg);
+    size_t n;
+
+    *buf++ = SCG_SERIAL_MAGIC;
+    *buf++ = ndims;
+    for (int d = 0; d < ndims; d++) {
+        *buf++ = scg->cg_dim[d];
+        n = (size_t)scg->cg_dim[d] * (d + 1);
+        for (size_t i = 0; i < n; i++) {
+            *buf++ = scg->x[d][i];
+        }
+    }
+}
+
+/*
+ *  Rebuild an SCG from its serialized form (n words).
+ *  The chain groups keep the serialized order.
+ *  Returns NULL if buf is not a valid serialized SCG.
+ */
+SCG * scg_deserialize(const int32_t * buf, size_t n)
+{
+    size_t pos = 2;
+    int ndims;
+
+    if ((n < 2) || (buf[0] != SCG_SERIAL_MAGIC)) return NULL;
+    ndims = buf[1];
+    if ((ndims < 0) || (ndims >= MAXDIM)) return NULL;
+
+    SCG * scg = get_empty_SCG();
+    for (int d = 0; d < ndims; d++) {
+        int32_t n_d;
+
+        if (pos >= n) goto fail;
+        n_d = buf[pos++];
+        if ((n_d < 0) || ((size_t)n_d * (d + 1) > n - pos)) goto fail;
+
+        for (int32_t j = 0; j < n_d; j++) {
+            const int32_t * v = buf + pos;
+            for (int i = 1; i <= d; i++) {
+                /* vertices must be sorted */
+                if (v[i] <= v[i-1]) goto fail;
+            }
+            scg_append(scg, v, d);
+            pos += d + 1;
+        }
+    }
+    if (pos != n) goto fail;
+    return scg;
+
+fail:
+    free_SCG(scg);
+    return NULL;
 }
@@ -23,37 +23,59 @@
 #include <Python.h>
 #endif
 
-#include "hash_table.h"
+#include <stddef.h>
+#include <stdint.h>
 
 #define MAXNAME 128
 #define MAXMS 12
 #define MAXDIM 40 
+#define SCG_SERIAL_MAGIC 0x31474353 /* "SCG1" */
+
+#include "hash_table.h"
 
 struct Simplex {
     int vertices[MAXDIM];
     int dim;
 };
 
-struct simplex_list {
-    struct Simplex * s;
-    struct simplex_list * next;
-    struct simplex_list * prev;
-};
-
-/* Array of simplex lists forms simplicial complex generators */
+/* Simplicial complex generators
+ * The simplices of dimension d are stored contiguously in x[d]:
+ * simplex k has the sorted vertices x[d][k*(d+1)] ... x[d][k*(d+1) + d] */
 typedef struct SCG {
-    struct simplex_list *x[MAXDIM];
+    int *x[MAXDIM];
     int cg_dim[MAXDIM]; /* Dimensions of the chain groups */
+    int cap[MAXDIM];    /* Number of simplices allocated in x[dim] */
 }SCG;
 
+/* Vertices of simplex k in dimension dim */
+#define SCG_SIMPLEX(scg, dim, k) ((scg)->x[(dim)] + (size_t)(k)*((dim)+1))
+
+/* Row of basis element i of chain group dim.
+ * Chain groups are stored in the order the simplices were added, and their
+ * basis keeps the order of the linked list chain groups this storage
+ * replaced, where each new simplex went in second place: the first simplex,
+ * then the others newest first.  Boundary operators and Laplacians are built
+ * in this basis, so divergences that pair the bases of two complexes by
+ * index (JS) are unchanged.  The map is its own inverse: it also takes a
+ * row to its basis index. */
+#define SCG_BASIS_ROW(scg, dim, i) ((i) ? (scg)->cg_dim[(dim)] - (i) : 0)
+
+/* Vertices of basis element i in dimension dim */
+#define SCG_BASIS_SIMPLEX(scg, dim, i) \
+    SCG_SIMPLEX((scg), (dim), SCG_BASIS_ROW((scg), (dim), (i)))
+
 unsigned int num_ones(unsigned int N);
 int check_bit(unsigned int N, unsigned int i);
 unsigned int integer_from_simplex(struct Simplex * simp);
 void get_faces_common(unsigned int N, int *verts, int dim, SCG * scg_temp);
 SCG * get_faces(struct Simplex * simp);
+SCG * get_faces_capped(struct Simplex * simp, int max_dim);
 int int_cmp(const void * a, const void * b);
 void compute_chain_groups(struct Simplex ** max_simps,
                           int n_max_simps, SCG * scg_out);
+void compute_chain_groups_capped(struct Simplex ** max_simps,
+                                 int n_max_simps, int max_dim,
+                                 SCG * scg_out);
 
 /* Simplex Functions */
 struct Simplex * create_simplex(unsigned int *vertices, int dim);
@@ -63,30 +85,32 @@ struct Simplex *get_simplex_from_integer(unsigned int N);
 struct Simplex * create_empty_simplex(void);
 void add_vertex(struct Simplex * s, int v);
 
-/* Simplex List functions */
-void simplex_list_free(struct simplex_list * sl);
-struct simplex_list * get_empty_simplex_list(void);
-void add_simplex(struct simplex_list *slist, struct Simplex *s);
-void add_simplex_nocheck(struct simplex_list *slist, struct Simplex *s);
-struct simplex_list * remove_simplex(struct simplex_list *slist,
-                                     struct Simplex *s);
-struct simplex_list * simplex_list_isin(struct simplex_list *slist,
-                                        struct Simplex *);
+int vertices_equal(const int * v1, const int * v2, int dim);
 
 /* SCG functions */
 SCG * get_empty_SCG(void); 
 void free_SCG(SCG * scg);
+size_t scg_nsimplices(SCG * scg);
+size_t scg_nbytes(SCG * scg);
+int scg_append(SCG * scg, const int * vertices, int dim);
+int scg_find_simplex(SCG * scg, const int * vertices, int dim);
 void scg_list_union(SCG * scg1, SCG * scg2);
 void scg_list_union_hash(SCG * scg1, SCG * scg2,
                          struct simplex_hash_table *table);
+void scg_union_many(SCG ** scgs, int n, SCG * scg_out,
+                    struct simplex_hash_table *table);
 void scg_add_simplex(SCG * scg, struct Simplex * s);
 void scg_add_simplex_nocheck(SCG * scg, struct Simplex * s);
 
 void scg_add_max_simplex(SCG * scg, struct Simplex * max_s);
 
+/* SCG serialization: flat int32 vertex arrays per dimension */
+size_t scg_serialized_size(SCG * scg);
+void scg_serialize(SCG * scg, int32_t * buf);
+SCG * scg_deserialize(const int32_t * buf, size_t n);
+
 /* print functions */
 void print_simplex(struct Simplex * s);
-void print_simplex_list(struct simplex_list *sl);
 void print_SCG(SCG * scg);
 
 extern int ncollisions; 
@@ -18,13 +18,22 @@
 
 #include <math.h>
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 
 #include <gsl/gsl_math.h>
 #include <gsl/gsl_vector.h>
 #include <gsl/gsl_matrix.h>
 #include <gsl/gsl_sort.h>
 #include <gsl/gsl_sort_vector.h>
-#include <gsl/gsl_eigen.h>
+
+#include "slse.h"
+
+/* LAPACK: eigenvalues of a real symmetric matrix, divide and conquer */
+extern void dsyevd_(const char * jobz, const char * uplo, const int * n,
+                    double * a, const int * lda, double * w, double * work,
+                    const int * lwork, int * iwork, const int * liwork,
+                    int * info);
 
 int check_square_matrix(gsl_matrix * a)
 {
@@ -42,17 +51,12 @@ int check_square_matrix(gsl_matrix * a)
 
 
 /* Computes the KL divergence between two density matrices.
- * Computes eigenvalues independently, sorts them, then 
- * computes divergence */
-double __attribute__((optimize("O0"))) KL_divergence(gsl_matrix * L1, 
-                                                     gsl_matrix * L2,
-                                                     double beta)
+ * Computes the spectrum of each Laplacian once, then the divergence
+ * from the spectra (see KL_divergence_spectra) */
+double KL_divergence(gsl_matrix * L1, gsl_matrix * L2, double beta)
 {
     double div = 0.0;
-    double rval, sval;
-
-    int i;
-    size_t n;
+    int n;
 
     /* Check if they are square matrices and report size */
     if ((n = check_square_matrix(L1)) < 0) {
@@ -63,56 +67,230 @@ double __attribute__((optimize("O0"))) KL_divergence(gsl_matrix * L1,
         return 0;
     }
 
-    gsl_vector * L1v = gsl_vector_alloc(n);
-    gsl_vector * L2v = gsl_vector_alloc(n);
-
-    gsl_vector * rhov = gsl_vector_alloc(n);
-    gsl_vector * sigmav = gsl_vector_alloc(n);
-
-    /* Allocate workspace for eigendecomposition */
-    gsl_eigen_symm_workspace * w =  gsl_eigen_symm_alloc(n);
-
-    /* Copy the matrices */
-    /* We need this because GSL destroys matrices 
-     * during eigenvalue computation */
-    gsl_matrix * L1copy = gsl_matrix_alloc(n, n);
-    gsl_matrix * L2copy = gsl_matrix_alloc(n, n);
-    gsl_matrix_memcpy(L1copy, L1);
-    gsl_matrix_memcpy(L2copy, L2);
-
-    /* Compute eigenvalues */ 
-    gsl_eigen_symm(L1copy, L1v, w);
-    gsl_eigen_symm(L2copy, L2v, w); 
-    gsl_eigen_symm_free(w);
-
-    /* Compute density eigenvalues */
-    double r1, r2;
-    double tr1=0, tr2=0;
-    for (i = 0; i<n; i++) {
-        r1 = exp(beta*gsl_vector_get(L1v, i));
-        r2 = exp(beta*gsl_vector_get(L2v, i));
-        gsl_vector_set(rhov, i, r1);
-        gsl_vector_set(sigmav, i, r2);
-        tr1 += r1; 
-        tr2 += r2;
-    }
+    struct spectrum_workspace * ws = spectrum_workspace_alloc();
+    gsl_vector * L1v = laplacian_spectrum_ws(L1, ws);
+    gsl_vector * L2v = laplacian_spectrum_ws(L2, ws);
+    spectrum_workspace_free(ws);
+
+    KL_divergence_spectra(L1v, L2v, &beta, 1, &div);
+    gsl_vector_free(L1v);
+    gsl_vector_free(L2v);       
+    return div;
+}
 
-    /* Sort eigenvalues */
-    gsl_sort_vector(rhov);
-    gsl_sort_vector(sigmav);
+/* Computes the JS divergence between the density matrices of two
+ * Laplacians of the same size.  The spectra of L1, L2 and of their
+ * mean M = (L1 + L2)/2 are each computed once */
+double JS_divergence(gsl_matrix * L1, gsl_matrix * L2, double beta)
+{
+    double div = 0.0;
+    int n;
 
-    /* Compute divergence */
-    for (i = 0; i < n; i++) {
-        rval = gsl_vector_get(rhov, i) / tr1;
-        sval = gsl_vector_get(sigmav, i) / tr2;
-        div += rval*(log(rval) - log(sval))/log(2.0);
+    if ((n = check_square_matrix(L1)) < 0) {
+        printf("Rho matrix not Square!! \n");
+        return 0;
+    } else if ( check_square_matrix(L2) != n) {
+        printf("Rho and Sigma dimensions do not match! \n");
+        return 0;
     }
-    /* Free Memory */
-    gsl_matrix_free(L1copy);
-    gsl_matrix_free(L2copy);
-    gsl_vector_free(rhov);
-    gsl_vector_free(sigmav);
+
+    gsl_matrix * M = gsl_matrix_alloc(n, n);
+    gsl_matrix_memcpy(M, L1);
+    gsl_matrix_add(M, L2);
+    gsl_matrix_scale(M, 0.5);
+
+    struct spectrum_workspace * ws = spectrum_workspace_alloc();
+    gsl_vector * L1v = laplacian_spectrum_ws(L1, ws);
+    gsl_vector * L2v = laplacian_spectrum_ws(L2, ws);
+    gsl_vector * Mv = laplacian_spectrum_ws(M, ws);
+    spectrum_workspace_free(ws);
+
+    JS_divergence_spectra(L1v, L2v, Mv, &beta, 1, &div);
+    gsl_matrix_free(M);
     gsl_vector_free(L1v);
-    gsl_vector_free(L2v);       
+    gsl_vector_free(L2v);
+    gsl_vector_free(Mv);
     return div;
 }
+
+/* Workspace for laplacian_spectrum_ws: a copy of the matrix, which
+ * dsyevd destroys, and the LAPACK work arrays.  The buffers grow to
+ * the largest matrix seen, so one workspace can be reused for many
+ * spectra.  Not thread safe: use one workspace per thread */
+struct spectrum_workspace * spectrum_workspace_alloc(void)
+{
+    return calloc(1, sizeof(struct spectrum_workspace));
+}
+
+void spectrum_workspace_free(struct spectrum_workspace * ws)
+{
+    if (!ws) return;
+    free(ws->a);
+    free(ws->work);
+    free(ws->iwork);
+    free(ws);
+}
+
+/* Grow the workspace buffers to fit an n x n matrix */
+static int spectrum_workspace_reserve(struct spectrum_workspace * ws, int n)
+{
+    double work_query;
+    int iwork_query;
+    int info;
+    int lwork = -1;
+    int liwork = -1;
+
+    if (n <= ws->n) return 0;
+
+    /* Optimal work array sizes */
+    dsyevd_("N", "L", &n, NULL, &n, NULL, &work_query, &lwork,
+            &iwork_query, &liwork, &info);
+    if (info != 0) {
+        printf("dsyevd workspace query failed: info = %d\n", info);
+        return info;
+    }
+    lwork = (int)work_query;
+    liwork = iwork_query;
+
+    free(ws->a);
+    free(ws->work);
+    free(ws->iwork);
+    ws->a = malloc((size_t)n * n * sizeof(double));
+    ws->work = malloc(lwork * sizeof(double));
+    ws->iwork = malloc(liwork * sizeof(int));
+    if (!ws->a || !ws->work || !ws->iwork) {
+        printf("Unable to allocate spectrum workspace\n");
+        ws->n = 0;
+        return -1;
+    }
+    ws->lwork = lwork;
+    ws->liwork = liwork;
+    ws->n = n;
+    return 0;
+}
+
+/* Computes the eigenvalues of a Laplacian matrix, sorted in
+ * ascending order, with the LAPACK divide and conquer solver dsyevd
+ * (eigenvalues only).  L is not modified.  Pass ws = NULL for a
+ * workspace allocated for this call only */
+gsl_vector * laplacian_spectrum_ws(gsl_matrix * L,
+                                   struct spectrum_workspace * ws)
+{
+    int n = L->size1;
+    int info;
+    struct spectrum_workspace * tmp = NULL;
+    gsl_vector * ev = gsl_vector_alloc(n);
+
+    if (!ws) {
+        ws = tmp = spectrum_workspace_alloc();
+    }
+    if (spectrum_workspace_reserve(ws, n) != 0) {
+        spectrum_workspace_free(tmp);
+        gsl_vector_set_zero(ev);
+        return ev;
+    }
+
+    /* Copy the rows of L (possibly strided) to a dense array.  L is
+     * symmetric, so the row major copy is also column major */
+    for (int i = 0; i < n; i++) {
+        memcpy(ws->a + (size_t)i*n, gsl_matrix_const_ptr(L, i, 0),
+               n * sizeof(double));
+    }
+    dsyevd_("N", "L", &n, ws->a, &n, ev->data, ws->work, &ws->lwork,
+            ws->iwork, &ws->liwork, &info);
+    if (info != 0) {
+        printf("dsyevd failed: info = %d\n", info);
+    }
+    spectrum_workspace_free(tmp);
+
+    /* dsyevd returns the eigenvalues in ascending order */
+    return ev;
+}
+
+/* Computes the eigenvalues of a Laplacian matrix, sorted in
+ * ascending order.  The KL and JS divergences only depend on the
+ * Laplacians through these spectra, so they can be computed once
+ * per SCG and dimension and reused for any beta */
+gsl_vector * laplacian_spectrum(gsl_matrix * L)
+{
+    return laplacian_spectrum_ws(L, NULL);
+}
+
+/* Spectrum of a Laplacian whose basis is expanded with zeros to size n
+ * (see reconcile_laplacians): the extra eigenvalues are zero */
+static double * padded_spectrum(gsl_vector * ev, size_t n)
+{
+    double * out = calloc(n, sizeof(double));
+    for (size_t i = 0; i < ev->size; i++) {
+        out[i] = gsl_vector_get(ev, i);
+    }
+    gsl_sort(out, 1, n);
+    return out;
+}
+
+/* Log of the density matrix eigenvalues exp(beta*ev) / tr */
+static void log_density_spectrum(double * ev, size_t n, double beta,
+                                 double * out)
+{
+    double m = beta*ev[0];
+    double tr = 0.0;
+    double logtr;
+
+    for (size_t i = 1; i < n; i++) {
+        if (beta*ev[i] > m) m = beta*ev[i];
+    }
+    for (size_t i = 0; i < n; i++) {
+        tr += exp(beta*ev[i] - m);
+    }
+    logtr = m + log(tr);
+    for (size_t i = 0; i < n; i++) {
+        out[i] = beta*ev[i] - logtr;
+    }
+}
+
+/* Computes the KL divergence between the density matrices of two 
+ * Laplacians with sorted spectra ev1 and ev2 for each of nbetas betas.
+ * The smaller spectrum is padded with zeros, as reconcile_laplacians
+ * does for the matrices. Matches KL_divergence. */
+void KL_divergence_spectra(gsl_vector * ev1, gsl_vector * ev2,
+                           const double * betas, size_t nbetas, double * out)
+{
+    size_t n = ev1->size > ev2->size ? ev1->size : ev2->size;
+    double * r = padded_spectrum(ev1, n);
+    double * s = padded_spectrum(ev2, n);
+    double * lr = malloc(n * sizeof(double));
+    double * ls = malloc(n * sizeof(double));
+    double div;
+
+    for (size_t b = 0; b < nbetas; b++) {
+        log_density_spectrum(r, n, betas[b], lr);
+        log_density_spectrum(s, n, betas[b], ls);
+        div = 0.0;
+        for (size_t i = 0; i < n; i++) {
+            div += exp(lr[i])*(lr[i] - ls[i]);
+        }
+        out[b] = div / log(2.0);
+    }
+    free(r);
+    free(s);
+    free(lr);
+    free(ls);
+}
+
+/* Computes the JS divergence for each of nbetas betas from the sorted
+ * spectra of two Laplacians and of their mean (L1 + L2)/2, as JS does */
+void JS_divergence_spectra(gsl_vector * ev1, gsl_vector * ev2,
+                           gsl_vector * evM, const double * betas,
+                           size_t nbetas, double * out)
+{
+    double * div1 = malloc(nbetas * sizeof(double));
+    double * div2 = malloc(nbetas * sizeof(double));
+
+    KL_divergence_spectra(ev1, evM, betas, nbetas, div1);
+    KL_divergence_spectra(ev2, evM, betas, nbetas, div2);
+    for (size_t b = 0; b < nbetas; b++) {
+        out[b] = 0.5*div1[b] + 0.5*div2[b];
+    }
+    free(div1);
+    free(div2);
+}
@@ -20,10 +20,41 @@
 #define SLSE_H
 
 #include <gsl/gsl_matrix.h>
+#include <gsl/gsl_vector.h>
+
+/* Reusable buffers for the LAPACK eigenvalue solver */
+struct spectrum_workspace {
+    int n;              /* largest matrix size the buffers fit */
+    double * a;         /* copy of the matrix, destroyed by dsyevd */
+    double * work;
+    int lwork;
+    int * iwork;
+    int liwork;
+};
 
 int check_square_matrix(gsl_matrix * a);
 double KL_divergence(gsl_matrix * L1, gsl_matrix * L2, double beta);
+double JS_divergence(gsl_matrix * L1, gsl_matrix * L2, double beta);
+
+/* Spectral functions: divergences from cached Laplacian spectra */
+struct spectrum_workspace * spectrum_workspace_alloc(void);
+void spectrum_workspace_free(struct spectrum_workspace * ws);
+gsl_vector * laplacian_spectrum_ws(gsl_matrix * L,
+                                   struct spectrum_workspace * ws);
+gsl_vector * laplacian_spectrum(gsl_matrix * L);
+void KL_divergence_spectra(gsl_vector * ev1, gsl_vector * ev2,
+                           const double * betas, size_t nbetas, double * out);
+void JS_divergence_spectra(gsl_vector * ev1, gsl_vector * ev2,
+                           gsl_vector * evM, const double * betas,
+                           size_t nbetas, double * out);
+#ifdef NOCUDA
+/* CPU-only build: the CUDA divergences fall back to the LAPACK solver */
+#define KL_divergence_cuda KL_divergence
+#define JS_divergence_cuda JS_divergence
+#else
 extern double KL_divergence_cuda(gsl_matrix * L1, gsl_matrix * L2, double beta);
+extern double JS_divergence_cuda(gsl_matrix * L1, gsl_matrix * L2, double beta);
+#endif
 
 
 #endif
@@ -30,6 +30,11 @@
 #include <gsl/gsl_sort_vector.h>
 #include <gsl/gsl_eigen.h>
 
+/* From slse.c: JS divergence from sorted spectra */
+extern "C" void JS_divergence_spectra(gsl_vector * ev1, gsl_vector * ev2,
+                                      gsl_vector * evM, const double * betas,
+                                      size_t nbetas, double * out);
+
 
 int check_square_matrix(gsl_matrix * a)
 {
@@ -133,7 +138,7 @@ extern "C" double KL_divergence_cuda(gsl_matrix * L1, gsl_matrix * L2, double be
     double rval, sval;
 
     int i;
-    size_t n;
+    int n;
 
     /* Check if they are square matrices and report size */
     if ((n = check_square_matrix(L1)) < 0) {
@@ -173,6 +178,8 @@ extern "C" double KL_divergence_cuda(gsl_matrix * L1, gsl_matrix * L2, double be
     for (i = 0; i < n; i++) {
         rval = gsl_vector_get(rhov, i) / tr1;
         sval = gsl_vector_get(sigmav, i) / tr2;
+        /* 0 log 0 = 0: skip eigenvalues whose density underflows */
+        if (rval == 0.0) continue;
         div += rval*(log(rval) - log(sval))/log(2.0);
     }
     /* Free Memory */
@@ -182,3 +189,43 @@ extern "C" double KL_divergence_cuda(gsl_matrix * L1, gsl_matrix * L2, double be
     gsl_vector_free(L2v);       
     return div;
 }
+
+/* Computes the JS divergence between the density matrices of two
+ * Laplacians of the same size.  L1, L2 and their mean are each
+ * decomposed once on the GPU */
+extern "C" double JS_divergence_cuda(gsl_matrix * L1, gsl_matrix * L2, double beta)
+{
+    double div = 0.0;
+    int n;
+
+    /* Check if they are square matrices and report size */
+    if ((n = check_square_matrix(L1)) < 0) {
+        printf("Rho matrix not Square!! \n");
+        return 0;
+    } else if ( check_square_matrix(L2) != n) {
+        printf("Rho and Sigma dimensions do not match! \n");
+        return 0;
+    }
+
+    gsl_matrix * M = gsl_matrix_alloc(n, n);
+    gsl_matrix_memcpy(M, L1);
+    gsl_matrix_add(M, L2);
+    gsl_matrix_scale(M, 0.5);
+
+    /* compute eigenvalues */
+    gsl_vector * L1v = cuda_get_eigenvalues(L1, n);
+    gsl_vector * L2v = cuda_get_eigenvalues(L2, n);
+    gsl_vector * Mv = cuda_get_eigenvalues(M, n);
+    gsl_sort_vector(L1v);
+    gsl_sort_vector(L2v);
+    gsl_sort_vector(Mv);
+
+    JS_divergence_spectra(L1v, L2v, Mv, &beta, 1, &div);
+
+    /* Free Memory */
+    gsl_matrix_free(M);
+    gsl_vector_free(L1v);
+    gsl_vector_free(L2v);
+    gsl_vector_free(Mv);
+    return div;
+}
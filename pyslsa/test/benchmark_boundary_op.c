@@ -0,0 +1,122 @@
+/*
+ * =====================================================================================
+ *
+ *       Filename:  benchmark_boundary_op.c
+ *
+ *    Description:  Benchmark boundary operator assembly on random complexes
+ *                  with about 10k and 100k simplices in the source chain
+ *                  group.  The indexed assembly is checked against the
+ *                  reference assembly, which compares the faces of every
+ *                  source simplex to every target simplex.
+ *
+ *        Version:  1.0
+ *       Revision:  none
+ *       Compiler:  gcc
+ *
+ * =====================================================================================
+ */
+
+#include "simplex.h"
+#include "hash_table.h"
+#include "boundary_op.h"
+
+#include <stdlib.h>
+#include <stdio.h>
+#include <time.h>
+
+#define NCELLS 400
+#define DIM 2
+
+/* Reference runs above this many source x target pairs are skipped */
+#define MAX_REFERENCE_PAIRS 1e10
+
+/*
+ *  Random complex: max simplices of 3 to 6 vertices out of NCELLS
+ */
+SCG * random_complex(int n_max_simps)
+{
+    struct Simplex ** max_simps = malloc(n_max_simps*sizeof(struct Simplex *));
+    SCG * scg = get_empty_SCG();
+
+    for (int i = 0; i < n_max_simps; i++) {
+        int nverts = 3 + rand() % 4;
+        max_simps[i] = create_empty_simplex();
+        while (max_simps[i]->dim < nverts - 1) {
+            int v = rand() % NCELLS;
+            int present = 0;
+            for (int j = 0; j <= max_simps[i]->dim; j++) {
+                present |= (max_simps[i]->vertices[j] == v);
+            }
+            if (!present) add_vertex(max_simps[i], v);
+        }
+    }
+    compute_chain_groups_capped(max_simps, n_max_simps, DIM, scg);
+    for (int i = 0; i < n_max_simps; i++) {
+        free_simplex(max_simps[i]);
+    }
+    free(max_simps);
+    return scg;
+}
+
+/*
+ *  Reference assembly: number of nonzero entries of the boundary operator
+ *  found by comparing the faces of each source simplex to every target
+ */
+long reference_nnz(SCG * scg, int dim)
+{
+    struct Simplex face;
+    long nnz = 0;
+
+    face.dim = dim - 1;
+    for (int j = 0; j < scg->cg_dim[dim]; j++) {
+        int * src = SCG_SIMPLEX(scg, dim, j);
+        for (int k = 0; k <= dim; k++) {
+            int pos = 0;
+            for (int i = 0; i <= dim; i++) {
+                if (i != k) face.vertices[pos++] = src[i];
+            }
+            if (scg_find_simplex(scg, face.vertices, dim - 1) >= 0) nnz++;
+        }
+    }
+    return nnz;
+}
+
+int main(int argc, char **argv)
+{
+    int sizes[] = {1000, 12000};
+    clock_t start;
+
+    srand(0);
+    printf("%10s %10s %12s %14s %14s\n", "source", "target", "nnz",
+           "indexed (ms)", "reference (ms)");
+    for (int s = 0; s < 2; s++) {
+        SCG * scg = random_complex(sizes[s]);
+        int nsrc = scg->cg_dim[DIM];
+        int ntarg = scg->cg_dim[DIM-1];
+
+        start = clock();
+        struct bdry_matrix * D = compute_boundary_operator_sparse(scg, DIM);
+        double t_indexed = 1000.0*(clock() - start) / CLOCKS_PER_SEC;
+
+        long nnz = 0;
+        for (long e = 0; e < (long)D->ncols*D->nnz_col; e++) {
+            nnz += (D->rows[e] >= 0);
+        }
+
+        double t_ref = -1;
+        if ((double)nsrc*ntarg <= MAX_REFERENCE_PAIRS) {
+            start = clock();
+            long nnz_ref = reference_nnz(scg, DIM);
+            t_ref = 1000.0*(clock() - start) / CLOCKS_PER_SEC;
+            if (nnz_ref != nnz) {
+                printf("Indexed and reference assembly differ\n");
+                exit(-1);
+            }
+        }
+        printf("%10d %10d %12ld %14.1f %14.1f\n", nsrc, ntarg, nnz,
+               t_indexed, t_ref);
+        free_bdry_matrix(D);
+        free_SCG(scg);
+    }
+    return 0;
+}
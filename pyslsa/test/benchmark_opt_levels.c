@@ -0,0 +1,122 @@
+/*
+ * =====================================================================================
+ *
+ *       Filename:  benchmark_opt_levels.c
+ *
+ *    Description:  Compute chain groups, Laplacian spectra and KL/JS
+ *                  divergences of random complexes and print every number
+ *                  at full precision, with the timings on stderr.  Run by
+ *                  compare_opt_levels.sh, which builds this program at
+ *                  -O0 and -O2 and checks that the outputs agree.
+ *
+ *        Version:  1.0
+ *       Revision:  none
+ *       Compiler:  gcc
+ *
+ * =====================================================================================
+ */
+
+#include "simplex.h"
+#include "hash_table.h"
+#include "boundary_op.h"
+#include "slse.h"
+
+#include <stdlib.h>
+#include <stdio.h>
+#include <time.h>
+
+#include <gsl/gsl_matrix.h>
+#include <gsl/gsl_vector.h>
+
+#define NCELLS 25
+#define NMAXSIMPS 40
+#define MAX_DIM 3
+#define NBETAS 4
+
+/*
+ *  Random complex: max simplices of 2 to 5 vertices out of NCELLS
+ */
+SCG * random_complex(int n_max_simps)
+{
+    struct Simplex ** max_simps = malloc(n_max_simps*sizeof(struct Simplex *));
+    SCG * scg = get_empty_SCG();
+
+    for (int i = 0; i < n_max_simps; i++) {
+        int nverts = 2 + rand() % 4;
+        max_simps[i] = create_empty_simplex();
+        while (max_simps[i]->dim < nverts - 1) {
+            int v = rand() % NCELLS;
+            int present = 0;
+            for (int j = 0; j <= max_simps[i]->dim; j++) {
+                present |= (max_simps[i]->vertices[j] == v);
+            }
+            if (!present) add_vertex(max_simps[i], v);
+        }
+    }
+    compute_chain_groups_capped(max_simps, n_max_simps, MAX_DIM, scg);
+    for (int i = 0; i < n_max_simps; i++) {
+        free_simplex(max_simps[i]);
+    }
+    free(max_simps);
+    return scg;
+}
+
+int main(int argc, char **argv)
+{
+    double betas[NBETAS] = {-0.1, -0.5, -1.0, -2.0};
+    double kl[NBETAS], js[NBETAS];
+    clock_t start = clock();
+
+    srand(0);
+    SCG * scg1 = random_complex(NMAXSIMPS);
+    SCG * scg2 = random_complex(NMAXSIMPS);
+    double t_build = 1000.0*(clock() - start) / CLOCKS_PER_SEC;
+
+    start = clock();
+    for (int d = 0; d < MAX_DIM; d++) {
+        printf("cg_dim %d %d %d\n", d, scg1->cg_dim[d], scg2->cg_dim[d]);
+
+        gsl_matrix * L1 = compute_simplicial_laplacian(scg1, d);
+        gsl_matrix * L2 = compute_simplicial_laplacian(scg2, d);
+        reconcile_laplacians(L1, L2, &L1, &L2);
+
+        /* Mean Laplacian (L1 + L2)/2 for JS */
+        gsl_matrix * M = gsl_matrix_alloc(L1->size1, L1->size2);
+        gsl_matrix_memcpy(M, L1);
+        gsl_matrix_add(M, L2);
+        gsl_matrix_scale(M, 0.5);
+
+        gsl_vector * ev1 = laplacian_spectrum(L1);
+        gsl_vector * ev2 = laplacian_spectrum(L2);
+        gsl_vector * evM = laplacian_spectrum(M);
+        for (size_t i = 0; i < ev1->size; i++) {
+            printf("spectrum %d %zu %.17g %.17g\n", d, i,
+                   gsl_vector_get(ev1, i), gsl_vector_get(ev2, i));
+        }
+
+        for (int b = 0; b < NBETAS; b++) {
+            printf("KL %d %g %.17g\n", d, betas[b],
+                   KL_divergence(L1, L2, betas[b]));
+        }
+        KL_divergence_spectra(ev1, ev2, betas, NBETAS, kl);
+        JS_divergence_spectra(ev1, ev2, evM, betas, NBETAS, js);
+        for (int b = 0; b < NBETAS; b++) {
+            printf("KL_spectra %d %g %.17g\n", d, betas[b], kl[b]);
+            printf("JS_spectra %d %g %.17g\n", d, betas[b], js[b]);
+        }
+
+        gsl_vector_free(ev1);
+        gsl_vector_free(ev2);
+        gsl_vector_free(evM);
+        gsl_matrix_free(L1);
+        gsl_matrix_free(L2);
+        gsl_matrix_free(M);
+    }
+    double t_div = 1000.0*(clock() - start) / CLOCKS_PER_SEC;
+    fprintf(stderr, "build %.1f ms, laplacians and divergences %.1f ms\n",
+            t_build, t_div);
+
+    free_SCG(scg1);
+    free_SCG(scg2);
+    return 0;
+}
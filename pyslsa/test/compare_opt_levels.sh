@@ -0,0 +1,44 @@
+#!/bin/sh
+# Build benchmark_opt_levels.c against the SLSA core at -O0 and at -O2,
+# run both and check that the chain groups, Laplacian spectra and KL/JS
+# divergences agree to a relative tolerance of TOL (default 1e-12).
+# Run from pyslsa/.  GSL_CFLAGS, GSL_LIBS and LAPACK_LIBS locate GSL and
+# LAPACK if they are not installed in the default paths.
+set -e
+
+CC=${CC:-gcc}
+TOL=${TOL:-1e-12}
+GSL_LIBS=${GSL_LIBS:--lgsl -lgslcblas}
+LAPACK_LIBS=${LAPACK_LIBS:--llapack -lblas}
+OUT=$(mktemp -d)
+SRC="test/benchmark_opt_levels.c slsa/simplex.c slsa/hash_table.c slsa/boundary_op.c slsa/slse.c"
+
+for opt in -O0 -O2; do
+    $CC $opt -std=c99 -Wall -DNOPYTHON -Islsa $GSL_CFLAGS $SRC $GSL_LIBS $LAPACK_LIBS -lm \
+        -o $OUT/bench$opt
+    echo "$opt: $($OUT/bench$opt 2>&1 >$OUT/out$opt)"
+done
+
+# Fields 1-3 are labels; numbers after them must agree within TOL
+paste -d' ' $OUT/out-O0 $OUT/out-O2 | awk -v tol=$TOL '
+{
+    n = NF/2
+    for (i = 1; i <= n; i++) {
+        a = $i; b = $(i+n)
+        if (i <= 3 && $1 != "cg_dim") {
+            if (a != b) { print "mismatched lines:", $0; bad = 1 }
+            continue
+        }
+        d = a - b; if (d < 0) d = -d
+        s = a < 0 ? -a : a; if (s < 1) s = 1
+        if (d/s > maxerr) maxerr = d/s
+        if (d/s > tol) { print "differs:", $0; bad = 1 }
+    }
+    count++
+}
+END {
+    printf("%d lines compared, max relative difference %g\n", count, maxerr)
+    if (bad) { print "-O0 and -O2 builds differ"; exit 1 }
+    print "-O0 and -O2 builds agree"
+}'
+rm -rf $OUT
@@ -55,8 +55,7 @@ int test_boundary_op()
     compute_chain_groups(max_simps, 3, scg1);
     
     struct bdry_op_dict * bdry_op_1 = compute_boundary_operator(s2);
-    int * out_vec = bdry_canonical_coordinates(bdry_op_1, scg1->x[1],
-                                          scg1->cg_dim[1]);
+    int * out_vec = bdry_canonical_coordinates(bdry_op_1, scg1, 1);
     print_SCG(scg1);    
     printf("BOUNDARY OPERATOR\n");
     for (int i = 0; i < scg1->cg_dim[1]; i++) {
@@ -66,37 +65,39 @@ int test_boundary_op()
     printf ("\nBOUNDARY MATRIX\n");
     int srcd = scg1->cg_dim[2];
     int trgd = scg1->cg_dim[1];
-    int * out_mat = compute_boundary_operator_matrix(scg1, 2);
+    gsl_matrix * out_mat = compute_boundary_operator_matrix(scg1, 2);
     for (int i = 0; i < trgd; i++) {
         for (int j = 0; j < srcd; j++) {
-            printf("%2d, ", out_mat[i*srcd + j]);
+            printf("%2d, ", (int)gsl_matrix_get(out_mat, i, j));
         }
         printf(";\n");
     }
     printf("\n");
+    gsl_matrix_free(out_mat);
     srcd = scg1->cg_dim[3];
     trgd = scg1->cg_dim[2];
     out_mat = compute_boundary_operator_matrix(scg1, 3);
     for (int i = 0; i < trgd; i++) {
         for (int j = 0; j < srcd; j++) {
-            printf("%2d, ", out_mat[i*srcd + j]);
+            printf("%2d, ", (int)gsl_matrix_get(out_mat, i, j));
         }
         printf(";\n");
     }
     printf("\n\nLAPLACIAN\n");
-    int * laplacian = compute_simplicial_laplacian(scg1, 2);
+    gsl_matrix_free(out_mat);
+    gsl_matrix * L = compute_simplicial_laplacian(scg1, 2);
     for (int i = 0; i<scg1->cg_dim[2]; i++) {
         for (int j=0; j<scg1->cg_dim[2]; j++) {
-            printf("%2d, ", laplacian[i*scg1->cg_dim[2] + j]);
+            printf("%2d, ", (int)gsl_matrix_get(L, i, j));
         }
         printf(";\n");
     }
     printf("\n");
     
-    gsl_matrix * L = to_gsl(laplacian, trgd);
     double div = KL_divergence(L, L, 0.15);
     printf("Div: %f\n", div);
-
+    gsl_matrix_free(L);
+    return 1;
 }
 int test_compute_chain_groups()
 {
@@ -177,7 +178,7 @@ int test_scg_list_union()
     print_SCG(scg2);
 
     scg_list_union_hash(scg1, scg2, NULL);
-    if ((!simplex_list_isin(scg2->x[2], s1))) {
+    if (scg_find_simplex(scg2, s1->vertices, 2) < 0) {
         retcode = 0;
     }
     print_SCG(scg2);
@@ -230,7 +231,7 @@ int test_int_from_simplex()
     return retcode;
 }
 
-int test_add_remove_simplex()
+int test_add_find_simplex()
 {
     int retcode = 1;
 
@@ -243,25 +244,23 @@ int test_add_remove_simplex()
     add_vertex(s2, 1);
     add_vertex(s2, 4);
     add_vertex(s2, 11);
-    struct simplex_list *new_sl = get_empty_simplex_list();
-
-    add_simplex(new_sl, s1);
-    if ((!simplex_list_isin(new_sl, s1)) || (simplex_list_isin(new_sl, s2))) {
-        retcode = 0;
-        return retcode;
-    }
+    SCG * scg = get_empty_SCG();
 
-    add_simplex(new_sl, s2);
-    if ((!simplex_list_isin(new_sl, s1)) || (!simplex_list_isin(new_sl, s2))) {
+    scg_add_simplex(scg, s1);
+    if ((scg_find_simplex(scg, s1->vertices, 2) != 0) ||
+        (scg_find_simplex(scg, s2->vertices, 2) >= 0)) {
         retcode = 0;
-        return retcode;
     }
 
-    new_sl = remove_simplex(new_sl, s2);
-    if ((!simplex_list_isin(new_sl, s1)) || (simplex_list_isin(new_sl, s2))) {
+    scg_add_simplex(scg, s2);
+    scg_add_simplex(scg, s1);
+    if ((scg->cg_dim[2] != 2) ||
+        (scg_find_simplex(scg, s2->vertices, 2) != 1)) {
         retcode = 0;
-        return retcode;
     }
+    free_SCG(scg);
+    free_simplex(s1);
+    free_simplex(s2);
     return retcode;
 }
 
@@ -304,8 +303,8 @@ int main(int argc, char **argv)
         printf("Simplex equals fails\n");
         exit(-1);
     }
-    if (!test_add_remove_simplex()) {
-        printf("Add Remove Simplex fails\n");
+    if (!test_add_find_simplex()) {
+        printf("Add Find Simplex fails\n");
         exit(-1);
     }
     if (!test_scg_list_union()) {
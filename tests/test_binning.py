@@ -0,0 +1,258 @@
+import os
+import numpy as np
+import pandas as pd
+import h5py
+
+import neuraltda.topology2 as tp2
+
+
+def generate_binning_dataset(n_cells, n_trials, trial_len, fs, rate, gap=2.0):
+    '''
+    Generates random Poisson spike trains for a set of trials
+    '''
+    trial_samps = int(trial_len*fs)
+    gap_samps = int(gap*fs)
+    trial_starts = (trial_samps + gap_samps)*np.arange(n_trials) + gap_samps
+    n_spikes = np.random.poisson(rate*n_cells*(trial_len+gap)*n_trials)
+    total = int(trial_starts[-1] + trial_samps + gap_samps)
+    spikes = pd.DataFrame({'cluster': np.random.randint(0, n_cells, n_spikes),
+                           'time_samples': np.sort(np.random.randint(0, total,
+                                                                     n_spikes)),
+                           'recording': np.zeros(n_spikes, dtype=int)})
+    trials = pd.DataFrame({'time_samples': trial_starts,
+                           'stimulus_end': trial_starts + trial_samps,
+                           'stimulus': n_trials*['test_binning_stimulus'],
+                           'recording': np.zeros(n_trials, dtype=int)})
+    clusters = pd.DataFrame({'cluster': np.arange(n_cells),
+                             'quality': n_cells*['Good']})
+    return (spikes, trials, clusters)
+
+
+def loop_activity_tensor(stim_trials, spikes, clusters_list, nclus,
+                         win_size, subwin_len, noverlap, segment):
+    '''
+    Reference binning for build_activity_tensor_quick: loops over every
+    spike with get_windows_for_spike
+    '''
+    nreps = len(stim_trials.index)
+    stim_recs = stim_trials['recording'].values
+    skip = subwin_len - noverlap
+    dur = segment[1] - segment[0]
+    nwins = int(np.round(float(dur)/float(skip)))
+    poptens = np.zeros((nclus, nwins, nreps))
+    for rep in range(nreps):
+        trial_start = stim_trials.iloc[rep]['time_samples']
+        samp_period = (trial_start + segment[0], trial_start + segment[1])
+        stim_rec_spikes = tp2.get_spikes_in_window(spikes, samp_period,
+                                                   stim_recs[rep])
+        sptimes = stim_rec_spikes['time_samples'].values
+        clusters = stim_rec_spikes['cluster'].values
+        for sp, clu in zip(sptimes, clusters):
+            wins = tp2.get_windows_for_spike(sp, subwin_len, noverlap,
+                                             samp_period)
+            poptens[clusters_list==clu, wins, rep] += 1
+    poptens /= (win_size/1000.0)
+    return poptens
+
+
+def test_build_activity_tensor_quick_matches_loop():
+    np.random.seed(1)
+    fs = 24000.0
+    (spikes, trials, clusters) = generate_binning_dataset(12, 4, 1.0, fs, 20.0)
+    clusters_list = clusters['cluster'].unique()[1:]
+    spikes = spikes[spikes['cluster'].isin(list(clusters_list))]
+    for (win_size, dt_overlap) in [(10.0, 0.0), (10.0, 5.0), (25.0, 20.0),
+                                   (7.3, 2.1)]:
+        subwin_len = int(np.round(win_size/1000. * fs))
+        noverlap = int(np.round(dt_overlap/1000. * fs))
+        trial_len = (trials['stimulus_end'] - trials['time_samples']).unique()[0]
+        for segment_info in [[0, 0], [100, -200]]:
+            segment = tp2.get_segment([0, trial_len], fs, segment_info)
+            new = tp2.build_activity_tensor_quick(trials, spikes,
+                                                  clusters_list,
+                                                  len(clusters_list),
+                                                  win_size, subwin_len,
+                                                  noverlap, segment)
+            old = loop_activity_tensor(trials, spikes, clusters_list,
+                                       len(clusters_list), win_size,
+                                       subwin_len, noverlap, segment)
+            assert new.shape == old.shape
+            assert np.array_equal(new, old)
+
+
+def test_get_windows_for_spikes_matches_scalar():
+    segment = [1000, 9000]
+    sptimes = np.arange(1000, 9001, 7)
+    (spike_inds, wins) = tp2.get_windows_for_spikes(sptimes, 240, 120, segment)
+    for ind, t in enumerate(sptimes):
+        expected = sorted(tp2.get_windows_for_spike(t, 240, 120, segment))
+        assert sorted(wins[spike_inds == ind]) == expected
+
+
+def test_spike_index_matches_dataframe_masking():
+    np.random.seed(2)
+    n_spikes = 5000
+    spikes = pd.DataFrame({'cluster': np.random.randint(0, 10, n_spikes),
+                           'time_samples': np.random.randint(0, 100000,
+                                                             n_spikes),
+                           'recording': np.random.randint(0, 3, n_spikes)})
+    spike_index = tp2.SpikeIndex(spikes)
+    assert len(spike_index) == n_spikes
+    for (window, rec) in [((100, 5000), 0), ((2000.5, 70000.2), 2),
+                          ((0, 100000), 1), ((500, 400), 0), ((0, 10), 7)]:
+        expected = tp2.get_spikes_in_window(spikes, window, rec)
+        (times, clusters) = tp2.get_spikes_in_window(spike_index, window, rec)
+        order = np.lexsort((expected['cluster'].values,
+                            expected['time_samples'].values))
+        assert np.array_equal(times, expected['time_samples'].values[order])
+        got = np.lexsort((clusters, times))
+        assert np.array_equal(clusters[got],
+                              expected['cluster'].values[order])
+        assert times.base is not None
+
+
+def test_build_activity_tensors_multi_matches_single():
+    np.random.seed(3)
+    fs = 24000.0
+    (spikes, trials, clusters) = generate_binning_dataset(10, 3, 1.0, fs, 30.0)
+    clusters_list = clusters['cluster'].unique()
+    win_sizes = [2.0, 5.0, 10.0, 25.0, 7.5]
+    dt_overlaps = [0.0, 2.5, 5.0, 12.5, 2.5]
+    subwin_lens = [int(np.round(w/1000. * fs)) for w in win_sizes]
+    noverlaps = [int(np.round(o/1000. * fs)) for o in dt_overlaps]
+    # window steps with gcd 1 are binned one size at a time
+    coprime = ([97.0/fs*1000., 101.0/fs*1000.], [97, 101], [0, 0])
+    trial_len = (trials['stimulus_end'] - trials['time_samples']).unique()[0]
+    for (segment_info, (win_sizes, subwin_lens, noverlaps)) in [
+            ([0, 0], (win_sizes, subwin_lens, noverlaps)),
+            ([50, -120], (win_sizes, subwin_lens, noverlaps)),
+            ([0, 0], coprime)]:
+        segment = tp2.get_segment([0, trial_len], fs, segment_info)
+        multi = tp2.build_activity_tensors_multi(trials, spikes,
+                                                 clusters_list,
+                                                 len(clusters_list),
+                                                 win_sizes, subwin_lens,
+                                                 noverlaps, segment)
+        for ind in range(len(win_sizes)):
+            single = tp2.build_activity_tensor_quick(trials, spikes,
+                                                     clusters_list,
+                                                     len(clusters_list),
+                                                     win_sizes[ind],
+                                                     subwin_lens[ind],
+                                                     noverlaps[ind], segment)
+            assert np.array_equal(multi[ind], single)
+
+
+def test_binning_cache(tmpdir):
+    np.random.seed(3)
+    fs = 24000.0
+    block_path = str(tmpdir)
+    (spikes, trials, clusters) = generate_binning_dataset(6, 2, 0.5, fs, 20.0)
+    bfdict = tp2.do_dag_bin_lazy(block_path, spikes, trials, clusters, fs,
+                                 10.0, [0, 0], cluster_group=['Good'])
+    assert bfdict['cache'] == 'miss'
+    bfdict2 = tp2.do_dag_bin_lazy(block_path, spikes, trials, clusters, fs,
+                                  10.0, [0, 0], cluster_group=['Good'])
+    assert bfdict2['cache'] == 'hit'
+    assert bfdict2['raw'] == bfdict['raw']
+
+    # Different data must not hit the same entry
+    spikes2 = spikes.copy()
+    spikes2['time_samples'] += 1
+    bfdict3 = tp2.do_dag_bin_lazy(block_path, spikes2, trials, clusters, fs,
+                                  10.0, [0, 0], cluster_group=['Good'])
+    assert bfdict3['cache'] == 'miss'
+    assert bfdict3['raw'] != bfdict['raw']
+
+    # The comment names the binned folder, so it is part of the key
+    bfdict4 = tp2.do_dag_bin_lazy(block_path, spikes, trials, clusters, fs,
+                                  10.0, [0, 0], cluster_group=['Good'],
+                                  comment='tagged')
+    assert bfdict4['cache'] == 'miss'
+    assert '0-0-tagged' in bfdict4['raw']
+
+    bfdicts = tp2.do_dag_bin_multi_lazy(block_path, spikes, trials, clusters,
+                                        fs, [10.0, 20.0], [0, 0],
+                                        cluster_group=['Good'])
+    assert [b['cache'] for b in bfdicts] == ['hit', 'miss']
+    assert bfdicts[0]['raw'] == bfdict['raw']
+
+    report = tp2.binning_cache_report(block_path)
+    assert report['entries'] == 4
+    assert report['hits'] == 2
+    assert report['misses'] == 4
+
+    # Evict everything but the newest entry
+    tp2.do_dag_bin_lazy(block_path, spikes, trials, clusters, fs, 5.0,
+                        [0, 0], cluster_group=['Good'], cache_max_bytes=1)
+    report = tp2.binning_cache_report(block_path)
+    assert report['entries'] == 1
+    assert not os.path.exists(bfdict['raw'])
+
+
+def test_compressed_count_storage(tmpdir):
+    np.random.seed(4)
+    fs = 24000.0
+    (spikes, trials, clusters) = generate_binning_dataset(8, 3, 0.5, fs, 20.0)
+    plain_f = os.path.join(str(tmpdir), 'plain.binned')
+    packed_f = os.path.join(str(tmpdir), 'packed.binned')
+    tp2.build_binned_file_quick(spikes, trials, clusters, 10.0, fs, ['Good'],
+                                [0, 0], plain_f, 5.0)
+    tp2.build_binned_file_quick(spikes, trials, clusters, 10.0, fs, ['Good'],
+                                [0, 0], packed_f, 5.0, compression='lzf',
+                                store_counts=True)
+    stim = 'test_binning_stimulus'
+    sel = [1, 4, 5]
+    with h5py.File(plain_f, 'r') as pf, h5py.File(packed_f, 'r') as cf:
+        dset = cf[stim]['pop_tens']
+        assert dset.compression == 'lzf'
+        assert dset.chunks == (8, dset.shape[1], 1)
+        assert dset.dtype.kind == 'u'
+        full = np.array(pf[stim]['pop_tens'])
+        assert np.allclose(tp2.read_population_tensor(cf[stim]), full)
+        assert np.allclose(tp2.read_population_trial(cf[stim], 2),
+                           full[:, :, 2])
+        assert np.allclose(tp2.read_population_trial(cf[stim], 1,
+                                                     clusters=sel),
+                           full[sel, :, 1])
+        assert np.allclose(tp2.read_population_tensor(cf[stim], [0, 2],
+                                                      clusters=[5, 1, 4]),
+                           full[sel][:, :, [0, 2]])
+        assert np.allclose(tp2.read_population_tensor(pf[stim],
+                                                      clusters=sel),
+                           full[sel])
+        assert tp2.read_population_tensor(cf[stim], clusters=[99]).shape == \
+            (0, full.shape[1], 3)
+        assert tp2.population_tensor_shape(cf[stim], sel) == \
+            (3, full.shape[1], 3)
+    assert np.allclose(tp2.extract_population_tensor(packed_f, stim), full)
+
+
+def test_open_population_memmap(tmpdir, monkeypatch):
+    np.random.seed(5)
+    fs = 24000.0
+    (spikes, trials, clusters) = generate_binning_dataset(8, 3, 0.5, fs, 20.0)
+    plain_f = os.path.join(str(tmpdir), 'plain.binned')
+    packed_f = os.path.join(str(tmpdir), 'packed.binned')
+    tp2.build_binned_file_quick(spikes, trials, clusters, 10.0, fs, ['Good'],
+                                [0, 0], plain_f)
+    tp2.build_binned_file_quick(spikes, trials, clusters, 10.0, fs, ['Good'],
+                                [0, 0], packed_f, compression='lzf',
+                                store_counts=True)
+    stim = 'test_binning_stimulus'
+    full = tp2.extract_population_tensor(plain_f, stim)
+    with tp2.open_population_memmap(plain_f, stim) as poptens:
+        assert isinstance(poptens, np.memmap)
+        # trial major: each trial is contiguous
+        assert poptens.flags['C_CONTIGUOUS']
+        assert np.array_equal(poptens, np.transpose(full, (2, 0, 1)))
+        tmp_f = poptens.filename
+    assert not os.path.exists(tmp_f)
+    # trials read in blocks of a single trial
+    monkeypatch.setattr(tp2, 'POPTENS_MEMMAP_BLOCK_BYTES', 1)
+    with tp2.open_population_memmap(packed_f, stim, [0, 3]) as poptens:
+        assert isinstance(poptens, np.memmap)
+        tmp_f = poptens.filename
+        for trial in range(full.shape[2]):
+            assert np.allclose(poptens[trial], full[[0, 3], :, trial])
+    assert not os.path.exists(tmp_f)
@@ -0,0 +1,206 @@
+import itertools
+import os
+
+import numpy as np
+import h5py
+
+import neuraltda.homology as hom
+import neuraltda.topology2 as tp2
+
+
+def gf2_rank(mat):
+    '''
+    Rank of a 0/1 matrix over Z/2
+    '''
+    mat = mat.copy() % 2
+    rank = 0
+    (nrows, ncols) = mat.shape
+    for col in range(ncols):
+        rows = np.nonzero(mat[rank:, col])[0]
+        if len(rows) == 0:
+            continue
+        pivot = rank + rows[0]
+        mat[[rank, pivot]] = mat[[pivot, rank]]
+        others = np.nonzero(mat[:, col])[0]
+        others = others[others != rank]
+        mat[others] ^= mat[rank]
+        rank += 1
+        if rank == nrows:
+            break
+    return rank
+
+
+def brute_force_bettis(simplices, ndims):
+    by_dim = [sorted(s for s in simplices if len(s) == d+1)
+              for d in range(ndims+1)]
+    ranks = [0]
+    for d in range(1, ndims+1):
+        index = {s: i for i, s in enumerate(by_dim[d-1])}
+        bdry = np.zeros((len(by_dim[d-1]), len(by_dim[d])), dtype=np.uint8)
+        for j, s in enumerate(by_dim[d]):
+            for k in range(len(s)):
+                bdry[index[s[:k] + s[k+1:]], j] = 1
+        ranks.append(gf2_rank(bdry))
+    ranks.append(0)
+    return [len(by_dim[d]) - ranks[d] - ranks[d+1] for d in range(ndims)]
+
+
+def test_known_spaces():
+    circle = [[0, [0, 1]], [1, [1, 2]], [2, [0, 2]], [3, [0, 1, 2]],
+              [4, []], [5, [3]]]
+    assert hom.calc_bettis_from_cell_groups(circle) == \
+        [[1, [1, 0, 0]], [2, [1, 0, 0]], [3, [1, 1, 0]], [4, [1, 0, 0]],
+         [6, [2, 0, 0]]]
+    sphere = [[i, list(f)]
+              for i, f in enumerate(itertools.combinations(range(4), 3))]
+    assert hom.calc_bettis_from_cell_groups(sphere)[-1] == [4, [1, 0, 1]]
+    assert hom.calc_bettis_from_cell_groups(sphere, max_dim=1)[-1] == \
+        [4, [1, 0]]
+    assert hom.calc_bettis_from_cell_groups([[0, []]]) == []
+
+
+def test_random_filtrations_match_brute_force():
+    np.random.seed(7)
+    for rep in range(10):
+        data_mat = np.random.poisson(1.0, (9, 30)).astype(float)
+        clusters = np.arange(9) + 100
+        cell_groups = tp2.calc_cell_groups(data_mat, clusters, 1.5)
+        bettis = tp2.calc_bettis(data_mat, clusters, None, 1.5,
+                                 backend='native')
+        filtration = hom.cell_groups_to_filtration(cell_groups)
+        ndims = max(len(s) for s in filtration)
+        for (t, betti_vals) in bettis:
+            simplices = [s for s in filtration if filtration[s] <= t]
+            assert betti_vals == brute_force_bettis(simplices, ndims)
+
+
+def test_parallel_betti_scheduler(tmpdir):
+    np.random.seed(8)
+    block_path = str(tmpdir)
+    binned_f = os.path.join(block_path, 'test.binned')
+    with h5py.File(binned_f, 'w') as bdf:
+        for stim in ['a', 'b']:
+            stimgrp = bdf.create_group(stim)
+            poptens = np.random.poisson(1.0, (8, 40, 3)).astype(float)
+            tp2.write_population_tensor(stimgrp, poptens, np.arange(8) + 10,
+                                        24000.0, 10.0)
+    variants = ['raw', 'rawshuffled', 'permuted', 'shuffledpermuted']
+    results = tp2.calc_CI_bettis_tensor_parallel('par', binned_f, block_path,
+                                                 1.5, variants, nperms=2,
+                                                 ncellsperm=5, njobs=2,
+                                                 backend='native')
+    results1 = tp2.calc_CI_bettis_tensor_parallel('par1', binned_f,
+                                                  block_path, 1.5, variants,
+                                                  nperms=2, ncellsperm=5,
+                                                  njobs=1, max_in_flight=1,
+                                                  backend='native')
+    serial = tp2.calc_CI_bettis_tensor('ser', binned_f, block_path, 1.5,
+                                       backend='native')[1]
+    assert results['raw'][1] == serial
+    for variant in variants:
+        assert results[variant][1] == results1[variant][1]
+        assert os.path.exists(results[variant][0])
+    assert list(results['permuted'][1]['a'].keys()) == ['0', '1', '2']
+    assert list(results['permuted'][1]['a']['0'].keys()) == ['0', '1']
+
+    # cluster subsets, with the default variants
+    clusters = [11, 12, 14, 15, 17]
+    subset = tp2.calc_CI_bettis_tensor_parallel('sub', binned_f, block_path,
+                                                1.5, njobs=2,
+                                                backend='native',
+                                                clusters=clusters)
+    serial = tp2.calc_CI_bettis_tensor('subser', binned_f, block_path, 1.5,
+                                       clusters=clusters,
+                                       backend='native')[1]
+    assert list(subset.keys()) == ['raw']
+    assert subset['raw'][1] == serial
+    assert subset['raw'][1] != results['raw'][1]
+
+
+def test_serial_bettis_select_clusters(tmpdir):
+    np.random.seed(10)
+    block_path = str(tmpdir)
+    full_f = os.path.join(block_path, 'full.binned')
+    subset_f = os.path.join(block_path, 'subset.binned')
+    cells = np.arange(8) + 10
+    clusters = [11, 12, 14, 15, 17]
+    rows = [1, 2, 4, 5, 7]
+    with h5py.File(full_f, 'w') as fdf, h5py.File(subset_f, 'w') as sdf:
+        for stim in ['a', 'b']:
+            poptens = np.random.poisson(1.0, (8, 40, 3)).astype(float)
+            tp2.write_population_tensor(fdf.create_group(stim), poptens,
+                                        cells, 24000.0, 10.0)
+            tp2.write_population_tensor(sdf.create_group(stim),
+                                        poptens[rows], cells[rows],
+                                        24000.0, 10.0)
+    # clusters selects rows of the population tensor
+    subset = tp2.calc_CI_bettis_tensor('sub', full_f, block_path, 1.5,
+                                       clusters=clusters,
+                                       backend='native')[1]
+    expected = tp2.calc_CI_bettis_tensor('exp', subset_f, block_path, 1.5,
+                                         backend='native')[1]
+    assert subset == expected
+    full = tp2.calc_CI_bettis_tensor('full', full_f, block_path, 1.5,
+                                     backend='native')[1]
+    assert full != subset
+
+
+def test_incremental_matches_batch():
+    np.random.seed(9)
+    for rep in range(10):
+        data_mat = np.random.poisson(1.0, (10, 50)).astype(float)
+        data_mat[:, :3] = 0
+        clusters = np.arange(10)
+        cell_groups = tp2.calc_cell_groups(data_mat, clusters, 1.5)
+        batch = dict((t, b) for (t, b) in
+                     hom.calc_bettis_from_cell_groups(cell_groups))
+        incremental = tp2.calc_bettis(data_mat, clusters, None, 1.5,
+                                      backend='incremental')
+        times = [t for (t, b) in incremental]
+        assert times == list(range(min(batch), len(cell_groups) + 1))
+        last = None
+        for (t, b) in incremental:
+            if t in batch:
+                last = batch[t]
+            assert b == last
+        capped = hom.calc_bettis_incremental(cell_groups, max_dim=1)
+        assert [b for (t, b) in capped] == [b[:2] for (t, b) in incremental]
+
+
+def test_betti_curves_match_interp1d():
+    from scipy.interpolate import interp1d
+    np.random.seed(10)
+    betti_dict = {}
+    for stim in ['a', 'b']:
+        betti_dict[stim] = {}
+        for trial in range(3):
+            betti_dict[stim][str(trial)] = {}
+            for perm in range(2):
+                nt = np.random.randint(1, 8)
+                t = np.sort(np.random.choice(60, nt, replace=False)) + 1
+                dat = [[int(x), list(np.random.randint(0, 5,
+                                                       np.random.randint(1, 4)))]
+                       for x in t]
+                betti_dict[stim][str(trial)][str(perm)] = {'bettis': dat}
+    dims = [0, 1, 2]
+    (windt, dtovr) = (10.0, 5.0)
+    twin = np.linspace(-50, 400, 97)
+    (curves, t_vals, t_ms) = tp2.betti_dict_to_betti_curves(betti_dict, dims,
+                                                            twin, windt,
+                                                            dtovr)
+    for stim in betti_dict:
+        curve = 0
+        for trial in betti_dict[stim]:
+            for perm in betti_dict[stim][trial]:
+                dat = betti_dict[stim][trial][perm]['bettis']
+                t = np.array([x[0] for x in dat])
+                for k, dim in enumerate(dims):
+                    b_val = np.array([(x[1] + 10*[0])[dim] for x in dat])
+                    b_func = interp1d(t, b_val, kind='zero',
+                                      bounds_error=False,
+                                      fill_value=(b_val[0], b_val[-1]))
+                    expected = b_func(t_vals)
+                    assert np.array_equal(curves[stim][k, :, curve],
+                                          expected)
+                curve += 1
+        assert curves[stim].shape == (3, 97, 6)
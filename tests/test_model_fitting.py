@@ -0,0 +1,46 @@
+import numpy as np
+
+import neuraltda.simpComp as sc
+import neuraltda.model_fitting as mf
+
+
+def target_complex(ncells, nwin, a, seed):
+    np.random.seed(seed)
+    binmat = (np.random.rand(ncells, nwin) < a).astype(int)
+    return sc.simplicialChainGroups(sc.binarytomaxsimplex(binmat, rDup=True),
+                                    max_dim=3)
+
+
+def test_sweep_matches_per_sample_divergences():
+    E = target_complex(8, 100, 0.1, 0)
+    fitter = mf.PoissonModelFit(E, 8, 100, 3, [0, 1], [-0.5, -1.0],
+                                njobs=1, seed=1)
+    (m, stderr) = fitter.sweep([0.05, 0.15])
+    assert m.shape == (2, 2, 2)
+    for (k, a) in enumerate([0.05, 0.15]):
+        for (l, dim) in enumerate([0, 1]):
+            divs = []
+            for binmat in fitter.sample([a])[0]:
+                msimps = sc.binarytomaxsimplex(binmat.astype(int), rDup=True)
+                Lsamp = sc.compute_laplacian(sc.simplicialChainGroups(msimps),
+                                             dim)
+                Ldata = sc.compute_laplacian(E, dim)
+                # reconcile_laplacians returns the smaller one first
+                if len(Ldata) <= len(Lsamp):
+                    (LA, LB) = sc.reconcile_laplacians(Ldata, Lsamp)
+                else:
+                    (LB, LA) = sc.reconcile_laplacians(Ldata, Lsamp)
+                divs.append(sc.KLdivergence_lap(LA, LB, -1.0))
+            assert np.isclose(m[k, l, 1], np.mean(divs))
+            assert np.isclose(stderr[k, l, 1], np.std(divs)/np.sqrt(3))
+    assert fitter.loss(0.05, 1, -1.0) == (m[0, 1, 1], stderr[0, 1, 1])
+
+
+def test_fit_recovers_rate():
+    E = target_complex(10, 300, 0.08, 3)
+    fitter = mf.PoissonModelFit(E, 10, 300, 5, [1], [-1.0], njobs=2, seed=1)
+    (a, m, stderr) = fitter.fit(1, -1.0, (0.01, 0.3))
+    assert abs(a - 0.08) < 0.02
+    (a_lo, a_hi) = fitter.rate_interval(a, 1, -1.0, (0.01, 0.3))
+    assert a_lo <= a <= a_hi
+    assert fitter.loss(a_hi, 1, -1.0)[0] >= m
@@ -0,0 +1,172 @@
+import numpy as np
+import pytest
+
+import neuraltda.simpComp as sc
+
+
+def loop_chain_groups(maxsimps):
+    '''
+    Reference simplicialChainGroups: enumerates the faces of each
+    maximal simplex with get_faces
+    '''
+    Elen = max([len(s) for s in maxsimps]) + 1
+    E = [[] for ind in range(Elen)]
+    for maxsimp in maxsimps:
+        faces = sc.get_faces(maxsimp)
+        for j in range(len(faces)):
+            E[j] = sc.union(E[j], faces[j])
+    return [sorted(Ek) for Ek in E]
+
+
+def test_bitmask_chain_groups_match_bitloop():
+    np.random.seed(11)
+    for ncells in [12, 150]:
+        for rep in range(20):
+            nsimps = np.random.randint(1, 20)
+            maxsimps = [tuple(sorted(np.random.choice(ncells,
+                                                      np.random.randint(1, 7),
+                                                      replace=False)))
+                        for ind in range(nsimps)]
+            E = sc.simplicialChainGroups(maxsimps)
+            E_old = loop_chain_groups(maxsimps)
+            assert [list(Ek) for Ek in E] == [list(Ek) for Ek in E_old]
+            assert sc.simplicialChainGroups(maxsimps, max_dim=2) == E[:4]
+            E_arr = sc.chain_group_arrays(maxsimps)
+            for k in range(1, len(E)):
+                assert E_arr[k].shape == (len(E[k]), k)
+                assert [tuple(x) for x in E_arr[k].tolist()] == E[k]
+
+
+def test_max_dim_cap_does_not_enumerate_above():
+    maxsimps = [tuple(range(40))]
+    E = sc.chain_group_arrays(maxsimps, max_dim=1)
+    assert len(E) == 3
+    assert len(E[2]) == 40*39//2
+
+
+def test_capped_chain_groups_give_same_laplacian():
+    np.random.seed(12)
+    binmat = (np.random.rand(8, 40) > 0.6).astype(int)
+    msimps = sc.binarytomaxsimplex(binmat, rDup=True)
+    E = sc.simplicialChainGroups(msimps)
+    for d in range(1, 3):
+        E_capped = sc.simplicialChainGroups(msimps, max_dim=d+1)
+        assert np.array_equal(sc.compute_laplacian(E_capped, d),
+                              sc.compute_laplacian(E, d))
+
+
+def test_sparse_boundary_operator_matches_canonical_coordinates():
+    np.random.seed(13)
+    binmat = (np.random.rand(9, 30) > 0.55).astype(int)
+    msimps = sc.binarytomaxsimplex(binmat, rDup=True)
+    E = sc.simplicialChainGroups(msimps)
+    for dim in range(1, len(E)-1):
+        D = sc.sparse_boundary_operator(E, dim)
+        expected = np.zeros((len(E[dim]), len(E[dim+1])))
+        for j, simplex in enumerate(E[dim+1]):
+            c = sc.boundaryOperator(simplex)
+            expected[:, j] = sc.canonicalCoordinates(c, E[dim])
+        assert np.array_equal(D.toarray(), expected)
+        assert D.nnz == (dim+1)*len(E[dim+1])
+    for d in range(len(E)):
+        L = sc.compute_laplacian(E, d, sparse=True)
+        assert np.array_equal(L.toarray(), sc.compute_laplacian(E, d))
+    (LA, LB) = sc.reconcile_laplacians(sc.compute_laplacian(E, 1, sparse=True),
+                                       np.eye(len(E[2]) + 3))
+    assert LA.shape == LB.shape
+    assert np.array_equal(LA.toarray()[:len(E[2]), :len(E[2])],
+                          sc.compute_laplacian(E, 1))
+
+
+def test_spectrum_cache_matches_matrix_divergences():
+    np.random.seed(14)
+    scgs = []
+    for ind in range(3):
+        binmat = (np.random.rand(8, 30) > 0.55).astype(int)
+        scgs.append(sc.simplicialChainGroups(
+            sc.binarytomaxsimplex(binmat, rDup=True)))
+    betas = [-2.0, -0.5, 0.3]
+    cache = sc.SpectrumCache()
+    for dim in [0, 1, 2]:
+        for scgA in scgs:
+            for scgB in scgs:
+                LA = sc.compute_laplacian(scgA, dim)
+                LB = sc.compute_laplacian(scgB, dim)
+                # reconcile_laplacians returns the smaller matrix first
+                if len(LA) <= len(LB):
+                    (LA, LB) = sc.reconcile_laplacians(LA, LB)
+                else:
+                    (LB, LA) = sc.reconcile_laplacians(LA, LB)
+                expected = [sc.KLdivergence_lap(LA, LB, beta)
+                            for beta in betas]
+                assert np.allclose(cache.KL(scgA, scgB, dim, betas),
+                                   expected)
+                M = (LA + LB) / 2.0
+                expected = [0.5*sc.KLdivergence_lap(LA, M, beta) +
+                            0.5*sc.KLdivergence_lap(LB, M, beta)
+                            for beta in betas]
+                assert np.allclose(sc.JS_betas(scgA, scgB, dim, betas,
+                                               cache), expected)
+    assert len(cache.spectra) == 9
+
+
+def test_js_divergence_matches_kl_to_mean():
+    np.random.seed(13)
+    A = np.random.randn(30, 30)
+    B = np.random.randn(30, 30)
+    rho = sc.densityMatrix(A @ A.T, -0.2)
+    sigma = sc.densityMatrix(B @ B.T, -0.2)
+    M = (rho + sigma) / 2.0
+    expected = (sc.KLdivergence(rho, M) + sc.KLdivergence(sigma, M)) / 2.0
+    assert np.isclose(sc.JSdivergence(rho, sigma), expected)
+    assert np.allclose(sc.laplacian_spectrum(M),
+                       np.sort(np.linalg.eigvalsh(M)))
+
+
+def test_slq_divergences_match_dense():
+    np.random.seed(14)
+    maxsimps = [[tuple(sorted(np.random.choice(40, np.random.randint(2, 6),
+                                               replace=False)))
+                 for ind in range(80)] for k in range(2)]
+    (EA, EB) = [sc.simplicialChainGroups(m) for m in maxsimps]
+    (LA, LB) = sc.reconcile_laplacians(sc.compute_laplacian(EA, 1, sparse=True),
+                                       sc.compute_laplacian(EB, 1, sparse=True))
+    assert LA.shape[0] > 100
+    # the error includes the Lanczos truncation bias: no extra slack
+    slq_args = dict(tol=2e-2, nsteps=40, ndeflate=10, seed=0, max_probes=60)
+    for beta in [-0.5, 0.5]:
+        rhoA = sc.densityMatrix(LA, beta)
+        rhoB = sc.densityMatrix(LB, beta)
+        for (approx, exact) in [
+                (sc.entropy_slq(LA, beta, **slq_args), sc.Entropy(rhoA)),
+                (sc.KLdivergence_slq(LA, LB, beta, **slq_args),
+                 sc.KLdivergence(rhoA, rhoB)),
+                (sc.JS_lap_slq(LA, LB, beta, **slq_args),
+                 sc.JS_spectra(sc.laplacian_spectrum(LA),
+                               sc.laplacian_spectrum(LB),
+                               sc.laplacian_spectrum((LA + LB) / 2.0),
+                               [beta])[0]),
+                (sc.JSdivergence_slq(LA, LB, beta, **slq_args),
+                 sc.JSdivergence(rhoA, rhoB))]:
+            (value, error) = approx
+            assert 0 < error <= slq_args['tol']
+            assert abs(value - np.real(exact)) < 4*error
+
+    # small operators are decomposed exactly
+    beta = -0.5
+    (value, error) = sc.KLdivergence_slq(LA[:30, :30], LB[:30, :30], beta,
+                                         nsteps=20, ndeflate=10)
+    assert error == 0
+    assert np.isclose(value, sc.KLdivergence(sc.densityMatrix(LA[:30, :30], beta),
+                                             sc.densityMatrix(LB[:30, :30], beta)))
+
+    # a missed tolerance is reported as a warning
+    with pytest.warns(UserWarning, match='above tolerance'):
+        (value, error) = sc.entropy_slq(LA, beta, tol=1e-9, nsteps=20,
+                                        ndeflate=10, seed=0, max_probes=10)
+    assert error > 1e-9
+    # more probes do not help with too few Lanczos steps
+    with pytest.warns(UserWarning, match='raise nsteps'):
+        (value, error) = sc.JS_lap_slq(LA, LB, beta, tol=1e-2, nsteps=6,
+                                       ndeflate=10, seed=0)
+    assert error > 1e-2
@@ -0,0 +1,205 @@
+import numpy as np
+import pytest
+
+pyslsa = pytest.importorskip('pycuslsa')
+
+import neuraltda.spectralAnalysis as sa
+import neuraltda.stimulus_space as ss
+
+
+def random_scgs(ntrials, ncells=8, nwins=30):
+    scgs = []
+    for trial in range(ntrials):
+        binmat = (np.random.rand(ncells, nwins) > 0.6).astype(int)
+        maxsimps = sorted(ss.binarytomaxsimplex(binmat, rDup=True), key=len)
+        scgs.append(pyslsa.build_SCG(maxsimps))
+    return scgs
+
+
+def test_pairwise_divergence_matches_single_calls():
+    np.random.seed(15)
+    scgs_a = random_scgs(4)
+    scgs_b = random_scgs(3)
+    dims = [1, 2]
+    betas = [-2.0, -0.5]
+    for metric in ['KL', 'JS']:
+        div_func = getattr(pyslsa, metric)
+        for (a, b) in [(scgs_a, scgs_b), (scgs_a, scgs_a)]:
+            divs = sa.pairwise_divergence(a, b, dims, betas, metric,
+                                          njobs=3)
+            assert divs.shape == (len(a), len(b), 2, 2)
+            for i in range(len(a)):
+                for j in range(len(b)):
+                    for l, dim in enumerate(dims):
+                        for k, beta in enumerate(betas):
+                            assert np.isclose(divs[i, j, l, k],
+                                              div_func(a[i], b[j], dim, beta))
+
+
+def test_js_matches_linked_list_chain_groups():
+    # JS pairs the Laplacian bases of the two complexes by index, so it
+    # depends on the chain group order.  Values from the linked list build.
+    pairs = [([(0, 1, 2), (1, 2, 3), (2, 3, 4, 5), (0, 5)],
+              [(0, 1), (1, 2, 3, 4), (3, 4, 5), (0, 2, 5)]),
+             ([(0, 1, 2, 3), (2, 4), (4, 5, 6), (1, 6)],
+              [(0, 3), (1, 2, 5), (2, 3, 4, 6), (0, 1, 4)])]
+    expected = [[[0.016066972881632405, 0.01216782476476744],
+                 [0.1729271348301382, 0.03243139767270384],
+                 [0.196382221640499, 0.0189792038696297]],
+                [[0.13742242562206466, 0.038566325222229136],
+                 [0.2288908127685661, 0.05952490058957823],
+                 [0.32773326585088325, 0.02910975918466506]]]
+    betas = [-1.0, 0.5]
+    for ((a, b), js) in zip(pairs, expected):
+        (scga, scgb) = (pyslsa.build_SCG(a), pyslsa.build_SCG(b))
+        for dim in [0, 1, 2]:
+            assert np.allclose([pyslsa.JS(scga, scgb, dim, beta)
+                                for beta in betas], js[dim],
+                               rtol=1e-10, atol=0)
+            assert np.allclose(pyslsa.JS_betas(scga, scgb, dim, betas),
+                               js[dim], rtol=1e-10, atol=0)
+
+
+def test_divergences_reject_non_scg_arguments():
+    scg = random_scgs(1)[0]
+    for (func, args) in [(pyslsa.KL, ([1, 2], [3], 1, -1.0)),
+                         (pyslsa.JS, (1, 2, 1, -1.0)),
+                         (pyslsa.KL_betas, (None, None, 1, [-1.0])),
+                         (pyslsa.JS_betas, (scg, None, 1, [-1.0]))]:
+        with pytest.raises(TypeError):
+            func(*args)
+
+
+def test_batch_divergences_reject_non_scg_items():
+    scg = random_scgs(1)[0]
+    for func in [pyslsa.KL_batch, pyslsa.JS_batch]:
+        with pytest.raises(TypeError):
+            func([1], [2], 1, [-1.0])
+        with pytest.raises(TypeError):
+            func([scg, scg], [scg, None], 1, [-1.0])
+
+
+def test_batch_divergences_match_pairwise_calls():
+    np.random.seed(16)
+    scgs = random_scgs(6)
+    scgs1 = [scgs[i % 6] for i in range(10)]
+    scgs2 = [scgs[(2*i + 1) % 6] for i in range(10)]
+    betas = [-1.0, 0.5]
+    for dim in [1, 2]:
+        assert np.allclose(pyslsa.KL_batch(scgs1, scgs2, dim, betas),
+                           [pyslsa.KL_betas(a, b, dim, betas)
+                            for (a, b) in zip(scgs1, scgs2)])
+        assert np.allclose(pyslsa.JS_batch(scgs1, scgs2, dim, betas),
+                           [pyslsa.JS_betas(a, b, dim, betas)
+                            for (a, b) in zip(scgs1, scgs2)])
+
+
+def test_batch_divergences_accept_iterators():
+    # the SCGs only live as long as the temporary sequence of the iterator
+    np.random.seed(20)
+    blobs = [scg.to_bytes() for scg in random_scgs(8)]
+    betas = [-1.0, -0.5]
+    for func in [pyslsa.KL_batch, pyslsa.JS_batch]:
+        expected = func([pyslsa.SCG.from_bytes(b) for b in blobs],
+                        [pyslsa.SCG.from_bytes(b) for b in blobs[::-1]],
+                        1, betas)
+        for rep in range(5):
+            divs = func((pyslsa.SCG.from_bytes(b) for b in blobs),
+                        (pyslsa.SCG.from_bytes(b) for b in blobs[::-1]),
+                        1, betas)
+            assert np.allclose(divs, expected)
+
+
+def test_scg_pickle_and_store_round_trip(tmpdir):
+    import os
+    import pickle
+    import h5py
+    import neuraltda.topology2 as tp2
+    np.random.seed(17)
+    for scg in random_scgs(3):
+        scg2 = pickle.loads(pickle.dumps(scg))
+        assert scg2.to_bytes() == scg.to_bytes()
+        for dim in [0, 1, 2]:
+            assert scg2.spectrum(dim) == scg.spectrum(dim)
+        assert pyslsa.KL(scg, scg2, 1, 1.0) == 0.0
+    with pytest.raises(ValueError):
+        pyslsa.SCG.from_bytes(scg.to_bytes()[:-4])
+
+    block_path = str(tmpdir)
+    binned_f = os.path.join(block_path, 'test.binned')
+    with h5py.File(binned_f, 'w') as bdf:
+        for stim in ['a', 'b']:
+            poptens = np.random.poisson(1.0, (8, 30, 3)).astype(float)
+            tp2.write_population_tensor(bdf.create_group(stim), poptens,
+                                        np.arange(8), 24000.0, 10.0)
+    computed = sa.pyslsa_compute_chain_groups_binned(block_path, binned_f,
+                                                      1.0, max_dim=3)
+    scgf = sa.scg_store_path(block_path, binned_f, 1.0, max_dim=3)
+    assert os.path.exists(scgf)
+    assert scgf != sa.scg_store_path(block_path, binned_f, 1.0)
+    assert scgf != sa.scg_store_path(block_path, binned_f, 1.0,
+                                     clusters=range(4), max_dim=3)
+    loaded = sa.pyslsa_compute_chain_groups_binned(block_path, binned_f,
+                                                    1.0, max_dim=3)
+    assert sorted(loaded) == ['a', 'b']
+    for stim in computed:
+        assert [s.to_bytes() for s in loaded[stim]] == \
+            [s.to_bytes() for s in computed[stim]]
+    params = sa.scg_store_params(binned_f, 1.0, max_dim=2)
+    assert not sa.scg_store_valid(scgf, params)
+
+
+def test_union_many_matches_joint_build():
+    np.random.seed(18)
+    maxsimps = []
+    scgs = []
+    for trial in range(20):
+        binmat = (np.random.rand(10, 20) > 0.6).astype(int)
+        trial_simps = sorted(ss.binarytomaxsimplex(binmat, rDup=True), key=len)
+        maxsimps.extend(trial_simps)
+        scgs.append(pyslsa.build_SCG(trial_simps))
+    union = pyslsa.union_many(scgs)
+    joint = pyslsa.build_SCG(maxsimps)
+    for dim in range(4):
+        assert np.allclose(union.spectrum(dim), joint.spectrum(dim))
+    assert union.to_bytes() == pyslsa.union_many([union, scgs[3]]).to_bytes()
+    assert pyslsa.union_many([]).spectrum(0) == [0.0]
+    with pytest.raises(TypeError):
+        pyslsa.union_many([union, 1])
+
+
+def test_sparse_boundary_gives_laplacian_spectrum():
+    import scipy.sparse as sp
+    np.random.seed(19)
+
+    def boundary(scg, dim):
+        (rows, cols, vals, shape) = scg.boundary(dim)
+        return sp.coo_matrix((vals, (rows, cols)), shape=shape).tocsr()
+
+    for scg in random_scgs(3, ncells=9):
+        for dim in [1, 2]:
+            (rows, cols, vals, shape) = scg.boundary(dim)
+            assert len(vals) == (dim + 1) * shape[1]
+            assert abs(boundary(scg, dim).dot(boundary(scg, dim+1))).sum() == 0
+            down = boundary(scg, dim)
+            up = boundary(scg, dim+1)
+            lap = (down.T.dot(down) + up.dot(up.T)).toarray()
+            assert np.allclose(np.linalg.eigvalsh(lap), scg.spectrum(dim))
+        assert scg.boundary(0)[3] == (0, len(scg.spectrum(0)))
+
+
+def test_compute_entropy_matches_density_matrix():
+    import neuraltda.simpComp as sc
+    np.random.seed(21)
+    maxsimps = [tuple(sorted(np.random.choice(15, np.random.randint(2, 5),
+                                              replace=False)))
+                for ind in range(12)]
+    E = sc.simplicialChainGroups(maxsimps)
+    for dim in [0, 1]:
+        L = sc.compute_laplacian(E, dim)
+        for beta in [-1.0, 0.5]:
+            expected = np.real(sc.Entropy(sc.densityMatrix(L, beta)))
+            assert np.isclose(sa.compute_entropy(E, dim, beta), expected)
+            (ent, error) = sa.compute_entropy(E, dim, beta, return_error=True)
+            assert np.isclose(ent, expected)
+            assert error == 0.0
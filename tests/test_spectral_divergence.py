@@ -0,0 +1,42 @@
+import numpy as np
+
+import neuraltda.simpComp as sc
+import neuraltda.spectral_divergence as sd
+
+
+def random_laplacians(seed):
+    np.random.seed(seed)
+    maxsimps = [[tuple(sorted(np.random.choice(15, np.random.randint(2, 5),
+                                               replace=False)))
+                 for ind in range(12)] for rep in range(2)]
+    LA = sc.compute_laplacian(sc.simplicialChainGroups(maxsimps[0]), 1)
+    LB = sc.compute_laplacian(sc.simplicialChainGroups(maxsimps[1]), 1)
+    return sc.reconcile_laplacians(LA, LB)
+
+
+def test_spectral_divergences_match_density_matrices():
+    betas = [-0.1, -0.5, -1.0, -2.0]
+    for seed in range(3):
+        (LA, LB) = random_laplacians(seed)
+        js = sd.JS_laplacians(LA, LB, betas)
+        kl = sd.KL_laplacians(LA, LB, betas)
+        bdd = sd.JS_BDD_laplacians(LA, LB, betas)
+        ent = sd.entropy_laplacian(LA, betas)
+        for (k, beta) in enumerate(betas):
+            rho = sc.densityMatrix(LA, beta)
+            sigma = sc.densityMatrix(LB, beta)
+            assert np.isclose(js[k], sc.JSdivergence(rho, sigma), atol=1e-10)
+            assert np.isclose(kl[k], sc.KLdivergence(rho, sigma), atol=1e-10)
+            assert np.isclose(bdd[k], sc.JSdivergence_BDD(rho, sigma),
+                              atol=1e-10)
+            assert np.isclose(ent[k], sc.Entropy(rho), atol=1e-10)
+        assert np.isclose(sd.JS_laplacians(LA, LB, betas[1]), js[1])
+
+
+def test_large_negative_beta_is_finite():
+    (LA, LB) = random_laplacians(5)
+    for beta in [-100.0, -1000.0]:
+        assert np.isfinite(sd.JS_laplacians(LA, LB, beta))
+        assert np.isfinite(sd.JS_BDD_laplacians(LA, LB, beta))
+        assert np.isfinite(sd.entropy_laplacian(LA, beta))
+        assert np.isclose(sd.JS_laplacians(LA, LA, beta), 0.0, atol=1e-12)